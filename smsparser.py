@@ -45,7 +45,47 @@
 ########################################################################
 
 import sys
+import os
 import re
+import zlib
+import shutil
+import struct
+import hashlib
+import base64
+import unicodedata
+import math
+import random
+import calendar
+import datetime
+import time
+import bisect
+import itertools
+import collections
+import json
+import csv
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+import multiprocessing
+from cStringIO import StringIO
+from multiprocessing.pool import ThreadPool
+from array import array
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    import numpy
+except ImportError:
+    numpy = None # Optional, only used to speed up some scans
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None # Optional, only used to store results on disk
 
 
 # ------------------------------------------------------
@@ -114,173 +154,187 @@ def nibble_to_str(nibble_string, number=True):
     None or string
     """
     
-    res = ""
-    seen_non_decimal = False
-    digits = ["0","1","2","3","4","5","6","7","8","9"]
-    for byte in nibble_string:
+    return nibbles_at(bytearray(nibble_string), 0, len(nibble_string), number)
+
+NIBBLE_DIGITS = [str(n) for n in range(16)]
+def nibbles_at(img, ind, length, number=True):
+    """
+    Description
+    -----------
+    Same as nibble_to_str() for the 'length' bytes at img[ind], without
+    copying them. 'img' must give integers when indexed (bytearray)
+    
+    Return
+    ------
+    None or string
+    """
+    
+    digits = []
+    for pos in range(ind, ind+length):
+        byte = img[pos]
         # Low 4 bits 
-        low = str(ord(byte) & 0x0f )
+        low = byte & 0x0f
         # High 4 bits
-        high = str(ord(byte) >> 4)
+        high = byte >> 4
         if( number ):
             # If we want to convert a number
             # Check for non decimal chars
-            if( seen_non_decimal ):
-                return None
-            if( not low in digits ):
+            if( low > 9 ):
                 return None
+            digits.append(NIBBLE_DIGITS[low])
+            if( high > 9 ):
+                if( pos != ind+length-1 ):
+                    return None
             else:
-                res += low
-            if( not high in digits ):
-                seen_non_decimal = True
-            else:
-                res += high
+                digits.append(NIBBLE_DIGITS[high])
         else:
-            res += low
-            res += high
-        
-    return res 
+            digits.append(NIBBLE_DIGITS[low])
+            digits.append(NIBBLE_DIGITS[high])
+    return "".join(digits)
+
+class LRUCache:
+    """
+    Description
+    -----------
+    A dictionary that keeps at most 'size' items. When it is full, the
+    least recently used item is removed
+    """
+    def __init__(self, size):
+        self.size = size
+        self.items = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self.items.pop(key)
+        except KeyError:
+            return default
+        self.items[key] = value
+        return value
+
+    def put(self, key, value):
+        self.items.pop(key, None)
+        self.items[key] = value
+        if( len(self.items) > self.size ):
+            self.items.popitem(last=False)
+
+# Timestamps are decoded once per distinct 7-byte value: the same
+# SCTS shows up in every copy of a SMS
+SCTS_CACHE_SIZE = 65536
+scts_cache = LRUCache(SCTS_CACHE_SIZE)
+MAX_TZ_QUARTERS = 14*4 # Time zones go from UTC-12 to UTC+14
+
+def bcd_to_int(byte):
+    """
+    Description
+    -----------
+    Decodes a swapped BCD byte (ex: 0x81 -> 18)
+    Returns None if one of the nibbles is not a decimal digit
+    """
+    low = byte & 0x0f
+    high = byte >> 4
+    if( low > 9 or high > 9 ):
+        return None
+    return low*10+high
+
+def decode_scts(string):
+    """
+    Description
+    -----------
+    Decodes a SCTS (or an absolute TP-VP) and checks that the date
+    is valid. Results are memoized in 'scts_cache'
+
+    Parameters
+    ----------
+    string : string of bytes, length should be 7
+
+    Return
+    ------
+    (UTC timestamp in seconds, time zone offset in minutes)
+    or None if the date is invalid
+    """
+    string = str(string[:7])
+    res = scts_cache.get(string, False)
+    if( res is not False ):
+        return res
+    res = None
+    if( len(string) == 7 ):
+        fields = [bcd_to_int(ord(c)) for c in string[:6]]
+        tz = ord(string[6])
+        quarters = bcd_to_int(tz & 0b11110111)
+        if( not None in fields and quarters is not None and quarters <= MAX_TZ_QUARTERS ):
+            year, month, day, hour, minutes, seconds = fields
+            if( year > 50 ):
+                year += 1900
+            else:
+                year += 2000
+            if( 1 <= month <= 12 and 1 <= day <= calendar.monthrange(year, month)[1]\
+                and hour <= 23 and minutes <= 59 and seconds <= 59 ):
+                offset = quarters*15
+                if( tz & 0b00001000 ):
+                    offset = -offset
+                epoch = calendar.timegm((year, month, day, hour, minutes, seconds))
+                res = (epoch-offset*60, offset)
+    scts_cache.put(string, res)
+    return res
+
+def epoch_to_datetime(epoch):
+    return datetime.datetime(1970, 1, 1)+datetime.timedelta(seconds=epoch)
+
+def format_date(epoch, offset):
+    """
+    Description
+    -----------
+    Formats a timestamp in the local time of the SMS
+    Ex: "01/05/2018 04:30:15 (UTC+02)"
+    """
+    date = epoch_to_datetime(epoch+offset*60).strftime("%d/%m/%Y %H:%M:%S")
+    if( offset < 0 ):
+        sign = "-"
+    else:
+        sign = "+"
+    zone = "{0:02d}".format(abs(offset)/60)
+    if( abs(offset)%60 ):
+        zone += ":{0:02d}".format(abs(offset)%60)
+    return date+" (UTC"+sign+zone+")"
+
+def format_date_utc(epoch):
+    """
+    Description
+    -----------
+    Formats a timestamp in UTC+00. Ex: "01-05-18 02:30:15"
+    """
+    return epoch_to_datetime(epoch).strftime("%d-%m-%y %H:%M:%S")
 
 def str_to_date(string, check=True):
     """
     Description
     -----------
     Takes a PDU string and decodes it into a date string
-    If check=True the function also checks if the date is valid
-    (if the date isn't valid it returns None) 
-    
+    The date is always checked, 'check' is only kept for compatibility
+
     Parameters
     ----------
     string : string of bytes, length should be 7
     check : bool
-    
+
     Return
     ------
     returns  - a date in string format
-             - or None 
+             - or None
     """
-    try:
-        day = nibble_to_str(string[2])      # Day
-        month = nibble_to_str(string[1])    # Month
-        year = nibble_to_str(string[0])     # Year
-        if( int(year) > 50 ):
-            year = "19"+year
-        else:
-            year = "20"+year 
-        hour = nibble_to_str(string[3])     # Hours
-        minutes = nibble_to_str(string[4])  # Minutes
-        seconds = nibble_to_str(string[5])  # Seconds
-        if( (ord(string[6]) & 0b00001000) >> 3 == 1 ):
-            sign = "-"
-        else:
-            sign="+"
-        zone = "{0:02x}".format(int("{0:02x}".format((ord(string[6]) & 0b11110111))[::-1],16)/4)
-
-        # Build date string 
-        date = ''
-        date += day
-        date += '/'+month
-        date += '/'+year
-        date += ' '+hour
-        date += ':'+minutes
-        date += ':'+seconds
-        date += ' (UTC'+sign+zone+")"
-        
-        if( not check):
-            return date
-        else:
-            wrong = (int(day) > 31) or (int(month) > 12) or (int(hour) > 23)\
-                or (int(minutes) > 59) or (int(seconds) > 59) or (int(zone) > 24)\
-                or(int(day) < 1) or (int(month) < 1) or (int(hour) < 0)\
-                or (int(minutes) < 0) or (int(seconds) < 0) or (int(zone) < 0) 
-            if( wrong ):
-                return None
-            else:
-                return date
-        
-    except Exception as e:
+    ts = decode_scts(string)
+    if( not ts ):
         return None
- 
+    return format_date(*ts)
+
 def str_to_date_utc(string, check=True):
-    try:
-        day = int(nibble_to_str(string[2]))      # Day
-        month = int(nibble_to_str(string[1]))    # Month
-        year = int(nibble_to_str(string[0]))     # Year
-        hour = int(nibble_to_str(string[3]) )    # Hours
-        minutes = int(nibble_to_str(string[4]))  # Minutes
-        seconds = int(nibble_to_str(string[5]) ) # Seconds
-        if( (ord(string[6]) & 0b00001000) >> 3 == 1 ):
-            sign = -1
-        else:
-            sign= 1
-        zone = sign*int("{0:02x}".format((ord(string[6]) & 0b11110111))[::-1],16)/4
-        
-        # Adjusting time 
-        hour -= zone
-        if( hour < 0 ):
-            hour = 24-hour
-            day -= 1
-            if( day < 1 ):
-                if( month in [5,7, 10, 12] ):
-                    day = 30
-                    month -= 1
-                elif( month in [2, 4,6,8,9,11] ):
-                    day = 31
-                    month -=1
-                elif( month == 3 ):
-                    if( year%400 == 0 or (year%4 == 0 and year%100 != 0)):
-                        day = 29
-                    else:
-                        day = 28
-                    month = 2
-                elif( month == 1 ):
-                    day = 31
-                    month = 12
-                    year -= 1
-        elif( hour > 23 ):
-            hour -= 24
-            day += 1
-            if( month in [1,3, 5, 7, 8, 10, 12] ):
-                if( day > 31 ):
-                    day -= 31
-                    month += 1 % 12
-            elif( month in [4,6,9,11] ):
-                if( day > 31 ):
-                    day -= 30
-                    month += 1
-            elif( month == 2 ):
-                if( year%400 == 0 or (year%4 == 0 and year%100 != 0)):
-                    limit = 29
-                else:
-                    limit = 28
-                if( day > limit ):
-                    month = 3
-                    day = day - limit
-                
-                
-        # Build date string 
-        date = ''
-        date += "{0:02d}".format(day)
-        date += '-'+"{0:02d}".format(month)
-        date += '-'+"{0:02d}".format(year)
-        date += ' '+"{0:02d}".format(hour)
-        date += ':'+"{0:02d}".format(minutes)
-        date += ':'+"{0:02d}".format(seconds)
-        
-        if( not check):
-            return date
-        else:
-            wrong = (int(day) > 31) or (int(month) > 12) or (int(hour) > 23)\
-                or (int(minutes) > 59) or (int(seconds) > 59)\
-                or(int(day) < 1) or (int(month) < 1) or (int(hour) < 0)\
-                or (int(minutes) < 0) or (int(seconds) < 0) 
-            if( wrong ):
-                return None
-            else:
-                return date
-        
-    except:
+    """
+    Same as str_to_date() but the date is given in UTC+00
+    """
+    ts = decode_scts(string)
+    if( not ts ):
         return None
+    return format_date_utc(ts[0])
 
 # GSM7 format decoding 
 # From https://stackoverflow.com/questions/13130935/decode-7-bit-gsm
@@ -301,7 +355,11 @@ def charging_bar( nb_iter, curr_iter, bar_len, msg="", char=u"\u2588", end_msg='
     Print a charging bar 
     """
     global last_percent
-    percent = (100*curr_iter)/nb_iter
+    job = active_job()
+    if( job ):
+        # Background scans show their progress with scan-status
+        job.progress = (curr_iter, nb_iter, msg)
+        return
     if( curr_iter == nb_iter ):
         bar = '\r\t% '
         bar += str(msg)
@@ -312,472 +370,4330 @@ def charging_bar( nb_iter, curr_iter, bar_len, msg="", char=u"\u2588", end_msg='
         bar += '\n'
         sys.stdout.write(bar)
         last_percent = -1
-    elif( last_percent != percent):
-        last_percent = percent
+    elif( last_percent != (100*curr_iter)/nb_iter ):
+        last_percent = (100*curr_iter)/nb_iter
         bar = '\r\t% '
         bar += str(msg)
         bar += ' |'
-        full_part = char * (curr_iter/(nb_iter/bar_len))
+        full_part = char * ((bar_len*curr_iter)/nb_iter)
         empty_part = " "*(bar_len-len(full_part))
         bar += full_part + empty_part + '| '
         bar += '{:03d}%'.format(100*curr_iter/nb_iter)
         sys.stdout.write(bar)
     sys.stdout.flush()
 
-###############
-# SMS classes #
-###############
+#################
+# Binary images #
+#################
 
-# Types of SMS
-class SMSType:
-    SMS_PDU = 1
-    SMS_OTHER = 99
+# The scan engine can read an image by windows of SCAN_WINDOW bytes.
+# Two consecutive windows overlap by MAX_PDU_LEN bytes so that a SMS
+# starting near the end of a window can still be entirely parsed
+SCAN_WINDOW = 16*1024*1024
+MAX_PDU_LEN = 281 # Submit: header+MR+address(14)+PI/DCS+VP(7)+UDL+UD(255)
 
-def new_sms(sms_type):
+# Compressed images
+COMPRESSED_BLOCK = 1024*1024 # Compressed bytes read at once
+DECOMPRESSED_BLOCK = 4*1024*1024 # Max bytes decompressed at once (gzip)
+SEEK_POINT_SPAN = 64*1024*1024 # Uncompressed bytes between seek points
+
+COMPRESSION_MAGICS = [\
+    ("gzip", "\x1f\x8b"),\
+    ("xz", "\xfd7zXZ\x00"),\
+    ("zstd", "\x28\xb5\x2f\xfd")]
+
+def compression_format(filename):
     """
-    Return an instance of the right class according to the 
-    requested SMS type. 
+    Description
+    -----------
+    Detects if a file is compressed by looking at its magic number
+
+    Return
+    ------
+    "gzip", "xz", "zstd" or None if the file is a raw image
     """
-    if( sms_type == SMSType.SMS_PDU ):
-        return SMSPDU()
-    elif(sms_type == SMS_OTHER):
-        return SMSGeneric()
-    else:
-        raise Exception("Unknown sms_type in sms() function")
+    f = open(filename, "rb")
+    magic = f.read(6)
+    f.close()
+    for fmt, m in COMPRESSION_MAGICS:
+        if( magic.startswith(m) ):
+            return fmt
+    return None
 
-class SMSGeneric:
-    def __init__(self):
-        # Common fields for SMS
-        self.bin_offset = None # Offset in the binary  
-        self.src = None # Source number
-        self.dst = None # Destination number 
-        self.msg = None # Message body 
-        self.sms_date = None # SMS date in human readable format
-        self.date_utc_00 = None    # Date in UTC + 0
-        self.sms_status = None # (Received / Sent)
+def new_decompressor(fmt):
+    """
+    Description
+    -----------
+    Returns a streaming decompressor for the given format, or None
+    if the package needed to decompress it is missing
+    """
+    if( fmt == "gzip" ):
+        return zlib.decompressobj(16+zlib.MAX_WBITS)
+    elif( fmt == "xz" ):
+        try:
+            import lzma
+        except ImportError:
+            try:
+                from backports import lzma
+            except ImportError:
+                return None
+        return lzma.LZMADecompressor()
+    elif( fmt == "zstd" ):
+        try:
+            import zstandard
+        except ImportError:
+            return None
+        return zstandard.ZstdDecompressor().decompressobj()
+    return None
 
-    def date(self):
+class CompressedImage:
+    """
+    Description
+    -----------
+    A compressed binary image (gzip, xz or zstd). The image is never
+    decompressed entirely: it is decompressed on the fly and read by
+    windows, so the memory used stays bounded. All the offsets are
+    offsets in the uncompressed image.
+    While the image is decompressed, seek points are recorded every
+    SEEK_POINT_SPAN bytes so that read() does not have to decompress
+    the image from the start. Only gzip decompressors can be copied,
+    so xz and zstd images are always read from the start.
+    """
+    def __init__(self, filename, fmt):
+        self.filename = filename
+        self.fmt = fmt
+        self.compressed_size = os.path.getsize(filename)
+        self.consumed = 0 # Compressed bytes consumed by the last stream
+        self.size = None # Uncompressed size, known after a full pass
+        # Seek points: (uncompressed offset, compressed offset, decompressor)
+        self.seek_points = [(0, 0, None)]
+
+    def chunks(self, start=0):
         """
         Description
         -----------
-        Returns the date in readable format
-        """
-        if( self.sms_date ):
-            return self.sms_date
-        return "Unknown"
-    
-    def date_utc(self):
-        if( self.date_utc ):
-            return self.date_utc_00
-        return "Unknown"
-
-    def source(self):
-        if( self.src ):
-            return self.src
-        return "Unknown"
-        
-    def dest(self):
-        if( self.dst ):
-            return self.dst
-        return "Unknown"
+        Decompresses the image starting from the last seek point
+        before 'start'
 
-    def status(self):
-        if( self.sms_status ):
-            return self.sms_status
+        Return
+        ------
+        A generator of (offset, data), 'offset' being the position of
+        'data' in the uncompressed image
+        """
+        offset, pos, d = [p for p in self.seek_points if p[0] <= start][-1]
+        if( d ):
+            d = d.copy()
         else:
-            return "Unknown"
-            
-    def offset(self):
-        return self.bin_offset
-        
-    def message(self):
-        if( self.msg ):
-            return self.msg
-        return ''
-    
-    def excel_output(self):
-        def remove_control_chars(s):
-            illegal_chars_re = re.compile(r'[\000-\010]|[\013-\014]|[\016-\037]')
-            res = ""
-            for i in range(0,len(s)):
-                if( next(illegal_chars_re.finditer(s[i]), None )):
-                    res += " "
+            d = new_decompressor(self.fmt)
+        f = open(self.filename, "rb")
+        f.seek(pos)
+        tail = ""
+        try:
+            while True:
+                if( not tail ):
+                    tail = f.read(COMPRESSED_BLOCK)
+                if( not tail ):
+                    # End of file, get what zlib still holds
+                    if( self.fmt == "gzip" ):
+                        data = d.flush()
+                        if( data ):
+                            yield (offset, data)
+                            offset += len(data)
+                    break
+                if( self.fmt == "gzip" ):
+                    data = d.decompress(tail, DECOMPRESSED_BLOCK)
+                    tail = d.unconsumed_tail
+                    if( d.unused_data ):
+                        # End of a gzip member, another one follows
+                        tail = d.unused_data
+                        d = new_decompressor(self.fmt)
                 else:
-                    res += s[i]
-            return res
-        output = []
-        # Offset
-        output.append(hex(self.offset()))
-        # Status
-        output.append(self.status())
-        # Number
-        if( self.status == "Received" ):
-            output.append(self.source())
-        elif( self.status == "Sent" ):
-            output.append(self.dest())
-        elif( self.src ):
-            output.append(self.source())
-        elif( self.dst ):
-            output.append(self.dest())
-        else:
-            output.append("Unknown")
-        # Data
-        output.append(remove_control_chars(self.message()))
-        # Date
-        output.append(self.date())
-        output.append(self.date_utc())
-        return output
-    
-class SMSPDU(SMSGeneric):
-    def __init__(self):
-        SMSGeneric.__init__(self)
-        # TPDU fields 
-        self.tp_header = None  # First octet of the sms
-        self.tp_mr = None      # Message Reference 
-        self.tp_da = None      # Destination address
-        self.tp_oa = None      # Originating Address 
-        self.tp_pi = None      # Protocol Identifier 
-        self.tp_dcs = None     # Data Coding Scheme
-        self.tp_scts = None    # Service Center Time Stamp 
-        self.tp_vp = None      # Validity Period 
-        self.tp_udl = None     # User Data Length 
-        self.tp_ud = None      # User Data 
-            
-        self.addr_len = None   # Address length for the oa/da fields 
+                    data = d.decompress(tail)
+                    tail = ""
+                    if( getattr(d, "eof", False) and getattr(d, "unused_data", "") ):
+                        # End of a xz/zstd stream, another one follows
+                        tail = d.unused_data
+                        d = new_decompressor(self.fmt)
+                self.consumed = f.tell()-len(tail)
+                if( not data ):
+                    continue
+                yield (offset, data)
+                offset += len(data)
+                if( self.fmt == "gzip" and \
+                    offset >= self.seek_points[-1][0] + SEEK_POINT_SPAN ):
+                    self.seek_points.append((offset, self.consumed, d.copy()))
+            self.size = offset
+        finally:
+            f.close()
 
-    # Direct access functions
-    def header(self):
-        return self.tp_header
-    def mr(self):
-        return self.tp_mr
-    def da(self):
-        return self.tp_da
-    def oa(self):
-        return self.tp_oa
-    def pi(self):
-        return self.tp_pi
-    def dcs(self):
-        return self.tp_dcs
-    def scts(self):
-        return self.tp_scts
-    def vp(self):
-        return self.tp_vp
-    def udl(self):
-        return self.tp_udl
-    def ud(self):
-        return self.tp_ud
-    def offset(self):
-        return self.bin_offset
-    
-    # Fine-grain access functions 
-    def mti(self):
+    def windows(self, start=0, size=None, overlap=MAX_PDU_LEN):
         """
         Description
         -----------
-        Returns bits 0 and 1 of the header
-        They give the type of PDU message
+        Reads the uncompressed image by overlapping windows
+
+        Return
+        ------
+        A generator of (base, window, scan_len): 'window' is a bytearray
+        holding the bytes of the image starting at offset 'base'. Only the first
+        'scan_len' offsets of the window have to be scanned, the
+        following bytes are also the beginning of the next window
         """
-        return self.header() & 0b00000011
+        if( not size ):
+            size = SCAN_WINDOW
+        buf = []
+        buf_len = 0
+        base = start
+        for offset, data in self.chunks(start):
+            if( offset+len(data) <= start ):
+                continue
+            if( offset < start ):
+                data = data[start-offset:]
+            buf.append(data)
+            buf_len += len(data)
+            if( buf_len >= size+overlap ):
+                window = "".join(buf)
+                while( len(window) >= size+overlap ):
+                    yield (base, bytearray(window[:size+overlap]), size)
+                    window = window[size:]
+                    base += size
+                buf = [window]
+                buf_len = len(window)
+        window = "".join(buf)
+        if( window ):
+            yield (base, bytearray(window), len(window))
 
-    def vpf(self):
+    def uncompressed_size(self):
+        """
+        Size of the uncompressed image, decompressed once if it is not
+        known yet
+        """
+        if( self.size is None ):
+            for offset, data in self.chunks(self.seek_points[-1][0]):
+                pass
+        return self.size
+
+    def read_blocks(self, blocks):
         """
         Description
         -----------
-        Returns bits 3 and 4 of the header
-        They give the format of the Validity Period field 
+        Reads (offset, length) blocks sorted by offset, decompressing the
+        image only once
+
+        Return
+        ------
+        A generator of strings, one per block
         """
-        return (self.header() & 0b00011000 ) >> 3
-        
-    def data_format(self):
+        if( not blocks ):
+            return
+        chunks = self.chunks(blocks[0][0])
+        buf = ""
+        pos = blocks[0][0] # Offset of buf[0] in the image
+        for offset, length in blocks:
+            # Only the bytes from 'offset' are kept in 'buf'
+            while( pos+len(buf) < offset+length ):
+                chunk = next(chunks, None)
+                if( chunk is None ):
+                    break
+                if( chunk[0] < pos ):
+                    buf = chunk[1][pos-chunk[0]:]
+                else:
+                    buf += chunk[1]
+                if( pos < offset ):
+                    cut = min(offset-pos, len(buf))
+                    buf = buf[cut:]
+                    pos += cut
+            if( pos < offset ):
+                cut = min(offset-pos, len(buf))
+                buf = buf[cut:]
+                pos += cut
+            yield buf[offset-pos:offset-pos+length] if pos == offset else ""
+
+    def read(self, offset, length):
         """
         Description
         -----------
-        Returns the 4 least significant bytes of the DCS field
-        They give the encoding for the user data 
+        Returns 'length' bytes of the uncompressed image from 'offset'
         """
-        return self.dcs() & 0x0f
-            
-    
-####################
-# Parser class   ###
-####################
+        res = []
+        res_len = 0
+        for pos, data in self.chunks(offset):
+            if( pos+len(data) <= offset ):
+                continue
+            data = data[max(0, offset-pos):]
+            res.append(data)
+            res_len += len(data)
+            if( res_len >= length ):
+                break
+        return "".join(res)[:length]
 
-global_parser_refs = []
+def image_read(img, offset, length):
+    """
+    Description
+    -----------
+    Returns 'length' bytes from 'offset' in a raw or compressed image
+    """
+    if( isinstance(img, CompressedImage) ):
+        return img.read(offset, length)
+    return img[offset:offset+length]
+
+###############
+# Scan ranges #
+###############
+
+# Constant-fill regions (erased flash pages, zeroed areas) are detected
+# page by page and removed from the scanned offsets
+PAGE_SIZE = 4096
+MIN_PDU_LEN = 7 # Submit: header+MR+address(2)+PI/DCS+UDL
+
+# High-entropy blocks (encrypted partitions, compressed data) are scanned
+# after the other blocks, or skipped if the user accepts to miss the SMS
+# stored in blocks that look random
+ENTROPY_BLOCK = 4096
+ENTROPY_BATCH = 256 # Blocks processed at once with numpy
+ENTROPY_SCALE = 31 # Entropies are stored as int(entropy*ENTROPY_SCALE)
+ENTROPY_UNKNOWN = 255
+
+# Options of the scan engine, changed with the 'set' command
+scan_options = {
+    "skip-fill": True, # Do not scan constant-fill pages
+    "entropy-mode": "last", # last | skip | off (skip may miss SMS in random-looking blocks)
+    "entropy-threshold": 7.93, # Bits per byte, 4KB of random data is ~7.95
+    "text-index": False, # Build the full-text index while scanning
+    "resolve-overlaps": False, # Keep only the best of overlapping hits
+    "bigram-threshold": 0.5, # Min language score of the PDU-language filter
+    "result-store": "memory", # memory | disk (SQLite file 'store-file')
+    "store-file": "sms-results.db",
+    "checkpoint-interval": 300, # Seconds between two saves of a scan (0: no saves)
+    "checkpoint-file": "sms-scan.ckpt",
+    "watchlist-bloom": "auto", # auto | on | off, Bloom filter in front of the watch-list
+    "scts-years": "", # YYYY-YYYY, years of the SMS found by the SCTS-anchored parser
+    "scan-workers": 1, # Processes scanning the regions of a raw image in parallel
+    "background-scan": False, # parser-run returns at once, see scan-status
+    "scan-order": "offset", # offset | density (densest strata of the triage first)
+}
+scan_option_choices = {
+    "entropy-mode": ["skip", "last", "off"],
+    "scan-order": ["offset", "density"],
+    "result-store": ["memory", "disk"],
+    "watchlist-bloom": ["auto", "on", "off"],
+}
+
+# Bytes skipped by the last scan, by fill byte value
+fill_report = {}
+# Entropy of each ENTROPY_BLOCK block of the last scanned image
+entropy_map = array('B')
+# Bytes of high-entropy blocks skipped or postponed by the last scan
+entropy_report = [0]
+
+def constant_pages(img, start, end):
+    """
+    Description
+    -----------
+    Finds the pages of img[start:end] that are filled with a single
+    byte value. Pages are aligned on PAGE_SIZE in 'img'
+
+    Return
+    ------
+    A list of (page offset, fill byte)
+    """
+    first = ((start+PAGE_SIZE-1)/PAGE_SIZE)*PAGE_SIZE
+    nb_pages = (end-first)/PAGE_SIZE
+    if( nb_pages <= 0 ):
+        return []
+    if( numpy is not None ):
+        pages = numpy.frombuffer(img, dtype=numpy.uint8, count=nb_pages*PAGE_SIZE,\
+            offset=first).reshape(nb_pages, PAGE_SIZE)
+        low = pages.min(axis=1)
+        high = pages.max(axis=1)
+        return [(first+int(p)*PAGE_SIZE, int(low[p])) for p in numpy.nonzero(low == high)[0]]
+    res = []
+    for p in range(first, first+nb_pages*PAGE_SIZE, PAGE_SIZE):
+        if( img.count(img[p:p+1], p, p+PAGE_SIZE) == PAGE_SIZE ):
+            res.append((p, img[p]))
+    return res
+
+def fill_free_ranges(img, start, end):
+    """
+    Description
+    -----------
+    Removes the constant-fill runs from the range [start, end[ of 'img'
+    and counts the skipped bytes in 'fill_report'. The last MIN_PDU_LEN
+    bytes of a run are kept: a SMS could start there, unless the fill
+    goes on for MIN_PDU_LEN bytes after the run. This lookahead is
+    shorter than the overlap of the windows of a compressed image, so
+    the skipped bytes do not depend on how the image is read.
+
+    Return
+    ------
+    A list of (start, end) ranges to scan
+    """
+    global fill_report
+    runs = []
+    for page, fill in constant_pages(img, start, end):
+        if( runs and runs[-1][1] == page and runs[-1][2] == fill ):
+            runs[-1][1] += PAGE_SIZE
+        else:
+            runs.append([page, page+PAGE_SIZE, fill])
+    ranges = []
+    pos = start
+    for run_start, run_end, fill in runs:
+        if( run_end-run_start <= MIN_PDU_LEN ):
+            continue
+        if( run_start > pos ):
+            ranges.append((pos, run_start))
+        pos = run_end-MIN_PDU_LEN
+        if( img[run_end:run_end+MIN_PDU_LEN] == bytearray([fill])*MIN_PDU_LEN ):
+            pos = run_end
+        fill_report[fill] = fill_report.get(fill, 0) + pos-run_start
+    if( pos < end ):
+        ranges.append((pos, end))
+    return ranges
+
+def block_entropies(img, start, end):
+    """
+    Description
+    -----------
+    Computes the Shannon entropy (bits per byte) of each ENTROPY_BLOCK
+    block of img[start:end]. The last block can be shorter
+
+    Return
+    ------
+    A list of floats
+    """
+    res = []
+    if( numpy is not None ):
+        data = numpy.frombuffer(img, dtype=numpy.uint8, count=end-start, offset=start)
+        for s in range(0, len(data), ENTROPY_BATCH*ENTROPY_BLOCK):
+            chunk = data[s:s+ENTROPY_BATCH*ENTROPY_BLOCK].astype(numpy.int64)
+            nb_blocks = (len(chunk)+ENTROPY_BLOCK-1)//ENTROPY_BLOCK
+            blocks = numpy.arange(len(chunk))//ENTROPY_BLOCK
+            counts = numpy.bincount(blocks*256+chunk, minlength=nb_blocks*256)
+            counts = counts.reshape(nb_blocks, 256)
+            p = counts/counts.sum(axis=1, keepdims=True).astype(numpy.float64)
+            res += (-(p*numpy.log2(numpy.where(p > 0, p, 1))).sum(axis=1)).tolist()
+        return res
+    for s in range(start, end, ENTROPY_BLOCK):
+        block = img[s:min(s+ENTROPY_BLOCK, end)]
+        h = 0.0
+        for count in collections.Counter(block).values():
+            p = float(count)/len(block)
+            h -= p*math.log(p, 2)
+        res.append(h)
+    return res
+
+def record_entropies(first_block, entropies):
+    """
+    Description
+    -----------
+    Saves block entropies in 'entropy_map', from block number 'first_block'
+    """
+    global entropy_map
+    if( len(entropy_map) < first_block ):
+        entropy_map.extend([ENTROPY_UNKNOWN]*(first_block-len(entropy_map)))
+    entropy_map[first_block:first_block+len(entropies)] = \
+        array('B', [int(h*ENTROPY_SCALE) for h in entropies])
+
+def split_ranges(ranges, holes):
+    """
+    Description
+    -----------
+    Splits sorted ranges with sorted and disjoint holes
+
+    Return
+    ------
+    (parts of the ranges outside the holes, parts inside the holes)
+    """
+    outside = []
+    inside = []
+    j = 0
+    for start, end in ranges:
+        pos = start
+        while( pos < end ):
+            while( j < len(holes) and holes[j][1] <= pos ):
+                j += 1
+            if( j == len(holes) or holes[j][0] >= end ):
+                outside.append((pos, end))
+                break
+            hole_start, hole_end = holes[j]
+            if( hole_start > pos ):
+                outside.append((pos, hole_start))
+                pos = hole_start
+            inside.append((pos, min(end, hole_end)))
+            pos = min(end, hole_end)
+    return outside, inside
+
+def scan_ranges(img, start, end, base=0):
+    """
+    Description
+    -----------
+    Returns the list of (start, end) ranges of 'img' that the parsers
+    have to scan in [start, end[, according to 'scan_options'.
+    'base' is the offset of img[0] in the image. Entropy blocks are
+    aligned on ENTROPY_BLOCK in the image, so when 'start' or 'end'
+    are not, the entropy of the blocks holding them is computed on the
+    whole blocks (as far as 'img' goes)
+    """
+    if( scan_options["skip-fill"] ):
+        ranges = fill_free_ranges(img, start, end)
+    else:
+        ranges = [(start, end)]
+    if( scan_options["entropy-mode"] == "off" ):
+        return ranges
+
+    first = max(0, start-(base+start)%ENTROPY_BLOCK)
+    last = min(len(img), end+(-(base+end))%ENTROPY_BLOCK)
+    entropies = block_entropies(img, first, last)
+    record_entropies((base+first)/ENTROPY_BLOCK, entropies)
+    threshold = float(scan_options["entropy-threshold"])
+    high = []
+    for i in range(0, len(entropies)):
+        if( entropies[i] <= threshold ):
+            continue
+        block_start = max(start, first+i*ENTROPY_BLOCK)
+        block_end = min(first+(i+1)*ENTROPY_BLOCK, end)
+        if( high and high[-1][1] == block_start ):
+            high[-1][1] = block_end
+        else:
+            high.append([block_start, block_end])
+    low_ranges, high_ranges = split_ranges(ranges, high)
+    entropy_report[0] += sum([e-s for s, e in high_ranges])
+    if( scan_options["entropy-mode"] == "last" ):
+        return low_ranges+high_ranges
+    return low_ranges
+
+def human_size(nb_bytes):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if( nb_bytes < 1024 or unit == "GB" ):
+            break
+        nb_bytes /= 1024.0
+    return "{0:.1f} {1}".format(nb_bytes, unit)
+
+def merge_regions(regions):
+    """
+    Description
+    -----------
+    Sorts (start, end) regions and merges the ones that overlap or
+    touch. An end of None is the end of the image
+
+    Return
+    ------
+    A list of disjoint regions
+    """
+    res = []
+    for start, end in sorted(regions, key=lambda r: (r[0], r[1] is None, r[1])):
+        if( res and (res[-1][1] is None or start <= res[-1][1]) ):
+            if( res[-1][1] is not None and (end is None or end > res[-1][1]) ):
+                res[-1] = (res[-1][0], end)
+        else:
+            res.append((start, end))
+    return res
+
+##############
+# Partitions #
+##############
+
+# Partition tables are read at the start of the image: a protective
+# or classic MBR in sector 0, a GPT header in LBA 1 (512 or 4096
+# bytes sectors)
+SECTOR_SIZE = 512
+GPT_SECTOR_SIZES = [512, 4096]
+MBR_EXTENDED_TYPES = [0x05, 0x0f, 0x85]
+MBR_GPT_TYPE = 0xee
+MAX_GPT_ENTRIES = 1024
+MAX_LOGICAL_PARTITIONS = 128
+
+class Partition:
+    """
+    Description
+    -----------
+    A partition of the image: bytes [start, end[. 'name' is the GPT
+    name, or mbr<number> for MBR partitions (logical partitions are
+    numbered from 5)
+    """
+    def __init__(self, name, start, end, kind):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.kind = kind
+
+def gpt_partitions(img):
+    for sector in GPT_SECTOR_SIZES:
+        header = str(image_read(img, sector, 92))
+        if( not header.startswith("EFI PART") or len(header) < 92 ):
+            continue
+        entries_lba, nb_entries, entry_size = struct.unpack("<QII", header[72:88])
+        if( entry_size < 128 or nb_entries > MAX_GPT_ENTRIES ):
+            return []
+        data = str(image_read(img, entries_lba*sector, nb_entries*entry_size))
+        res = []
+        for i in range(0, nb_entries):
+            entry = data[i*entry_size:(i+1)*entry_size]
+            if( len(entry) < 128 or entry[:16] == "\x00"*16 ):
+                continue
+            first, last = struct.unpack("<QQ", entry[32:48])
+            name = entry[56:128].decode("utf-16-le", "replace").split(u"\x00")[0]
+            res.append(Partition(name.encode("utf-8") or "gpt{}".format(i+1),\
+                first*sector, (last+1)*sector, "GPT"))
+        return res
+    return []
+
+def mbr_entry(sector, number):
+    """
+    (type, first LBA, number of sectors) of an entry of a MBR or EBR
+    """
+    entry = sector[446+16*number:446+16*(number+1)]
+    lba, count = struct.unpack("<II", entry[8:16])
+    return ord(entry[4]), lba, count
+
+def mbr_partitions(img):
+    sector = str(image_read(img, 0, SECTOR_SIZE))
+    if( len(sector) < SECTOR_SIZE or sector[510:512] != "\x55\xaa" ):
+        return []
+    res = []
+    logical = []
+    for number in range(0, 4):
+        ptype, lba, count = mbr_entry(sector, number)
+        if( ptype == MBR_GPT_TYPE ):
+            return []
+        if( ptype == 0 or count == 0 ):
+            continue
+        if( ptype not in MBR_EXTENDED_TYPES ):
+            res.append(Partition("mbr{}".format(number+1), lba*SECTOR_SIZE,\
+                (lba+count)*SECTOR_SIZE, "MBR 0x{:02x}".format(ptype)))
+            continue
+        # Logical partitions: a chain of EBR, the first entry of an EBR
+        # is relative to the EBR, the second one (next EBR) to the
+        # extended partition
+        ebr = lba
+        for i in range(0, MAX_LOGICAL_PARTITIONS):
+            ebr_sector = str(image_read(img, ebr*SECTOR_SIZE, SECTOR_SIZE))
+            if( len(ebr_sector) < SECTOR_SIZE or ebr_sector[510:512] != "\x55\xaa" ):
+                break
+            ltype, llba, lcount = mbr_entry(ebr_sector, 0)
+            if( ltype and lcount ):
+                logical.append(Partition("mbr{}".format(5+len(logical)), (ebr+llba)*SECTOR_SIZE,\
+                    (ebr+llba+lcount)*SECTOR_SIZE, "MBR 0x{:02x}".format(ltype)))
+            ntype, nlba, ncount = mbr_entry(ebr_sector, 1)
+            if( ntype not in MBR_EXTENDED_TYPES or not nlba ):
+                break
+            ebr = lba+nlba
+    return res+logical
+
+def find_partitions(img):
+    """
+    Description
+    -----------
+    Reads the GPT, or the MBR, of a raw or compressed image
+
+    Return
+    ------
+    A list of Partition sorted by offset
+    """
+    res = gpt_partitions(img) or mbr_partitions(img)
+    return sorted(res, key=lambda p: p.start)
+
+##########
+# Triage #
+##########
+
+# A triage scans random blocks of each stratum (equal slices of the
+# image) to estimate where the SMS are before a full scan
+TRIAGE_TIME = 60 # Seconds spent sampling by default
+TRIAGE_BLOCK = 64*1024 # Bytes of a sampled block
+TRIAGE_STRATA = 256 # Max number of strata, one heatmap cell each
+TRIAGE_Z = 1.96 # Confidence bounds at 95%
+HEATMAP_CHARS = " .:-=+*#%@" # From no hit to the densest stratum
+HEATMAP_WIDTH = 64
+
+class Stratum:
+    """
+    Description
+    -----------
+    Bytes [start, end[ of the image, split in blocks of TRIAGE_BLOCK
+    bytes. 'counts' and 'sizes' are the hits and bytes of the sampled
+    blocks
+    """
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.counts = []
+        self.sizes = []
+        self.unsampled = None # Blocks not sampled yet, in random order
+
+    def nb_blocks(self):
+        return (self.end-self.start+TRIAGE_BLOCK-1)/TRIAGE_BLOCK
+
+    def density(self):
+        """
+        Description
+        -----------
+        Estimates the number of hits per MB of the stratum from its
+        sampled blocks, with the standard error of the mean (finite
+        population correction). With a single block the count is taken
+        as a Poisson variable, without any hit the upper bound is the
+        "rule of three"
+
+        Return
+        ------
+        (density, low bound, high bound), None if no block was sampled
+        """
+        n = len(self.counts)
+        if( n == 0 ):
+            return None
+        mb = 1024.0*1024
+        sampled = float(sum(self.sizes))
+        density = sum(self.counts)*mb/sampled
+        correction = 1-float(n)/self.nb_blocks()
+        if( sum(self.counts) == 0 ):
+            return (0.0, 0.0, 3*mb/sampled if correction > 0 else 0.0)
+        if( n == 1 ):
+            error = math.sqrt(self.counts[0])*mb/sampled*math.sqrt(correction)
+        else:
+            values = [count*mb/size for count, size in zip(self.counts, self.sizes)]
+            mean = sum(values)/n
+            variance = sum([(v-mean)**2 for v in values])/(n-1)
+            error = math.sqrt(variance/n*correction)
+        return (density, max(0.0, density-TRIAGE_Z*error), density+TRIAGE_Z*error)
+
+class Triage:
+    """
+    Description
+    -----------
+    Hit density of the strata of an image, estimated by scanning random
+    blocks: every round samples one more block in each stratum
+    (stratified sampling), until the time is over or all the blocks are
+    sampled.
+    A compressed image is decompressed once to get its size. Gzip images
+    are then read from their seek points, but xz and zstd images can
+    only be read from the start: the blocks of a round are read in one
+    pass, so each round costs a decompression of the image
+    """
+    def __init__(self, img, seed=None):
+        if( isinstance(img, CompressedImage) ):
+            self.size = img.uncompressed_size()
+        else:
+            self.size = len(img)
+        self.random = random.Random(seed)
+        step = max(TRIAGE_BLOCK, -(-self.size//TRIAGE_STRATA))
+        step = -(-step//TRIAGE_BLOCK)*TRIAGE_BLOCK
+        self.strata = [Stratum(start, min(start+step, self.size)) for start in range(0, self.size, step)]
+        self.duration = 0
+
+    def pick_block(self, stratum):
+        """
+        (start, length) of a random block of the stratum not sampled yet
+        """
+        if( stratum.unsampled is None ):
+            stratum.unsampled = range(0, stratum.nb_blocks())
+            self.random.shuffle(stratum.unsampled)
+        start = stratum.start+stratum.unsampled.pop()*TRIAGE_BLOCK
+        return start, min(TRIAGE_BLOCK, stratum.end-start)
+
+    def sample_block(self, window, stratum, start, length, parsers, filters):
+        """
+        Counts the hits of the block at 'start', read in 'window' with the
+        MAX_PDU_LEN bytes after it (the SMS starting in the block can be
+        parsed)
+        """
+        window = bytearray(window)
+        hits = []
+        for range_start, range_end in scan_ranges(window, 0, length, start):
+            for parser in parsers:
+                hits += parser.parse(window, range_start, range_end, start, progress=False)
+        for f in filters:
+            hits = list(itertools.compress(hits, f.keep(hits)))
+        stratum.counts.append(len(hits))
+        stratum.sizes.append(length)
+
+    def run(self, img, parsers, filters, duration):
+        """
+        Samples blocks for 'duration' seconds with the parsers and the
+        filters. Returns the number of sampled blocks
+        """
+        start = time.time()
+        nb_samples = 0
+        while( time.time()-start < duration ):
+            strata = [stratum for stratum in self.strata if stratum.unsampled is None or stratum.unsampled]
+            if( not strata ):
+                break
+            self.random.shuffle(strata)
+            blocks = [(stratum,)+self.pick_block(stratum) for stratum in strata]
+            if( isinstance(img, CompressedImage) and img.fmt != "gzip" ):
+                blocks.sort(key=lambda block: block[1])
+                windows = img.read_blocks([(block_start, length+MAX_PDU_LEN)\
+                    for stratum, block_start, length in blocks])
+            else:
+                windows = (image_read(img, block_start, length+MAX_PDU_LEN)\
+                    for stratum, block_start, length in blocks)
+            done = 0
+            for (stratum, block_start, length), window in itertools.izip(blocks, windows):
+                self.sample_block(window, stratum, block_start, length, parsers, filters)
+                done += 1
+                elapsed = time.time()-start
+                charging_bar(int(duration*10), min(int(elapsed*10), int(duration*10)-1), 20,\
+                    msg="Triage: ")
+                if( elapsed >= duration ):
+                    break
+            nb_samples += done
+            # The blocks picked but not sampled can be picked again
+            for stratum, block_start, length in blocks[done:]:
+                stratum.unsampled.append((block_start-stratum.start)/TRIAGE_BLOCK)
+        self.duration = time.time()-start
+        charging_bar(int(duration*10), int(duration*10), 20, msg="Triage: ",\
+            end_msg="{} blocks sampled".format(nb_samples))
+        return nb_samples
+
+    def estimate(self):
+        """
+        Return
+        ------
+        (hits, low bound, high bound) in the whole image. The strata
+        without sample get the density of all the sampled blocks
+        """
+        total = 0.0
+        variance = 0.0
+        pooled = Stratum(0, self.size)
+        unsampled = 0
+        for stratum in self.strata:
+            pooled.counts += stratum.counts
+            pooled.sizes += stratum.sizes
+            if( not stratum.counts ):
+                unsampled += stratum.end-stratum.start
+        parts = [(stratum.density(), stratum.end-stratum.start) for stratum in self.strata if stratum.counts]
+        if( unsampled and pooled.counts ):
+            parts.append((pooled.density(), unsampled))
+        for density, size in parts:
+            mb = size/(1024.0*1024)
+            total += density[0]*mb
+            variance += ((density[2]-density[0])*mb/TRIAGE_Z)**2
+        error = TRIAGE_Z*math.sqrt(variance)
+        return (total, max(0.0, total-error), total+error)
+
+    def heatmap(self):
+        """
+        Return
+        ------
+        One character by stratum, from HEATMAP_CHARS on a log scale ('?'
+        for the strata without sample)
+        """
+        densities = [stratum.density() for stratum in self.strata]
+        top = max([d[0] for d in densities if d] or [0])
+        res = ""
+        for density in densities:
+            if( density is None ):
+                res += "?"
+            elif( density[0] == 0 ):
+                res += HEATMAP_CHARS[0]
+            else:
+                level = math.log(1+density[0])/math.log(1+top)
+                res += HEATMAP_CHARS[1+int(level*(len(HEATMAP_CHARS)-2))]
+        return res
+
+    def schedule(self, regions):
+        """
+        Description
+        -----------
+        Splits the (start, end) regions (all the image if empty) on the
+        strata and sorts the parts by decreasing density, the strata
+        without sample last
+
+        Return
+        ------
+        A list of regions
+        """
+        parts = []
+        for start, end in regions or [(0, None)]:
+            end = self.size if end is None else min(end, self.size)
+            for stratum in self.strata:
+                if( stratum.start < end and stratum.end > start ):
+                    density = stratum.density()
+                    parts.append((max(start, stratum.start), min(end, stratum.end),\
+                        density[0] if density else -1))
+        parts.sort(key=lambda part: -part[2])
+        return [(start, end) for start, end, density in parts]
+
+###############
+# SMS classes #
+###############
+
+# Types of SMS
+class SMSType:
+    SMS_PDU = 1
+    SMS_OTHER = 99
+
+def new_sms(sms_type):
+    """
+    Return an instance of the right class according to the 
+    requested SMS type. 
+    """
+    if( sms_type == SMSType.SMS_PDU ):
+        return SMSPDU()
+    elif(sms_type == SMS_OTHER):
+        return SMSGeneric()
+    else:
+        raise Exception("Unknown sms_type in sms() function")
+
+class SMSGeneric(object):
+    # While a SMS is parsed its raw fields are kept as references in
+    # the image: (position, length) in 'refs', image in 'image'.
+    # They are copied by detach() only if the parser keeps the SMS
+    image = None
+    refs = None
+
+    def __init__(self):
+        # Common fields for SMS
+        self.bin_offset = None # Offset in the binary  
+        self.bin_end = None # End offset (excluded) of the parsed bytes
+        self.src = None # Source number
+        self.dst = None # Destination number 
+        self.msg = None # Message body 
+        self.timestamp = None # SMS date, UTC timestamp in seconds
+        self.tz_offset = None # Time zone of the SMS date, in minutes
+        self._sms_date = None
+        self._date_utc_00 = None
+        self.sms_status = None # (Received / Sent)
+
+    # SMS date in human readable format. It is derived from 'timestamp'
+    # unless a parser sets it directly
+    @property
+    def sms_date(self):
+        if( self._sms_date is None and self.timestamp is not None ):
+            return format_date(self.timestamp, self.tz_offset)
+        return self._sms_date
+
+    @sms_date.setter
+    def sms_date(self, value):
+        self._sms_date = value
+
+    # Date in UTC + 0
+    @property
+    def date_utc_00(self):
+        if( self._date_utc_00 is None and self.timestamp is not None ):
+            return format_date_utc(self.timestamp)
+        return self._date_utc_00
+
+    @date_utc_00.setter
+    def date_utc_00(self, value):
+        self._date_utc_00 = value
+
+    def set_ref(self, name, img, pos, length):
+        """
+        Description
+        -----------
+        Keeps field 'name' as a reference to img[pos:pos+length]
+        """
+        refs = self.refs
+        if( refs is None ):
+            self.refs = refs = {}
+            self.image = img
+        refs[name] = (pos, length)
+
+    def field(self, name):
+        """
+        Description
+        -----------
+        Returns the bytes of field 'name', referenced or detached
+        """
+        if( self.refs is not None and name in self.refs ):
+            pos, length = self.refs[name]
+            return bytes(self.image[pos:pos+length])
+        return getattr(self, name)
+
+    def field_view(self, name):
+        """
+        Description
+        -----------
+        Same as field() without copying a referenced field: returns a
+        read-only buffer on the image, valid until the SMS is detached
+        """
+        if( self.refs is not None and name in self.refs ):
+            pos, length = self.refs[name]
+            return buffer(self.image, pos, length)
+        return getattr(self, name)
+
+    def detach(self):
+        """
+        Description
+        -----------
+        Copies the referenced fields so that the SMS does not keep the
+        image alive. Called by the parser when it keeps the SMS
+        """
+        refs = self.refs
+        if( refs is not None ):
+            img = self.image
+            for name in refs:
+                pos, length = refs[name]
+                setattr(self, name, bytes(img[pos:pos+length]))
+            self.refs = None
+            self.image = None
+
+    def epoch(self):
+        """
+        Description
+        -----------
+        Returns the UTC timestamp of the SMS (or None), for numeric
+        comparisons and sorting
+        """
+        return self.timestamp
+
+    def date(self):
+        """
+        Description
+        -----------
+        Returns the date in readable format
+        """
+        if( self.sms_date ):
+            return self.sms_date
+        return "Unknown"
+    
+    def date_utc(self):
+        if( self.date_utc_00 ):
+            return self.date_utc_00
+        return "Unknown"
+
+    def source(self):
+        if( self.src ):
+            return self.src
+        return "Unknown"
+        
+    def dest(self):
+        if( self.dst ):
+            return self.dst
+        return "Unknown"
+
+    def status(self):
+        if( self.sms_status ):
+            return self.sms_status
+        else:
+            return "Unknown"
+            
+    def offset(self):
+        return self.bin_offset
+
+    def span(self):
+        """
+        Description
+        -----------
+        Returns (start, end) of the bytes of the SMS in the binary, end
+        excluded. SMS without an end (old results) take one byte
+        """
+        end = getattr(self, "bin_end", None)
+        if( end is None ):
+            end = self.bin_offset+1
+        return (self.bin_offset, end)
+        
+    def message(self):
+        if( self.msg ):
+            return self.msg
+        return ''
+    
+    def number(self):
+        """
+        Description
+        -----------
+        Returns the number of the correspondent: the source of a
+        received SMS, the destination of a sent SMS
+        """
+        if( self.sms_status == "Received" ):
+            return self.source()
+        elif( self.sms_status == "Sent" ):
+            return self.dest()
+        elif( self.src ):
+            return self.source()
+        return self.dest()
+
+    def excel_output(self):
+        def remove_control_chars(s):
+            illegal_chars_re = re.compile(r'[\000-\010]|[\013-\014]|[\016-\037]')
+            res = ""
+            for i in range(0,len(s)):
+                if( next(illegal_chars_re.finditer(s[i]), None )):
+                    res += " "
+                else:
+                    res += s[i]
+            return res
+        output = []
+        # Offset
+        output.append(hex(self.offset()))
+        # Status
+        output.append(self.status())
+        # Number
+        output.append(self.number())
+        # Data
+        output.append(remove_control_chars(self.message()))
+        # Date
+        output.append(self.date())
+        output.append(self.date_utc())
+        return output
+    
+class SMSPDU(SMSGeneric):
+    def __init__(self):
+        SMSGeneric.__init__(self)
+        # TPDU fields 
+        self.tp_header = None  # First octet of the sms
+        self.tp_mr = None      # Message Reference 
+        self.tp_da = None      # Destination address
+        self.tp_oa = None      # Originating Address 
+        self.tp_pi = None      # Protocol Identifier 
+        self.tp_dcs = None     # Data Coding Scheme
+        self.tp_scts = None    # Service Center Time Stamp 
+        self.tp_vp = None      # Validity Period 
+        self.vp_timestamp = None # Absolute TP-VP, UTC timestamp
+        self.tp_udl = None     # User Data Length 
+        self.tp_ud = None      # User Data 
+            
+        self.addr_len = None   # Address length for the oa/da fields 
+
+    # Direct access functions
+    def header(self):
+        return self.tp_header
+    def mr(self):
+        return self.tp_mr
+    def da(self):
+        return self.tp_da
+    def oa(self):
+        return self.tp_oa
+    def pi(self):
+        return self.tp_pi
+    def dcs(self):
+        return self.tp_dcs
+    def scts(self):
+        return self.field("tp_scts")
+    def vp(self):
+        return self.field("tp_vp")
+    def udl(self):
+        return self.tp_udl
+    def ud(self):
+        return self.field("tp_ud")
+    def offset(self):
+        return self.bin_offset
+    
+    # Fine-grain access functions 
+    def mti(self):
+        """
+        Description
+        -----------
+        Returns bits 0 and 1 of the header
+        They give the type of PDU message
+        """
+        return self.header() & 0b00000011
+
+    def vpf(self):
+        """
+        Description
+        -----------
+        Returns bits 3 and 4 of the header
+        They give the format of the Validity Period field 
+        """
+        return (self.header() & 0b00011000 ) >> 3
+        
+    def data_format(self):
+        """
+        Description
+        -----------
+        Returns the 4 least significant bytes of the DCS field
+        They give the encoding for the user data 
+        """
+        return self.dcs() & 0x0f
+
+    def detach(self):
+        """
+        Description
+        -----------
+        Copies the referenced fields and decodes the dates they hold
+        """
+        SMSGeneric.detach(self)
+        if( self.tp_scts is not None and self.timestamp is None ):
+            ts = decode_scts(self.tp_scts)
+            if( ts ):
+                self.timestamp, self.tz_offset = ts
+        if( self.tp_vp is not None and self.vpf() == VPF_ABSOLUTE ):
+            ts = decode_scts(self.tp_vp)
+            if( ts ):
+                self.vp_timestamp = ts[0]
+            
+    
+####################
+# Parser class   ###
+####################
+
+global_parser_refs = []
+
+# Number of offsets a parser scans between two reorderings of its guards
+GUARD_REORDER_INTERVAL = 65536
+
+class Guard:
+    """
+    Description
+    -----------
+    A cheap check run by a parser on every offset before its parsing
+    functions. 'check(img, ind)' returns False only when the parsing
+    functions would reject the SMS starting at img[ind] anyway, so
+    guards never change what a parser finds. They only make rejecting
+    garbage cheaper: no SMS instance is created and no parsing
+    function is called.
+    The guard counts how often it ran and how often it rejected, so
+    that the parser can run the most selective guards first
+    """
+    def __init__(self, name, check):
+        self.name = name
+        self.check = check
+        self.calls = 0
+        self.rejections = 0
+
+    def rejection_rate(self):
+        if( self.calls == 0 ):
+            return 0.0
+        return float(self.rejections)/self.calls
+
+def field_guard(name, position, predicate):
+    """
+    Description
+    -----------
+    Creates a guard checking the byte at a fixed position from the
+    start of the SMS. The guard rejects the offset if the byte is
+    after the end of the image
+
+    Parameters
+    ----------
+    name : string
+    position : int, position of the byte from the start of the SMS
+    predicate : function taking the byte value (int) and returning
+        True if it can be valid
+
+    Returns
+    -------
+    A Guard instance
+    """
+    def check(img, ind):
+        if( ind+position >= len(img) ):
+            return False
+        return predicate(img[ind+position])
+    return Guard(name, check)
+
+class Parser:
+    def __init__(self, name, sms_type, func_list, guards=None, anchors=None):
+        global global_parser_refs
+        self.parse_functions = func_list
+        self.sms_type = sms_type
+        self.name = name
+        self.guards = list(guards) if guards else []
+        self.anchors = anchors
+        global_parser_refs.append(self)
+        
+    def reorder_guards(self):
+        """
+        Description
+        -----------
+        Sorts the guards so that the ones rejecting the most offsets
+        run first. The guards are independent so their order does not
+        change the result
+        """
+        self.guards.sort(key=lambda g: g.rejection_rate(), reverse=True)
+        
+    def parse(self, img, start=0, end=None, base=0, progress=True, sink=None):
+        """
+        Description
+        -----------
+        Parses an image and returns a list of SMS
+
+        Parameters
+        ----------
+        img : a string of bytes
+        start, end : only SMS starting at offsets in [start, end[ are
+            searched. The parsing functions can still read bytes after
+            'end' (default: the whole image)
+        base : offset of img[0] in the binary image (when 'img' is a
+            window of a bigger image)
+        progress : show a charging bar. When the image is scanned with
+            several calls, (done, total, found) gives the offsets
+            scanned before, the offsets to scan in all and the SMS
+            found before, so that a single bar is shown
+        sink : function called with lists of STORE_BATCH SMS, to save
+            them elsewhere as soon as they are found (default: the SMS
+            are returned)
+
+        Returns
+        -------
+        A list of sms instances (empty if there is a sink)
+        """
+
+        if( end is None ):
+            end = len(img)
+        if( progress is True ):
+            progress = (0, end-start, 0)
+        res = []
+        found = 0 # SMS given to the sink
+        guards = self.guards
+        next_reorder = start + GUARD_REORDER_INTERVAL
+        # The bar changes once per percent, no need to update it at each
+        # offset. A background scan is checked at least every JOB_STEP offsets
+        job = active_job()
+        next_bar = end
+        if( progress or job ):
+            bar_step = max(1, progress[1]/100) if progress else JOB_STEP
+            if( job ):
+                bar_step = min(bar_step, JOB_STEP)
+            next_bar = start
+        if( self.anchors ):
+            offsets = self.anchors(img, start, end)
+        else:
+            offsets = range(start, end)
+        for i in offsets:
+            if( i >= next_bar ):
+                next_bar = min(i + bar_step, end-1)
+                if( progress ):
+                    charging_bar(progress[1]-1, progress[0]+i-start, 20, msg="Parser '{}': ".format(self.name),\
+                        end_msg = "{} SMS found".format(progress[2]+found+len(res)))
+                if( job ):
+                    # The hits found so far can be previewed, and are kept
+                    # if the scan is cancelled
+                    if( sink and res ):
+                        sink(res)
+                        found += len(res)
+                        res = []
+                    check_job()
+            if( guards ):
+                if( i >= next_reorder ):
+                    self.reorder_guards()
+                    next_reorder = i + GUARD_REORDER_INTERVAL
+                rejected = False
+                for guard in guards:
+                    guard.calls += 1
+                    if( not guard.check(img, i) ):
+                        guard.rejections += 1
+                        rejected = True
+                        break
+                if( rejected ):
+                    continue
+            sms = new_sms(self.sms_type)
+            sms.bin_offset = base+i
+            offset = 0
+            for func in self.parse_functions:
+                if( i+offset >= len(img)):
+                    sms = None
+                    break
+                parsed_bytes = func(img, i+offset, sms)
+                if( parsed_bytes == ERROR):
+                    sms = None
+                    break
+                else:
+                    offset += parsed_bytes 
+            if( sms ):
+                sms.bin_end = base+i+offset
+                sms.detach()
+                res.append(sms)
+                if( sink and len(res) >= STORE_BATCH ):
+                    sink(res)
+                    found += len(res)
+                    res = []
+        if( sink and res ):
+            sink(res)
+            res = []
+        if( progress and self.anchors and end > start ):
+            # The last offset is usually not an anchor
+            charging_bar(progress[1]-1, progress[0]+end-1-start, 20, msg="Parser '{}': ".format(self.name),\
+                end_msg = "{} SMS found".format(progress[2]+found+len(res)))
+        return res
+
+
+#################
+# Filter class ##
+#################
+
+def batch_form(batch_func):
+    """
+    Description
+    -----------
+    Decorator that gives a filtering function a batch form. The batch
+    form takes a ResultColumns instance and returns an array of
+    booleans (one per SMS). It must give the same result as the
+    filtering function applied to each SMS.
+    Ex:
+        @batch_form(filter_date_batch)
+        def filter_date(sms):
+            ...
+    """
+    def decorator(func):
+        func.batch = batch_func
+        return func
+    return decorator
+
+class ResultColumns:
+    """
+    Description
+    -----------
+    Columnar view of a list of SMS for batch filtering functions (needs
+    numpy). Each column is built the first time it is requested, then
+    shared by all the batch functions:
+     - "scts" : (n, 7) array of uint8, zeros when the SMS has no SCTS
+     - "udl", "dcs", "ud_len" : int arrays, -1 when the field is missing
+     - "messages" : list of the decoded messages (unicode)
+    """
+    def __init__(self, sms_list):
+        self.sms_list = sms_list
+        self.columns = {}
+
+    def __len__(self):
+        return len(self.sms_list)
+
+    def __getitem__(self, name):
+        if( not name in self.columns ):
+            self.columns[name] = getattr(self, "_column_"+name)()
+        return self.columns[name]
+
+    def _int_column(self, attr):
+        return numpy.array([-1 if getattr(sms, attr, None) is None else getattr(sms, attr)\
+            for sms in self.sms_list], dtype=numpy.int64)
+
+    def _column_scts(self):
+        raw = "".join([str(getattr(sms, "tp_scts", None) or "")[:7].ljust(7, "\x00")\
+            for sms in self.sms_list])
+        return numpy.frombuffer(raw, dtype=numpy.uint8).reshape(len(self.sms_list), 7)
+
+    def _column_udl(self):
+        return self._int_column("tp_udl")
+
+    def _column_dcs(self):
+        return self._int_column("tp_dcs")
+
+    def _column_ud_len(self):
+        return numpy.array([-1 if getattr(sms, "tp_ud", None) is None else len(sms.tp_ud)\
+            for sms in self.sms_list], dtype=numpy.int64)
+
+    def _column_messages(self):
+        res = []
+        for sms in self.sms_list:
+            msg = sms.message()
+            if( isinstance(msg, str) ):
+                msg = msg.decode("latin-1")
+            res.append(msg)
+        return res
+
+def scts_valid_batch(scts):
+    """
+    Description
+    -----------
+    Vectorized version of the date checks of decode_scts()
+
+    Parameters
+    ----------
+    scts : (n, 7) numpy array of uint8
+
+    Return
+    ------
+    numpy array of booleans
+    """
+    low = (scts & 0x0f).astype(numpy.int64)
+    high = (scts >> 4).astype(numpy.int64)
+    low[:, 6] &= 0b0111 # Time zone sign bit
+    valid = ((low <= 9) & (high <= 9)).all(axis=1)
+    values = low*10+high
+    year = numpy.where(values[:, 0] > 50, 1900, 2000)+values[:, 0]
+    month = values[:, 1]
+    leap = ((year%4 == 0) & (year%100 != 0)) | (year%400 == 0)
+    month_days = numpy.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+    days = month_days[numpy.clip(month, 0, 12)]+((month == 2) & leap)
+    return valid & (month >= 1) & (month <= 12) & (values[:, 2] >= 1) & (values[:, 2] <= days)\
+        & (values[:, 3] <= 23) & (values[:, 4] <= 59) & (values[:, 5] <= 59)\
+        & (values[:, 6] <= MAX_TZ_QUARTERS)
+
+def code_points(messages):
+    """
+    Description
+    -----------
+    Concatenates unicode messages in one numpy array of code points
+
+    Return
+    ------
+    (array of code points, array of the message lengths)
+    """
+    lengths = numpy.array([len(msg) for msg in messages], dtype=numpy.int64)
+    # Code units must match len(): UTF-16 on narrow Python builds
+    if( sys.maxunicode > 0xffff ):
+        chars = numpy.frombuffer(u"".join(messages).encode("utf-32-le"), dtype=numpy.uint32)
+    else:
+        chars = numpy.frombuffer(u"".join(messages).encode("utf-16-le"), dtype=numpy.uint16)
+    return chars, lengths
+
+def char_ratio_batch(messages, intervals):
+    """
+    Description
+    -----------
+    For each message, computes the ratio of characters that belong to
+    one of the (first, last) code point intervals. Empty messages get 0
+
+    Return
+    ------
+    numpy array of floats
+    """
+    chars, lengths = code_points(messages)
+    inside = numpy.zeros(len(chars), dtype=bool)
+    for first, last in intervals:
+        inside |= (chars >= first) & (chars <= last)
+    counts = numpy.concatenate([[0], numpy.cumsum(inside)])
+    ends = numpy.cumsum(lengths)
+    yes = counts[ends]-counts[ends-lengths]
+    return yes.astype(numpy.float64)/numpy.maximum(lengths, 1)
+
+def hit_scores(sms_list, score):
+    """
+    Description
+    -----------
+    Applies a scoring function to each SMS, with its batch form if
+    it has one (see batch_form) and numpy is available
+
+    Return
+    ------
+    A list of floats
+    """
+    if( numpy is not None and hasattr(score, "batch") and sms_list ):
+        return score.batch(ResultColumns(sms_list)).tolist()
+    return [score(sms) for sms in sms_list]
+
+class DisjointSpans:
+    """
+    Description
+    -----------
+    Set of disjoint spans chosen among 'spans', a list of (start, end)
+    sorted by start. A span is added by its rank in 'spans'. A Fenwick
+    tree keeps the max end of the added spans by rank, so that add()
+    and overlaps() take O(log n)
+    """
+    def __init__(self, spans):
+        self.starts = [start for start, end in spans]
+        self.ends = [end for start, end in spans]
+        self.tree = [0]*(len(spans)+1)
+
+    def add(self, rank):
+        end = self.ends[rank]
+        rank += 1
+        tree = self.tree
+        while( rank < len(tree) ):
+            if( tree[rank] < end ):
+                tree[rank] = end
+            rank += rank & -rank
+
+    def overlaps(self, start, end):
+        # An added span overlaps [start, end[ if it starts before 'end'
+        # and ends after 'start'
+        rank = bisect.bisect_left(self.starts, end)
+        tree = self.tree
+        while( rank > 0 ):
+            if( tree[rank] > start ):
+                return True
+            rank -= rank & -rank
+        return False
+
+def resolve_overlaps(sms_list, score):
+    """
+    Description
+    -----------
+    Removes the hits that overlap a better hit. The hits are sorted by
+    span and swept to group them in clusters of overlapping hits. In
+    each cluster the hits are taken by decreasing score, a hit is kept
+    if it does not overlap a hit kept before: the best hit of the
+    cluster is always kept, and so are the hits that do not overlap it
+
+    Parameters
+    ----------
+    sms_list : list of SMS
+    score : scoring function, takes a SMS and returns a float (the
+        higher the better)
+
+    Return
+    ------
+    The list of kept SMS, in the order of 'sms_list'
+    """
+    scores = hit_scores(sms_list, score)
+    spans = [sms.span() for sms in sms_list]
+    keep = [False]*len(sms_list)
+
+    def resolve_cluster(cluster):
+        if( len(cluster) == 1 ):
+            keep[cluster[0]] = True
+            return
+        # The cluster is sorted by start: the rank of a hit in the
+        # cluster is its rank in 'kept'
+        kept = DisjointSpans([spans[k] for k in cluster])
+        # Best score first, then first offset, then longest span
+        order = sorted(range(0, len(cluster)), key=lambda i: (-scores[cluster[i]],\
+            spans[cluster[i]][0], spans[cluster[i]][0]-spans[cluster[i]][1]))
+        for i in order:
+            k = cluster[i]
+            if( not kept.overlaps(*spans[k]) ):
+                kept.add(i)
+                keep[k] = True
+
+    cluster = []
+    cluster_end = None
+    for k in sorted(range(len(sms_list)), key=lambda k: (spans[k][0], -spans[k][1])):
+        if( cluster and spans[k][0] >= cluster_end ):
+            resolve_cluster(cluster)
+            cluster = []
+        if( not cluster ):
+            cluster_end = spans[k][1]
+        else:
+            cluster_end = max(cluster_end, spans[k][1])
+        cluster.append(k)
+    if( cluster ):
+        resolve_cluster(cluster)
+    return [sms_list[k] for k in range(len(sms_list)) if keep[k]]
+
+global_filter_refs = []
+class Filter:
+    def __init__(self, name, func_list):
+        global global_filter_refs
+        self.name = name
+        self.filter_functions = func_list 
+        global_filter_refs.append(self)
+
+    def batch(self):
+        """
+        Returns True if the filter can be applied in batch: numpy is
+        available and every filtering function has a batch form
+        """
+        return numpy is not None and\
+            all([hasattr(func, "batch") for func in self.filter_functions])
+
+    def keep(self, sms_list, columns=None):
+        """
+        Description
+        -----------
+        Applies the filter to 'sms_list' without copying it. 'columns'
+        can be a ResultColumns of 'sms_list' shared with other filters
+
+        Return
+        ------
+        A list of booleans, True for the SMS that pass the filter
+        """
+        if( self.batch() and len(sms_list) > 0 ):
+            if( columns is None ):
+                columns = ResultColumns(sms_list)
+            keep = numpy.ones(len(sms_list), dtype=bool)
+            for func in self.filter_functions:
+                keep &= numpy.asarray(func.batch(columns), dtype=bool)
+            return keep.tolist()
+        keep = [True]*len(sms_list)
+        for func in self.filter_functions:
+            keep = [k and bool(func(sms)) for k, sms in itertools.izip(keep, sms_list)]
+        return keep
+
+    def filter(self, sms_list):
+        msg = "\t% Filter '{}': {} -> ".format(self.name, len(sms_list))
+        tmp = list(itertools.compress(sms_list, self.keep(sms_list)))
+        msg += "{} SMS".format(len(tmp))
+        print(msg)
+        return tmp
+
+def bool_mask(keep):
+    """
+    Description
+    -----------
+    Converts a list of booleans into a bitmask: bit i is set if keep[i]
+    is True
+    """
+    if( numpy is not None ):
+        bits = numpy.zeros(-(-len(keep)//8)*8, dtype=bool)
+        bits[:len(keep)] = keep
+        # packbits is big-endian: the last SMS goes in the first byte
+        return int(numpy.packbits(bits[::-1]).tostring().encode("hex") or "0", 16)
+    return int("".join(["1" if k else "0" for k in reversed(keep)]) or "0", 2)
+
+def mask_count(mask):
+    return bin(mask).count("1")
+
+class MaskedResults:
+    """
+    Description
+    -----------
+    The SMS of 'sms_list' selected by a bitmask (bit i set if
+    sms_list[i] is selected). It is read like a list of the selected
+    SMS, but the SMS are not copied: the bits are read when iterating,
+    the positions of the selected SMS are listed on the first index
+    access
+    """
+    def __init__(self, sms_list, mask):
+        self.sms_list = sms_list
+        self.mask = mask
+        self.size = mask_count(mask)
+        self.positions = None
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        bits = bin(self.mask)[:1:-1] # Bit 0 first
+        i = bits.find("1")
+        while( i >= 0 ):
+            yield self.sms_list[i]
+            i = bits.find("1", i+1)
+
+    def indexes(self):
+        if( self.positions is None ):
+            bits = bin(self.mask)[:1:-1]
+            self.positions = [i for i in range(0, len(bits)) if bits[i] == "1"]
+        return self.positions
+
+    def __getitem__(self, key):
+        if( isinstance(key, slice) ):
+            return [self.sms_list[i] for i in self.indexes()[key]]
+        return self.sms_list[self.indexes()[key]]
+
+
+#################
+# Result index ##
+#################
+
+def number_key(number):
+    """
+    Description
+    -----------
+    Key used to compare phone numbers: the digits without the
+    international prefix ('+' or '00')
+    """
+    if( not number ):
+        return None
+    number = number.strip()
+    if( number.startswith("+") ):
+        number = number[1:]
+    elif( number.startswith("00") ):
+        number = number[2:]
+    return number
+
+class ResultIndex:
+    """
+    Description
+    -----------
+    Secondary indexes over a list of SMS, to select SMS without going
+    through the whole list:
+     - a hash index on the phone number (source or destination)
+     - a sorted index on the timestamp
+     - a sorted index on the offset in the binary
+    The indexes are built once, the list must not change afterwards.
+
+    Example
+    -------
+    index = ResultIndex(scan_result)
+    index.query(number="+33612345678", date_from=1514764800)
+    """
+    def __init__(self, sms_list):
+        self.sms_list = sms_list
+        self.numbers = {}
+        dates = []
+        offsets = []
+        for i in range(0, len(sms_list)):
+            sms = sms_list[i]
+            for number in set([number_key(sms.src), number_key(sms.dst)]):
+                if( number ):
+                    self.numbers.setdefault(number, []).append(i)
+            if( sms.epoch() is not None ):
+                dates.append((sms.epoch(), i))
+            offsets.append((sms.offset(), i))
+        dates.sort()
+        offsets.sort()
+        self.dates = [d for d, i in dates]
+        self.date_ids = [i for d, i in dates]
+        self.offsets = [o for o, i in offsets]
+        self.offset_ids = [i for o, i in offsets]
+
+    def with_number(self, number):
+        """
+        Indexes of the SMS sent to or received from 'number'
+        """
+        return self.numbers.get(number_key(number), [])
+
+    def between_dates(self, start=None, end=None):
+        """
+        Indexes of the SMS with start <= timestamp <= end (UTC
+        timestamps in seconds)
+        """
+        return self.date_ids[self._range(self.dates, start, end)]
+
+    def between_offsets(self, start=None, end=None):
+        """
+        Indexes of the SMS with start <= offset < end
+        """
+        if( end is not None ):
+            end -= 1
+        return self.offset_ids[self._range(self.offsets, start, end)]
+
+    def _range(self, keys, start, end):
+        first = 0
+        last = len(keys)
+        if( start is not None ):
+            first = bisect.bisect_left(keys, start)
+        if( end is not None ):
+            last = bisect.bisect_right(keys, end)
+        return slice(first, last)
+
+    def query(self, number=None, date_from=None, date_to=None,\
+        offset_from=None, offset_to=None):
+        """
+        Description
+        -----------
+        Returns the SMS that match all the given criteria, in the order
+        of the indexed list. Dates are UTC timestamps, 'date_to' is
+        included and 'offset_to' is excluded
+        """
+        # Each criterion gives a (size, get_ids, check) selection. Only
+        # the smallest one is read, the others are checked on its SMS
+        key = number_key(number)
+        selections = []
+        if( number is not None ):
+            ids = self.with_number(number)
+            selections.append((len(ids), lambda: ids,\
+                lambda sms: key in (number_key(sms.src), number_key(sms.dst))))
+        if( date_from is not None or date_to is not None ):
+            s = self._range(self.dates, date_from, date_to)
+            date_slice = s
+            selections.append((s.stop-s.start, lambda: self.date_ids[date_slice],\
+                lambda sms: sms.epoch() is not None and\
+                    (date_from is None or sms.epoch() >= date_from) and\
+                    (date_to is None or sms.epoch() <= date_to)))
+        if( offset_from is not None or offset_to is not None ):
+            s = self._range(self.offsets, offset_from,\
+                None if offset_to is None else offset_to-1)
+            offset_slice = s
+            selections.append((s.stop-s.start, lambda: self.offset_ids[offset_slice],\
+                lambda sms: (offset_from is None or sms.offset() >= offset_from) and\
+                    (offset_to is None or sms.offset() < offset_to)))
+        if( not selections ):
+            return list(self.sms_list)
+        selections.sort(key=lambda selection: selection[0])
+        checks = [check for size, get_ids, check in selections[1:]]
+        res = []
+        for i in sorted(selections[0][1]()):
+            sms = self.sms_list[i]
+            if( all([check(sms) for check in checks]) ):
+                res.append(sms)
+        return res
+
+
+#################
+# Text index ####
+#################
+
+class TextIndex:
+    """
+    Description
+    -----------
+    Full-text index over the messages of SMS. It holds two inverted
+    indexes: lowercase words -> SMS and lowercase trigrams -> SMS.
+    SMS can be added one by one while the image is scanned.
+    Words are used for keyword searches, trigrams for substring
+    searches (the SMS containing all the trigrams of the substring
+    are the only ones that are checked).
+    """
+    def __init__(self):
+        self.docs = [] # Indexed SMS
+        self.messages = [] # Lowercase messages of the indexed SMS
+        self.words = {}
+        self.trigrams = {}
+
+    def add(self, sms):
+        doc = len(self.docs)
+        msg = sms.message().lower()
+        self.docs.append(sms)
+        self.messages.append(msg)
+        for word in set(re.findall(r'\w+', msg, re.UNICODE)):
+            self.words.setdefault(word, array('I')).append(doc)
+        for trigram in set([msg[i:i+3] for i in range(0, len(msg)-2)]):
+            self.trigrams.setdefault(trigram, array('I')).append(doc)
+
+    def add_all(self, sms_list):
+        for sms in sms_list:
+            self.add(sms)
+
+    def _candidates(self, postings):
+        """
+        Docs that appear in all the posting lists
+        """
+        if( not postings ):
+            return []
+        postings = sorted(postings, key=len)
+        docs = set(postings[0])
+        for posting in postings[1:]:
+            docs.intersection_update(posting)
+            if( not docs ):
+                break
+        return docs
+
+    def search_words(self, words):
+        """
+        Description
+        -----------
+        Keyword search: SMS containing all the words, ranked by the
+        number of occurrences of the words
+
+        Return
+        ------
+        A list of (number of matches, SMS)
+        """
+        words = [w.lower() for w in words]
+        postings = [self.words.get(word, []) for word in words]
+        res = []
+        for doc in self._candidates(postings):
+            found = re.findall(r'\w+', self.messages[doc], re.UNICODE)
+            res.append((sum([found.count(word) for word in words]), doc))
+        return self._ranked(res)
+
+    def search_substring(self, substring):
+        """
+        Description
+        -----------
+        Substring search: SMS containing 'substring' (case insensitive),
+        ranked by the number of occurrences
+
+        Return
+        ------
+        A list of (number of matches, SMS)
+        """
+        substring = substring.lower()
+        if( len(substring) < 3 ):
+            docs = range(0, len(self.docs))
+        else:
+            docs = self._candidates([self.trigrams.get(substring[i:i+3], [])\
+                for i in range(0, len(substring)-2)])
+        res = []
+        for doc in docs:
+            count = self.messages[doc].count(substring)
+            if( count ):
+                res.append((count, doc))
+        return self._ranked(res)
+
+    def _ranked(self, matches):
+        matches.sort(key=lambda match: (-match[0], match[1]))
+        return [(count, self.docs[doc]) for count, doc in matches]
+
+    @staticmethod
+    def checksum(sms_list):
+        """
+        Count and digest of the offsets of 'sms_list', to check that an
+        index is loaded with the list it was saved with
+        """
+        digest = hashlib.md5()
+        for sms in sms_list:
+            digest.update("{},".format(sms.offset()))
+        return (len(sms_list), digest.hexdigest())
+
+    def save(self, filename, sms_list):
+        """
+        Description
+        -----------
+        Saves the index. Indexed SMS are saved as their position in
+        'sms_list', the list of SMS saved with the index
+        """
+        positions = dict([(id(sms), i) for i, sms in enumerate(sms_list)])
+        f = open(filename, "wb")
+        pickle.dump((TextIndex.checksum(sms_list), [positions[id(sms)] for sms in self.docs],\
+            self.words, self.trigrams), f, pickle.HIGHEST_PROTOCOL)
+        f.close()
+
+    def load(self, filename, sms_list):
+        """
+        Loads an index saved with 'sms_list'. Raises ValueError if it
+        was saved with other SMS
+        """
+        f = open(filename, "rb")
+        saved = pickle.load(f)
+        f.close()
+        if( len(saved) != 4 or saved[0] != TextIndex.checksum(sms_list) ):
+            raise ValueError("the index does not match the results")
+        checksum, positions, self.words, self.trigrams = saved
+        self.docs = [sms_list[i] for i in positions]
+        self.messages = [sms.message().lower() for sms in self.docs]
+
+
+##################
+# Result store ###
+##################
+
+STORE_BATCH = 10000 # SMS written or read at once
+SQLITE_MAGIC = "SQLite format 3\x00"
+
+class ResultStore:
+    """
+    Description
+    -----------
+    SQLite database holding scan results on disk, for results that do
+    not fit in memory. The 'hits' table holds the pickled SMS, with
+    their offset, numbers and timestamp in indexed columns. The
+    'filtered' table holds the ids of the hits selected by the filters.
+    Hits are read back in the order of a scan in memory: by parser,
+    then in the order they were found.
+
+    Example
+    -------
+    store = ResultStore("results.db", create=True)
+    store.add_all(sms_list)
+    store.finish()
+    for sms in StoredResults(store):
+        ...
+    """
+    def __init__(self, filename, create=False, durable=False):
+        if( create and os.path.exists(filename) ):
+            os.remove(filename)
+        self.filename = filename
+        # A background scan fills the store that the CLI reads afterwards
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.text_factory = str
+        if( durable ):
+            # The hits counted by a checkpoint must survive a crash: the
+            # commits of Checkpoint.save() are synced to the journal
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=FULL")
+        else:
+            # Results can be computed again: no journal for bulk inserts
+            self.db.execute("PRAGMA journal_mode=OFF")
+            self.db.execute("PRAGMA synchronous=OFF")
+        if( create ):
+            self.db.execute("CREATE TABLE hits (id INTEGER PRIMARY KEY, parser INTEGER,"\
+                " offset INTEGER, src TEXT, dst TEXT, timestamp INTEGER, sms BLOB)")
+            self.db.execute("CREATE TABLE filtered (rank INTEGER PRIMARY KEY, id INTEGER)")
+            self.db.execute("CREATE TABLE info (name TEXT PRIMARY KEY, value TEXT)")
+
+    def add_all(self, sms_list, parser=0):
+        """
+        Description
+        -----------
+        Appends SMS found by parser number 'parser' (bulk insert)
+        """
+        self.db.executemany("INSERT INTO hits (parser, offset, src, dst, timestamp, sms)"\
+            " VALUES (?, ?, ?, ?, ?, ?)", [(parser, sms.offset(), number_key(sms.src),\
+            number_key(sms.dst), sms.epoch(), sqlite3.Binary(pickle.dumps(sms, pickle.HIGHEST_PROTOCOL)))\
+            for sms in sms_list])
+
+    def last_id(self):
+        return self.db.execute("SELECT MAX(id) FROM hits").fetchone()[0] or 0
+
+    def truncate(self, last_id):
+        """
+        Description
+        -----------
+        Deletes the hits added after hit number 'last_id'
+        """
+        self.db.execute("DELETE FROM hits WHERE id > ?", (last_id,))
+        self.db.commit()
+
+    def finish(self, parser_names=[]):
+        """
+        Description
+        -----------
+        Creates the indexes once all the hits are inserted (faster than
+        updating them at each insert) and saves the parser names
+        """
+        self.db.execute("CREATE INDEX IF NOT EXISTS hits_order ON hits (parser, id)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS hits_offset ON hits (offset)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS hits_src ON hits (src)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS hits_dst ON hits (dst)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS hits_timestamp ON hits (timestamp)")
+        self.db.execute("INSERT OR REPLACE INTO info VALUES ('parsers', ?)", ("\n".join(parser_names),))
+        self.db.commit()
+
+    def parser_names(self):
+        row = self.db.execute("SELECT value FROM info WHERE name = 'parsers'").fetchone()
+        if( not row or not row[0] ):
+            return []
+        return row[0].split("\n")
+
+    def select(self, view, filters):
+        """
+        Description
+        -----------
+        Applies filters to the SMS of a view, batch by batch, and saves
+        the ids of the SMS that pass all of them in the 'filtered' table
+
+        Return
+        ------
+        A StoredResults view of the filtered SMS
+        """
+        kept = []
+        counts = [[0, 0] for f in filters] # SMS before and after each filter
+        for chunk in view.chunks():
+            for f, count in zip(filters, counts):
+                count[0] += len(chunk)
+                chunk = list(itertools.compress(chunk, f.keep(chunk)))
+                count[1] += len(chunk)
+            kept += [sms.store_id for sms in chunk]
+        for f, count in zip(filters, counts):
+            print("\t% Filter '{}': {} -> {} SMS".format(f.name, count[0], count[1]))
+        self.set_filtered(kept)
+        return StoredResults(self, filtered=True)
+
+    def search(self, view, count):
+        """
+        Description
+        -----------
+        Full-text search over the SMS of a view, batch by batch, without
+        building a text index in memory. 'count' gives the number of
+        matches in a SMS (see text_matcher)
+
+        Return
+        ------
+        A list of (number of matches, SMS), ranked like TextIndex
+        """
+        res = []
+        for chunk in view.chunks():
+            for sms in chunk:
+                matches = count(sms)
+                if( matches ):
+                    res.append((matches, sms))
+        res.sort(key=lambda match: -match[0])
+        return res
+
+    def set_filtered(self, ids):
+        self.db.execute("DELETE FROM filtered")
+        self.db.executemany("INSERT INTO filtered (id) VALUES (?)", [(i,) for i in ids])
+        self.db.commit()
+
+    def resolve_overlaps(self, view, score):
+        """
+        Description
+        -----------
+        Runs resolve_overlaps() on the SMS of a view, read by offset.
+        SMS are resolved by groups of at least STORE_BATCH SMS that
+        end between two clusters of overlapping SMS, so that only one
+        group is in memory
+
+        Return
+        ------
+        The sorted ids of the kept SMS
+        """
+        kept = []
+        group = []
+        group_end = None
+        for chunk in view.chunks(order="hits.offset, hits.id"):
+            for sms in chunk:
+                start, end = sms.span()
+                if( len(group) >= STORE_BATCH and start >= group_end ):
+                    kept += [s.store_id for s in resolve_overlaps(group, score)]
+                    group = []
+                if( not group ):
+                    group_end = end
+                group.append(sms)
+                group_end = max(group_end, end)
+        kept += [s.store_id for s in resolve_overlaps(group, score)]
+        kept.sort()
+        return kept
+
+    def keep_hits(self, ids):
+        """
+        Description
+        -----------
+        Deletes the hits whose id is not in 'ids'
+        """
+        self.db.execute("CREATE TEMP TABLE kept (id INTEGER PRIMARY KEY)")
+        self.db.executemany("INSERT INTO kept VALUES (?)", [(i,) for i in ids])
+        self.db.execute("DELETE FROM hits WHERE id NOT IN (SELECT id FROM kept)")
+        self.db.execute("DROP TABLE kept")
+        self.db.execute("DELETE FROM filtered")
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+class StoredResults:
+    """
+    Description
+    -----------
+    List-like view of the SMS of a ResultStore: all the hits, or only
+    the filtered ones. The SMS are read from the disk each time the
+    view is iterated, batch by batch. They get a 'store_id' attribute
+    """
+    def __init__(self, store, filtered=False):
+        self.store = store
+        self.filtered = filtered
+        self.size = None
+
+    def _select(self, columns, where="", args=(), order=None, limit=None):
+        if( self.filtered ):
+            query = "SELECT {} FROM filtered JOIN hits ON hits.id = filtered.id".format(columns)
+            order = order or "filtered.rank"
+        else:
+            query = "SELECT {} FROM hits".format(columns)
+            order = order or "hits.parser, hits.id"
+        if( where ):
+            query += " WHERE "+where
+        query += " ORDER BY "+order
+        if( limit is not None ):
+            query += " LIMIT ? OFFSET ?"
+            args = tuple(args)+limit
+        return self.store.db.execute(query, args)
+
+    def _load(self, rows):
+        res = []
+        for store_id, data in rows:
+            sms = pickle.loads(str(data))
+            sms.store_id = store_id
+            res.append(sms)
+        return res
+
+    def chunks(self, where="", args=(), order=None):
+        """
+        Description
+        -----------
+        Generator of lists of at most STORE_BATCH SMS
+        """
+        cursor = self._select("hits.id, hits.sms", where, args, order)
+        while( True ):
+            rows = cursor.fetchmany(STORE_BATCH)
+            if( not rows ):
+                break
+            yield self._load(rows)
+
+    def __iter__(self):
+        for chunk in self.chunks():
+            for sms in chunk:
+                yield sms
+
+    def __len__(self):
+        if( self.size is None ):
+            self.size = self._select("COUNT(*)", order="NULL").fetchone()[0]
+        return self.size
+
+    def __getitem__(self, index):
+        if( isinstance(index, slice) ):
+            start, stop, step = index.indices(len(self))
+            if( step != 1 ):
+                raise IndexError("slices of stored results must have a step of 1")
+            return self._load(self._select("hits.id, hits.sms",\
+                limit=(max(0, stop-start), start)).fetchall())
+        if( index < 0 ):
+            index += len(self)
+        rows = self._select("hits.id, hits.sms", limit=(1, index)).fetchall()
+        if( index < 0 or not rows ):
+            raise IndexError("stored results index out of range")
+        return self._load(rows)[0]
+
+    def query(self, number=None, date_from=None, date_to=None,\
+        offset_from=None, offset_to=None):
+        """
+        Description
+        -----------
+        Same as ResultIndex.query(), with the indexes of the database
+        """
+        where = []
+        args = []
+        if( number is not None ):
+            where.append("(hits.src = ? OR hits.dst = ?)")
+            args += [number_key(number)]*2
+        if( date_from is not None or date_to is not None ):
+            where.append("hits.timestamp IS NOT NULL")
+        if( date_from is not None ):
+            where.append("hits.timestamp >= ?")
+            args.append(date_from)
+        if( date_to is not None ):
+            where.append("hits.timestamp <= ?")
+            args.append(date_to)
+        if( offset_from is not None ):
+            where.append("hits.offset >= ?")
+            args.append(offset_from)
+        if( offset_to is not None ):
+            where.append("hits.offset < ?")
+            args.append(offset_to)
+        res = []
+        for chunk in self.chunks(" AND ".join(where), tuple(args)):
+            res += chunk
+        return res
+
+
+#####################
+##### CLI script ####
+#####################
+
+def bold(string):
+    return '\033[1m'+string+'\033[0m'
+    
+def yellow(string):
+    return '\033[93m'+string+'\033[0m'
+    
+def green(string):
+    return '\033[92m'+string+'\033[0m'
+
+def index_hits(sms_list):
+    """
+    Adds new hits to the full-text index, if it is enabled
+    """
+    global text_index
+    if( text_index is not None ):
+        text_index.add_all(sms_list)
+
+def image_size(img):
+    """
+    Size of a raw image, or of the file of a compressed image
+    """
+    if( isinstance(img, CompressedImage) ):
+        return img.compressed_size
+    return len(img)
+
+CHECKPOINT_VERSION = 1
+
+def atomic_dump(obj, filename):
+    """
+    Description
+    -----------
+    Pickles 'obj' in a temporary file, then renames it to 'filename':
+    if the program stops while writing, 'filename' still holds the
+    previous complete pickle
+    """
+    tmp = filename+".tmp"
+    f = open(tmp, "wb")
+    pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    if( os.name == "nt" and os.path.exists(filename) ):
+        # rename() does not replace files on Windows
+        os.remove(filename)
+    os.rename(tmp, filename)
+
+class Checkpoint:
+    """
+    Description
+    -----------
+    Periodic saves of a running scan, so that it can be resumed after
+    a crash or a Ctrl-C. parse() and parse_compressed() call mark()
+    each time all the hits found before a position are in their lists
+    (or in the store): the position, the number of hits and the reports
+    of the scan engine are recorded, and written in 'filename' with
+    the hits every 'interval' seconds. 'state' holds what does not
+    change during the scan (image, parsers, options).
+    A scan resumed from 'saved', a loaded checkpoint, restarts from
+    the saved position with the saved hits and reports: it gives the
+    same results as a scan that was never interrupted
+    """
+    def __init__(self, filename, interval, state, store=None, saved=None):
+        self.filename = filename
+        self.interval = interval
+        self.state = state
+        self.store = store
+        self.saved = saved
+        self.last = time.time()
+        self.position = None
+
+    def start(self, position, hits, found):
+        """
+        Description
+        -----------
+        Restores the reports, the text index and the store of the saved
+        scan
+
+        Return
+        ------
+        The (position, hits, found) to start from: the saved ones, or
+        the arguments if there is no saved scan
+        """
+        global entropy_map
+        global text_index
+        if( self.saved is None ):
+            return position, hits, found
+        saved = self.saved
+        fill_report.clear()
+        fill_report.update(saved["fill_report"])
+        entropy_map = array('B', saved["entropy_map"])
+        entropy_report[0] = saved["entropy_report"]
+        if( text_index is not None and saved["text_index"] is not None ):
+            text_index = TextIndex()
+            text_index.add_all(saved["text_index"])
+        if( self.store ):
+            self.store.truncate(saved["stored"])
+        return saved["position"], saved["hits"], saved["found"]
+
+    def mark(self, position, hits, found):
+        """
+        Description
+        -----------
+        Records that the scan reached 'position', with the lists of
+        'hits' and the numbers of hits 'found' by each parser. Saves
+        the checkpoint if the last save is older than 'interval'
+        """
+        self.position = position
+        self.hits = hits
+        self.sizes = [len(h) for h in hits]
+        self.found = list(found)
+        self.fill = dict(fill_report)
+        self.entropy = (len(entropy_map), entropy_report[0])
+        self.docs = len(text_index.docs) if text_index is not None else None
+        self.stored = self.store.last_id() if self.store else None
+        if( time.time()-self.last >= self.interval ):
+            self.save()
+
+    def save(self):
+        """
+        Description
+        -----------
+        Writes the last marked position. Hits found after it (the scan
+        was interrupted) are not saved
+        """
+        if( self.position is None ):
+            return
+        state = dict(self.state)
+        state.update({\
+            "position": self.position,\
+            "hits": [self.hits[i][:self.sizes[i]] for i in range(0, len(self.hits))],\
+            "found": self.found,\
+            "fill_report": self.fill,\
+            "entropy_map": entropy_map[:self.entropy[0]].tostring(),\
+            "entropy_report": self.entropy[1],\
+            "text_index": text_index.docs[:self.docs] if self.docs is not None else None,\
+            "stored": self.stored})
+        if( self.store ):
+            self.store.db.commit()
+        atomic_dump(state, self.filename)
+        self.last = time.time()
+
+    def remove(self):
+        if( os.path.exists(self.filename) ):
+            os.remove(self.filename)
+
+def hit_collector(res, sink, number):
+    """
+    Description
+    -----------
+    Returns a function that receives the hits of parser number 'number':
+    they are indexed, then appended to the list 'res' or given to
+    'sink(hits, number)'. The function counts the hits in its 'found'
+    attribute
+    """
+    job = active_job()
+    def collect(hits):
+        index_hits(hits)
+        collect.found += len(hits)
+        if( job ):
+            job.add(hits, number)
+        if( sink ):
+            sink(hits, number)
+        else:
+            res.extend(hits)
+    collect.found = 0
+    if( job ):
+        # Hits restored from a checkpoint
+        job.add(res, number)
+    return collect
+
+def region_ranges(img, regions):
+    """
+    Description
+    -----------
+    Returns the ranges to scan in the (start, end) regions of a raw
+    image, the whole image if there are no regions
+    """
+    if( not regions ):
+        return scan_ranges(img, 0, len(img))
+    ranges = []
+    for start, end in regions:
+        end = len(img) if end is None else min(end, len(img))
+        if( start < end ):
+            ranges += scan_ranges(img, start, end)
+    return ranges
+
+def parse(parsers, img, sink=None, checkpoint=None, regions=None):
+    """
+    Description
+    -----------
+    Runs parsers on a raw image, or on its (start, end) regions. The
+    hits are returned, or given to sink(hits, parser number) by
+    batches. The ranges to scan are cut in pieces of SCAN_WINDOW bytes,
+    the checkpoint is marked after each piece
+    """
+    ranges = region_ranges(img, regions)
+    pieces = []
+    for start, end in ranges:
+        pieces += [(s, min(s+SCAN_WINDOW, end)) for s in range(start, end, SCAN_WINDOW)]
+    total = sum([end-start for start, end in ranges])
+    res = [[] for parser in parsers]
+    found = [0]*len(parsers)
+    first = (0, 0) # (parser number, piece number)
+    if( checkpoint ):
+        first, res, found = checkpoint.start(first, res, found)
+    for number in range(first[0], len(parsers)):
+        collect = hit_collector(res[number], sink, number)
+        collect.found = found[number]
+        done = 0
+        for piece in range(0, len(pieces)):
+            start, end = pieces[piece]
+            if( (number, piece) >= first ):
+                collect(parsers[number].parse(img, start, end, progress=(done, total, collect.found),\
+                    sink=collect))
+                if( checkpoint ):
+                    found[number] = collect.found
+                    checkpoint.mark((number, piece+1), res, found)
+            done += end-start
+    return sum(res, [])
+
+def parse_compressed(parsers, image, sink=None, checkpoint=None, regions=None):
+    """
+    Description
+    -----------
+    Runs parsers on a CompressedImage, or on its (start, end) regions.
+    The image is decompressed window by window and each window is
+    scanned by all the parsers, so it is decompressed only once. The
+    hits are returned, or given to sink(hits, parser number) by
+    batches. The checkpoint is marked after each window
+    """
+    res = [[] for parser in parsers]
+    found = [0]*len(parsers)
+    first = 0 # Offset of the first window
+    if( checkpoint ):
+        first, res, found = checkpoint.start(first, res, found)
+    collectors = [hit_collector(res[i], sink, i) for i in range(0, len(parsers))]
+    for i in range(0, len(parsers)):
+        collectors[i].found = found[i]
+    name = os.path.basename(image.filename)
+    for region_start, region_end in regions or [(0, None)]:
+        if( region_end is not None and region_end <= first ):
+            continue
+        # Windows start on an entropy block so that the entropy map is
+        # consistent, the bytes before the region are not scanned
+        start = max(region_start, first)
+        for base, window, scan_len in image.windows(start-start%ENTROPY_BLOCK):
+            if( region_end is not None ):
+                if( base >= region_end ):
+                    break
+                scan_len = min(scan_len, region_end-base)
+            ranges = scan_ranges(window, max(0, start-base), scan_len, base)
+            for i in range(0, len(parsers)):
+                for range_start, range_end in ranges:
+                    collectors[i](parsers[i].parse(window, range_start, range_end, base, progress=False,\
+                        sink=collectors[i]))
+            if( checkpoint ):
+                checkpoint.mark(base+scan_len, res, [collect.found for collect in collectors])
+            charging_bar(image.compressed_size, min(image.consumed, image.compressed_size-1),\
+                20, msg="Image '{}': ".format(name))
+    charging_bar(image.compressed_size, image.compressed_size, 20, msg="Image '{}': ".format(name),\
+        end_msg="{} SMS found".format(sum([collect.found for collect in collectors])))
+    return sum(res, [])
+
+# State of the parallel scan, inherited by the forked workers
+region_scan_state = {}
+
+def scan_region(number):
+    """
+    Description
+    -----------
+    Worker of parse_parallel: runs all the parsers on the region
+    'number' of the image
+
+    Return
+    ------
+    (hits of each parser, fill_report, entropy_map, entropy_report)
+    """
+    global fill_report
+    global entropy_map
+    img = region_scan_state["image"]
+    fill_report = {}
+    entropy_map = array('B')
+    entropy_report[0] = 0
+    ranges = region_ranges(img, [region_scan_state["regions"][number]])
+    hits = []
+    for parser in region_scan_state["parsers"]:
+        hits.append(sum([parser.parse(img, start, end, progress=False) for start, end in ranges], []))
+    return hits, fill_report, entropy_map, entropy_report[0]
+
+def parse_parallel(parsers, img, regions, workers, sink=None):
+    """
+    Description
+    -----------
+    Runs parsers on the (start, end) regions of a raw image, each
+    region is scanned by a forked process. Hits, fill and entropy
+    reports are merged in the order of the regions, so the result is
+    the same as parse(parsers, img, sink, regions=regions)
+    """
+    global region_scan_state
+    global entropy_map
+    region_scan_state = {"image": img, "parsers": parsers, "regions": regions}
+    res = [[] for parser in parsers]
+    collectors = [hit_collector(res[i], sink, i) for i in range(0, len(parsers))]
+    # Without a sink the hits are collected at the end, parser by parser,
+    # as parse() does (the text index keeps the same order)
+    pending = [[] for parser in parsers]
+    sizes = [min(end if end is not None else len(img), len(img))-start for start, end in regions]
+    done = 0
+    pool = multiprocessing.Pool(min(workers, len(regions)))
+    try:
+        results = pool.imap(scan_region, range(0, len(regions)))
+        for number in range(0, len(regions)):
+            # A timeout lets Ctrl-C or scan-cancel interrupt the wait
+            while( True ):
+                try:
+                    hits, fills, entropies, high = results.next(timeout=1)
+                    break
+                except multiprocessing.TimeoutError:
+                    check_job()
+            for fill, nb in fills.items():
+                fill_report[fill] = fill_report.get(fill, 0) + nb
+            entropy_report[0] += high
+            # Only the blocks of the region are known by the worker
+            first = regions[number][0]/ENTROPY_BLOCK
+            if( len(entropies) > first ):
+                if( len(entropy_map) < len(entropies) ):
+                    entropy_map.extend([ENTROPY_UNKNOWN]*(len(entropies)-len(entropy_map)))
+                entropy_map[first:len(entropies)] = entropies[first:]
+            for i in range(0, len(parsers)):
+                # Background scans show their hits as soon as possible
+                if( sink or active_job() ):
+                    collectors[i](hits[i])
+                else:
+                    pending[i].append(hits[i])
+            done += max(0, sizes[number])
+            charging_bar(sum(sizes), min(done, sum(sizes)-1), 20,\
+                msg="Regions ({} workers): ".format(workers))
+    finally:
+        pool.terminate()
+        region_scan_state = {}
+    for i in range(0, len(parsers)):
+        for hits in pending[i]:
+            collectors[i](hits)
+    charging_bar(sum(sizes), sum(sizes), 20, msg="Regions ({} workers): ".format(workers),\
+        end_msg="{} SMS found".format(sum([collect.found for collect in collectors])))
+    return sum(res, [])
+
+def filter_sms(filter_list, sms_list):
+    tmp = sms_list
+    for f in filter_list:
+        tmp = [sms for sms in tmp if f(sms)]
+    return tmp
+        
+# Commands
+CMD_LOAD = "load"
+CMD_LOAD_SHORT = "l"
+image_string = []
+image_filename = None
+image_partitions = None # Partitions of the loaded image, read when needed
+scan_regions = [] # (start, end) regions scanned by parser-run, all the image if empty
+image_triage = None # Triage of the loaded image
+def read_image(filename):
+    """
+    Description
+    -----------
+    Reads a binary image: raw images are read in a bytearray (parsing
+    functions index it with integers), compressed images are
+    decompressed on the fly when scanned.
+    Raises ImportError if the package to decompress the image is missing
+
+    Return
+    ------
+    A bytearray or a CompressedImage
+    """
+    fmt = compression_format(filename)
+    if( fmt ):
+        if( not new_decompressor(fmt) ):
+            raise ImportError("missing package to decompress {} images".format(fmt))
+        return CompressedImage(filename, fmt)
+    f = open(filename, "rb")
+    size = os.path.getsize(filename)
+    if( size ):
+        img = bytearray(size)
+        del img[f.readinto(img):]
+    else:
+        # Devices have no size
+        img = bytearray(f.read())
+    f.close()
+    return img
+
+def load(filename):
+    global image_string
+    global image_filename
+    global image_partitions
+    global scan_regions
+    global image_triage
+    if( scan_busy() ):
+        return
+    # Read the binary
+    try:
+        image_string = read_image(filename)
+        image_filename = filename
+    except ImportError as e:
+        print("\t% Error: {}".format(e))
+        return
+    except:
+        print("\t% Error: could not read binary")
+        return
+    if( isinstance(image_string, CompressedImage) ):
+        print("\n\t% Loaded file: " + filename + " ({} compressed)".format(image_string.fmt))
+    else:
+        print("\n\t% Loaded file: " + filename)
+    image_partitions = None
+    image_triage = None
+    if( scan_regions ):
+        scan_regions = []
+        print("\t% Scan regions cleared")
+
+CMD_CONTEXT = "context"
+CMD_CONTEXT_SHORT = "cx"
+def show_context(offset_arg, length_arg="64"):
+    global image_string
+    if( not image_string ):
+        print("You must load a binary first :) ")
+        return
+    try:
+        offset = int(offset_arg, 0)
+        length = int(length_arg, 0)
+    except:
+        print("\t% Error: invalid offset or length")
+        return
+    data = bytearray(image_read(image_string, offset, length))
+    print('')
+    for i in range(0, len(data), 16):
+        line = data[i:i+16]
+        hexa = " ".join(["{0:02x}".format(c) for c in line])
+        text = "".join([chr(c) if 0x20 <= c < 0x7f else "." for c in line])
+        print("\t{0:08x}  {1:<47}  {2}".format(offset+i, hexa, text))
+
+
+CMD_FILTER_SELECT = "filter-apply"
+CMD_FILTER_SELECT_SHORT = "fa"
+selected_filters = []
+filter_result = []
+# Bitmasks of the filters over 'scan_result', by filter number: they are
+# computed once, and dropped when the results or the filter settings change
+filter_masks = {}
+filter_columns = None # ResultColumns of 'scan_result', shared by the filters
+
+def results_changed():
+    """
+    Description
+    -----------
+    Drops the cached filter masks, to call when 'scan_result' or a
+    setting of the filters changes
+    """
+    global filter_masks
+    global filter_columns
+    filter_masks = {}
+    filter_columns = None
+
+def filter_mask(number):
+    """
+    Return
+    ------
+    (bitmask of the SMS of 'scan_result' that pass filter 'number',
+    True if it was cached)
+    """
+    global filter_columns
+    if( number in filter_masks ):
+        return filter_masks[number], True
+    f = global_filter_refs[number]
+    if( f.batch() and filter_columns is None ):
+        filter_columns = ResultColumns(scan_result)
+    filter_masks[number] = bool_mask(f.keep(scan_result, filter_columns))
+    return filter_masks[number], False
+
+def filter_select(filter_numbers):    
+    global global_filter_refs
+    global selected_filters
+    global scan_result
+    global filter_result
+    
+    selected_filters = []
+    filter_result = scan_result
+    partial = scan_job is not None and scan_job.running()
+    print('')
+    if( partial ):
+        if( not scan_job.keep_hits ):
+            print("\t% SMS stored on disk can be filtered when the scan is over")
+            return
+        # Filters are applied to the SMS found so far by the running scan
+        filter_result = scan_job.partial()
+    if( len(filter_numbers) == 0 ):
+        print("\t% Unselected all filters")
+        return 
+    elif( len(filter_result) == 0 ):
+        print("\t% No SMS to filter")
+        return 
+    filters = []
+    for num_arg in filter_numbers:
+        try:
+            num = int(num_arg)
+        except:
+            num = 9999
+        if( num >= len(global_filter_refs)):
+            print("\t% Ignored invalid filter number: {}".format(num_arg))
+        else:
+            filters.append(global_filter_refs[num])
+            selected_filters.append( num )
+    if( isinstance(filter_result, StoredResults) ):
+        # Filter the stored SMS batch by batch
+        filter_result = filter_result.store.select(filter_result, filters)
+    elif( partial ):
+        print("\t% Filtering the {} SMS found so far".format(len(filter_result)))
+        for f in filters:
+            filter_result = f.filter(filter_result)
+    else:
+        # AND of the cached masks of the filters
+        mask = (1 << len(scan_result))-1
+        for num in selected_filters:
+            f_mask, cached = filter_mask(num)
+            found = mask_count(mask)
+            mask &= f_mask
+            print("\t% Filter '{}': {} -> {} SMS{}".format(global_filter_refs[num].name,\
+                found, mask_count(mask), " (cached)" if cached else ""))
+        filter_result = MaskedResults(scan_result, mask)
+    selected_filters = list(set(selected_filters))
+
+CMD_FILTER_LIST = "filter-list"
+CMD_FILTER_LIST_SHORT = "fl"
+def filter_list():
+    global global_filter_refs
+    global selected_filters
+    print("\n\t-------------------------------")
+    print("\t"+bold("SMS-Tool-Kit filters"))
+    print("\t('"+green('*')+"'"+yellow(" indicate selected filters")+")")
+    print("\t-------------------------------\n")
+    
+    if( len(global_filter_refs) == 0):
+        print("\tNo filters are available")
+        return 
+        
+    for i in range(0,len(global_filter_refs)):
+        if( i in selected_filters ):
+            selected = green('* ')
+        else:
+            selected = '  ' 
+        print("\t{}.\t{}{}".format(i, selected, global_filter_refs[i].name))
+       
+
+CMD_PARSER_LIST = "parser-list"
+CMD_PARSER_LIST_SHORT = "pl"
+def parser_list():
+    global global_parser_refs
+    global selected_parsers
+    print("\n\t-------------------------------")
+    print("\t"+bold("SMS-Tool-Kit parsers"))
+    print("\t('"+green('*')+"'"+yellow(" indicate selected parsers")+")")
+    print("\t-------------------------------\n")
+    
+    if( len(global_parser_refs) == 0):
+        print("\tNo parsers are available")
+        return 
+        
+    for i in range(0, len(global_parser_refs)):
+        if( i in selected_parsers):
+            selected = green('* ')
+        else:
+            selected = '  ' 
+        
+        print("\t{}.\t{}{}".format(i, selected, global_parser_refs[i].name))
+
+CMD_QUIT = "quit"
+CMD_QUIT_SHORT = "q"
+
+CMD_HELP = "help"
+CMD_HELP_SHORT = "h"
+def show_help():
+    print("\n\t-------------------------")
+    print("\t"+bold("SMS-Tool-Kit commands"))
+    print("\t---------------------------\n")  
+
+    print("\n\t"+bold(CMD_LOAD)+', '+bold(CMD_LOAD_SHORT)+\
+        ":\t\tLoad a binary image to parse")
+    
+    print("\n\t"+bold(CMD_PARSER_LIST)+', '+bold(CMD_PARSER_LIST_SHORT)+\
+        ":\tShow available SMS parsers")
+    print("\n\t"+bold(CMD_PARSER_RUN)+', '+bold(CMD_PARSER_RUN_SHORT)+\
+        ":\t\tRun parsers on the loaded image"+\
+        "\n\t\t\t\t"+bold("Usage: ")+CMD_PARSER_RUN_SHORT+" <parser_num> [<parser_nums>]") 
+    
+    print("\n\t"+bold(CMD_SCAN_STATUS)+', '+bold(CMD_SCAN_STATUS_SHORT)+\
+        ":\tShow the progress of the background scan"+\
+        "\n\t\t\t\t(scans run in the background with: "+CMD_SET_SHORT+" background-scan on)")
+    print("\n\t"+bold(CMD_SCAN_PREVIEW)+', '+bold(CMD_SCAN_PREVIEW_SHORT)+\
+        ":\tShow the last SMS found by the background scan"+\
+        "\n\t\t\t\t"+bold("Usage: ")+CMD_SCAN_PREVIEW_SHORT+" [<number>]")
+    print("\n\t"+bold(CMD_SCAN_CANCEL)+', '+bold(CMD_SCAN_CANCEL_SHORT)+\
+        ":\tCancel the background scan, keeping the SMS found so far")
+
+    print("\n\t"+bold(CMD_PARTITION_LIST)+', '+bold(CMD_PARTITION_LIST_SHORT)+\
+        ":\tShow the MBR or GPT partitions of the loaded image")
+    print("\n\t"+bold(CMD_REGION_SET)+', '+bold(CMD_REGION_SET_SHORT)+\
+        ":\t\tRestrict the scans to partitions or offset ranges"+\
+        "\n\t\t\t\t"+bold("Usage: ")+CMD_REGION_SET_SHORT+" <partition>|<start>-<end> [...] | all"+\
+        "\n\t\t\t\t(partitions by name or number, no argument shows the regions)")
+    print("\n\t"+bold(CMD_TRIAGE)+', '+bold(CMD_TRIAGE_SHORT)+\
+        ":\t\tEstimate the SMS density of the image from random blocks"+\
+        "\n\t\t\t\t"+bold("Usage: ")+CMD_TRIAGE_SHORT+" [<parser nums>] [time=<s>] [filters=<nums>] [seed=<n>] [csv=<file>]"+\
+        "\n\t\t\t\t(with option scan-order density, scans start with the densest strata)")
+
+    print("\n\t"+bold(CMD_SCAN_RESUME)+', '+bold(CMD_SCAN_RESUME_SHORT)+\
+        ":\tResume an interrupted scan from its checkpoint"+\
+        "\n\t\t\t\t"+bold("Usage: ")+CMD_SCAN_RESUME_SHORT+" [<checkpoint_file>]")
+    
+    print("\n\t"+bold(CMD_FILTER_LIST)+', '+bold(CMD_FILTER_LIST_SHORT)+\
+        ":\tShow available SMS filters")
+    print("\n\t"+bold(CMD_FILTER_SELECT)+', '+bold(CMD_FILTER_SELECT_SHORT)+\
+        ":\tApply SMS filters"+\
+        "\n\t\t\t\t"+bold("Usage: ")+CMD_FILTER_SELECT_SHORT+" <filter_num> [<filter_nums>]")
+    
+    print("\n\t"+bold(CMD_WATCHLIST_LOAD)+', '+bold(CMD_WATCHLIST_LOAD_SHORT)+\
+        ":\tLoad the numbers of the 'Watch-list' filter"+\
+        "\n\t\t\t\t"+bold("Usage: ")+CMD_WATCHLIST_LOAD_SHORT+" <filename> [<country_code>]"+\
+        "\n\t\t\t\t(the country code replaces the 0 of national numbers)")
+    
+    print("\n\t"+bold(CMD_OVERLAP_RESOLVE)+', '+bold(CMD_OVERLAP_RESOLVE_SHORT)+\
+        ":\tKeep only the best of the overlapping SMS")
+
+    print("\n\t"+bold(CMD_QUERY)+', '+bold(CMD_QUERY_SHORT)+\
+        ":\t\tSelect SMS by number, date or offset"+\
+        "\n\t\t\t\t"+bold("Usage: ")+CMD_QUERY_SHORT+" [number=<num>] [from=<date>] [to=<date>]"+\
+        "\n\t\t\t\t\t[offset=<start>-<end>] [partition=<name>]"+\
+        "\n\t\t\t\t(dates in UTC: YYYY-MM-DD[THH:MM[:SS]])")
+
+    print("\n\t"+bold(CMD_SEARCH)+', '+bold(CMD_SEARCH_SHORT)+\
+        ":\t\tSearch SMS by keywords, or by substring between quotes"+\
+        "\n\t\t\t\t"+bold("Usage: ")+CMD_SEARCH_SHORT+" <word> [<words>] | \"<substring>\"")
+
+    print("\n\t"+bold(CMD_RESULTS_SAVE)+', '+bold(CMD_RESULTS_SAVE_SHORT)+\
+        ":\tSave the scan results (and their text index)"+\
+        "\n\t\t\t\t"+bold("Usage: ")+CMD_RESULTS_SAVE_SHORT+" <filename>")
+    print("\n\t"+bold(CMD_RESULTS_LOAD)+', '+bold(CMD_RESULTS_LOAD_SHORT)+\
+        ":\tLoad saved scan results"+\
+        "\n\t\t\t\t"+bold("Usage: ")+CMD_RESULTS_LOAD_SHORT+" <filename>")
+
+    print("\n\t"+bold(CMD_DIFF_IMAGES)+', '+bold(CMD_DIFF_IMAGES_SHORT)+\
+        ":\tCompare the SMS of several images of a device (new, removed, persistent)"+\
+        "\n\t\t\t\t"+bold("Usage: ")+CMD_DIFF_IMAGES_SHORT+" <file> <file> [<files>] [parsers=<nums>]"+\
+        "\n\t\t\t\t\t[filters=<nums>] [csv=<filename>]"+\
+        "\n\t\t\t\t(images, or results saved with "+CMD_RESULTS_SAVE_SHORT+")")
+
+    print("\n\t"+bold(CMD_EXPORT_EXCEL)+', '+bold(CMD_EXPORT_EXCEL_SHORT)+\
+        ":\tExport SMS in an excel file"+\
+        "\n\t\t\t\t"+bold("Usage: ")+CMD_EXPORT_EXCEL_SHORT+" <filename>")
+
+    print("\n\t"+bold(CMD_ENTROPY_EXPORT)+', '+bold(CMD_ENTROPY_EXPORT_SHORT)+\
+        ":\tExport the entropy map of the image (CSV)"+\
+        "\n\t\t\t\t"+bold("Usage: ")+CMD_ENTROPY_EXPORT_SHORT+" <filename>")
+
+    print("\n\t"+bold(CMD_SERVE)+', '+bold(CMD_SERVE_SHORT)+\
+        ":\t\tServe scans, filters, queries and exports over local HTTP"+\
+        "\n\t\t\t\t"+bold("Usage: ")+CMD_SERVE_SHORT+" [<port>] [<workers>]"+\
+        "\n\t\t\t\t(GET /scan?image=<file>&parsers=<nums>, /filter?result=<num>&filters=<nums>,"+\
+        "\n\t\t\t\t/query?result=<num>&number=..., /export?result=<num>, /status)")
+
+    print("\n\t"+bold(CMD_SET)+', '+bold(CMD_SET_SHORT)+\
+        ":\t\tShow or change the scan options"+\
+        "\n\t\t\t\t"+bold("Usage: ")+CMD_SET_SHORT+" [<option> <value>]")
+
+    print("\n\t"+bold(CMD_CONTEXT)+', '+bold(CMD_CONTEXT_SHORT)+\
+        ":\t\tShow the bytes of the image around an offset"+\
+        "\n\t\t\t\t"+bold("Usage: ")+CMD_CONTEXT_SHORT+" <offset> [<length>]")
+
+    print("\n\t"+bold(CMD_HELP)+', '+bold(CMD_HELP_SHORT)+\
+        ":\t\tShow this help")
+    
+    print("\n\t"+bold(CMD_QUIT)+', '+bold(CMD_QUIT_SHORT)+\
+        ":\t\tQuit the SMS-Tool-Kit")
+ 
+# Background scans
+JOB_STEP = 65536 # Max offsets scanned between two checks of a background scan
+JOB_PREVIEW = 10 # SMS shown by scan-preview by default
+JOB_PREVIEW_MAX = 100 # Last SMS kept for the preview
+scan_job = None # Last background scan
+
+class ScanCancelled(KeyboardInterrupt):
+    """
+    Raised in the thread of a background scan cancelled by scan-cancel:
+    the scan stops as if interrupted by Ctrl-C, but keeps its hits
+    """
+    pass
+
+class ScanJob:
+    """
+    Description
+    -----------
+    A scan running run_scan() in a background thread. The scan engine
+    reports to the job of its thread (see active_job): the charging
+    bars set 'progress' instead of printing, the collected hits are
+    added to the job, and check_job() stops the scan when the job is
+    cancelled. The hits are kept by parser (only the last ones if the
+    results are stored on disk) so that the SMS found so far can be
+    previewed and filtered
+    """
+    def __init__(self, parsers, saved=None):
+        self.parsers = parsers
+        self.saved = saved
+        self.keep_hits = scan_options["result-store"] == "memory"
+        self.hits = [[] for parser in parsers]
+        self.recent = collections.deque(maxlen=JOB_PREVIEW_MAX)
+        self.found = 0
+        self.progress = None # (done, total, message) of the last bar
+        self.cancelled = threading.Event()
+        self.start_time = time.time()
+        self.end_time = None
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def run(self):
+        try:
+            run_scan(self.parsers, self.saved)
+        except Exception as e:
+            print("\n\t% Error: background scan failed: {}".format(e))
+        self.end_time = time.time()
+
+    def running(self):
+        return self.thread.is_alive()
+
+    def add(self, hits, number):
+        self.found += len(hits)
+        self.recent.extend(hits)
+        if( self.keep_hits ):
+            self.hits[number].extend(hits)
+
+    def partial(self):
+        """
+        Returns the SMS found so far, in the order of the final results
+        """
+        return sum([list(hits) for hits in self.hits], [])
+
+    def cancel(self):
+        self.cancelled.set()
+        self.thread.join()
+
+def active_job():
+    """
+    Returns the background scan running in the current thread, None if
+    the current thread is not a background scan
+    """
+    job = scan_job
+    if( job and job.thread is threading.current_thread() ):
+        return job
+    return None
+
+def check_job():
+    """
+    Raises ScanCancelled in a background scan that was cancelled
+    """
+    job = active_job()
+    if( job and job.cancelled.is_set() ):
+        raise ScanCancelled()
+
+def scan_busy():
+    """
+    Returns True, with a message, if a background scan is running
+    """
+    if( scan_job and scan_job.running() ):
+        print("\t% A scan is running, wait for it or cancel it with: {}".format(CMD_SCAN_CANCEL_SHORT))
+        return True
+    return False
+
+def start_scan(parsers, saved=None):
+    """
+    Description
+    -----------
+    Runs the scan, in the background if the option 'background-scan'
+    is on
+    """
+    global scan_job
+    if( not scan_options["background-scan"] ):
+        run_scan(parsers, saved)
+        return
+    scan_job = ScanJob(parsers, saved)
+    scan_job.thread.start()
+    print("\t% Scan running in the background: {} (progress), {} (SMS found so far), {} (cancel)".format(\
+        CMD_SCAN_STATUS_SHORT, CMD_SCAN_PREVIEW_SHORT, CMD_SCAN_CANCEL_SHORT))
+
+CMD_PARSER_RUN = "parser-run"
+CMD_PARSER_RUN_SHORT = "pr"
+selected_parsers = []
+scan_result = [] # List of parsed SMS
+def parser_run(parser_numbers):
+    global selected_parsers
+    global global_parser_refs
+    global image_string
+
+    if( scan_busy() ):
+        return
+    selected_parsers = []
+    parsers = []
+    if( not image_string ):
+        print("You must load a binary before running parsers :) ")
+        return
+    print('')
+    for num_arg in parser_numbers:
+        try:
+            num = int(num_arg)
+        except:
+            num = 9999
+        if( num >= len(global_parser_refs)):
+            print("\t% Ignored invalid parser number: {}".format(num_arg))
+        else:
+            parsers.append(global_parser_refs[num])
+            selected_parsers.append (num )
+    start_scan(parsers)
+
+def scan_schedule(saved=None):
+    """
+    Description
+    -----------
+    Returns the regions scanned by parser-run, in the order of the
+    checkpoint 'saved' if the scan is resumed. With the option
+    "scan-order" set to "density" the regions of a raw image are cut
+    on the strata of its triage, the densest first
+    """
+    if( saved ):
+        return saved.get("schedule", saved.get("regions", []))
+    if( scan_options["scan-order"] == "density" and image_triage is not None\
+        and not isinstance(image_string, CompressedImage) ):
+        return image_triage.schedule(scan_regions)
+    return scan_regions
+
+def run_scan(parsers, saved=None):
+    """
+    Description
+    -----------
+    Runs the parsers on the loaded image and sets the scan results.
+    The scan is resumed from 'saved' if it is a loaded checkpoint
+    """
+    global selected_parsers
+    global scan_result
+    global filter_result
+    global image_string
+    global fill_report
+    global entropy_map
+    global text_index
+
+    store = None
+    if( scan_options["result-store"] == "disk" ):
+        if( sqlite3 is None ):
+            print("\t% Error: package 'sqlite3' missing, could not store results on disk")
+            return
+        if( isinstance(scan_result, StoredResults) ):
+            scan_result.store.close()
+            scan_result = filter_result = []
+            results_changed()
+        # A resumed scan adds its hits to the store of the interrupted one
+        store = ResultStore(scan_options["store-file"], create=not saved,\
+            durable=scan_options["checkpoint-interval"] > 0)
+        print("\t% Storing results in file: {}".format(store.filename))
+
+    fill_report = {}
+    entropy_map = array('B')
+    # Hits removed by the overlap resolution must not be indexed, and
+    # hits stored on disk are not kept in memory
+    if( scan_options["text-index"] and not scan_options["resolve-overlaps"] and not store ):
+        text_index = TextIndex()
+    else:
+        text_index = None
+    entropy_report[0] = 0
+    checkpoint = None
+    regions = scan_schedule(saved)
+    if( scan_options["checkpoint-interval"] > 0 ):
+        checkpoint = Checkpoint(scan_options["checkpoint-file"], scan_options["checkpoint-interval"],\
+            {"version": CHECKPOINT_VERSION, "image": image_filename, "image_size": image_size(image_string),\
+            "parsers": [parser.name for parser in parsers], "options": dict(scan_options),\
+            "regions": list(scan_regions), "schedule": regions}, store, saved)
+    sink = store.add_all if store else None
+    if( scan_regions ):
+        print("\t% Scanning regions: {}".format(", ".join([format_region(region) for region in scan_regions])))
+    if( regions != scan_regions ):
+        print("\t% Scanning the densest strata of the triage first")
+    try:
+        if( isinstance(image_string, CompressedImage) ):
+            res = parse_compressed(parsers, image_string, sink, checkpoint, regions)
+        elif( scan_options["scan-workers"] > 1 and len(regions) > 1 and os.name == "posix" ):
+            # Forked workers share the image, checkpoints are not saved
+            res = parse_parallel(parsers, image_string, regions, scan_options["scan-workers"], sink)
+        else:
+            res = parse(parsers, image_string, sink, checkpoint, regions)
+    except KeyboardInterrupt as e:
+        cancelled = isinstance(e, ScanCancelled)
+        print("\n\t% Scan {}".format("cancelled" if cancelled else "interrupted"))
+        if( checkpoint and checkpoint.position is not None ):
+            checkpoint.save()
+            print("\t% Progress saved in {}, resume with: {}".format(\
+                checkpoint.filename, CMD_SCAN_RESUME_SHORT))
+        if( not cancelled ):
+            if( store ):
+                store.close()
+            return
+        # A cancelled scan keeps the SMS found so far (and its checkpoint)
+        res = active_job().partial()
+        checkpoint = None
+    if( checkpoint ):
+        checkpoint.remove()
+    if( store ):
+        store.finish([parser.name for parser in parsers])
+        res = StoredResults(store)
+    if( scan_options["resolve-overlaps"] ):
+        found = len(res)
+        if( store ):
+            store.keep_hits(store.resolve_overlaps(res, overlap_score))
+            res = StoredResults(store)
+        else:
+            res = resolve_overlaps(res, overlap_score)
+        print("\t% Removed {} overlapping hits".format(found-len(res)))
+        if( scan_options["text-index"] and not store ):
+            text_index = TextIndex()
+            text_index.add_all(res)
+    selected_parsers = list(set(selected_parsers))
+    scan_result = res
+    filter_result = res
+    results_changed()
+    if( fill_report ):
+        print("\t% Skipped {} of constant fill ({})".format(\
+            human_size(sum(fill_report.values())),\
+            ", ".join(["0x{0:02x}: {1}".format(fill, human_size(nb))\
+                for fill, nb in sorted(fill_report.items())])))
+    if( entropy_report[0] ):
+        if( scan_options["entropy-mode"] == "last" ):
+            action = "Scanned last"
+        else:
+            action = "Skipped"
+        print("\t% {} {} of high-entropy blocks (> {} bits/byte)".format(\
+            action, human_size(entropy_report[0]), scan_options["entropy-threshold"]))
+        if( action == "Skipped" ):
+            print("\t% SMS in these blocks are missed, scan them with: {} entropy-mode last".format(\
+                CMD_SET_SHORT))
+    print(bold("\t% Found {} SMS".format(len(res))))
+
+CMD_OVERLAP_RESOLVE = "overlap-resolve"
+CMD_OVERLAP_RESOLVE_SHORT = "ov"
+def overlap_resolve():
+    global filter_result
+    print('')
+    # The results are replaced when the running scan ends
+    if( scan_busy() ):
+        return
+    if( len(filter_result) == 0 ):
+        print("\t% No SMS to resolve")
+        return
+    found = len(filter_result)
+    if( isinstance(filter_result, StoredResults) ):
+        store = filter_result.store
+        store.set_filtered(store.resolve_overlaps(filter_result, overlap_score))
+        filter_result = StoredResults(store, filtered=True)
+    else:
+        filter_result = resolve_overlaps(filter_result, overlap_score)
+    print(bold("\t% Kept {} of {} SMS ({} overlapping hits removed)".format(\
+        len(filter_result), found, found-len(filter_result))))
+
+CMD_WATCHLIST_LOAD = "watchlist-load"
+CMD_WATCHLIST_LOAD_SHORT = "wl"
+def watchlist_load(filename, country_code=""):
+    """
+    Description
+    -----------
+    Loads the watch-list of the 'Watch-list' filter: one number per
+    line (first column of CSV files), lines starting with '#' ignored
+    """
+    global watch_list
+    # Like the options, the filters do not change while a scan runs
+    if( scan_busy() ):
+        return
+    if( country_code and not country_code.lstrip("+").isdigit() ):
+        print("\t% Error: invalid country code: {}".format(country_code))
+        return
+    def numbers(f):
+        for line in f:
+            line = line.strip()
+            if( not line or line[0] == "#" ):
+                continue
+            if( "," in line or ";" in line or "\t" in line ):
+                line = re.split(r"[,;\t]", line, 1)[0].strip('"')
+            yield line
+    start = time.time()
+    try:
+        f = open(filename, "r")
+        if( scan_options["watchlist-bloom"] == "auto" ):
+            bloom = sum([1 for line in f]) > WATCHLIST_BLOOM_MIN
+            f.seek(0)
+        else:
+            bloom = scan_options["watchlist-bloom"] == "on"
+        watch_list = WatchList(numbers(f), country_code.lstrip("+"), bloom)
+        f.close()
+    except IOError as e:
+        print("\t% Error: could not read watch-list: {}".format(e))
+        return
+    results_changed()
+    print("\n\t% Loaded {} numbers in {:.2f} s{}".format(len(watch_list), time.time()-start,\
+        " (with a Bloom filter)" if bloom else ""))
+    if( watch_list.invalid ):
+        print("\t% Ignored {} invalid numbers".format(watch_list.invalid))
+
+CMD_SCAN_RESUME = "scan-resume"
+CMD_SCAN_RESUME_SHORT = "sr"
+def scan_resume(filename=None):
+    global selected_parsers
+    global global_parser_refs
+    global scan_options
+    global scan_regions
+    if( scan_busy() ):
+        return
+    if( filename is None ):
+        filename = scan_options["checkpoint-file"]
+    try:
+        f = open(filename, "rb")
+        saved = pickle.load(f)
+        f.close()
+    except Exception as e:
+        print("\t% Error: could not read checkpoint: {}".format(e))
+        return
+    if( not isinstance(saved, dict) or saved.get("version") != CHECKPOINT_VERSION ):
+        print("\t% Error: {} is not a checkpoint of this version".format(filename))
+        return
+    # Resume on the image that was scanned
+    if( image_filename != saved["image"] ):
+        load(saved["image"])
+    if( not image_string or image_size(image_string) != saved["image_size"] ):
+        print("\t% Error: image {} is missing or changed since the checkpoint".format(saved["image"]))
+        return
+    names = [parser.name for parser in global_parser_refs]
+    missing = [name for name in saved["parsers"] if name not in names]
+    if( missing ):
+        print("\t% Error: unknown parsers in checkpoint: {}".format(", ".join(missing)))
+        return
+    selected_parsers = [names.index(name) for name in saved["parsers"]]
+    # The options and regions of the interrupted scan give the same scan ranges
+    scan_options.update(saved["options"])
+    scan_regions = saved.get("regions", [])
+    print("\n\t% Resuming scan from checkpoint: {}".format(filename))
+    start_scan([global_parser_refs[num] for num in selected_parsers], saved)
+
+CMD_SCAN_STATUS = "scan-status"
+CMD_SCAN_STATUS_SHORT = "ss"
+def scan_status():
+    print('')
+    if( scan_job is None ):
+        print("\t% No background scan")
+        return
+    job = scan_job
+    if( job.running() ):
+        state = "running"
+    elif( job.cancelled.is_set() ):
+        state = "cancelled"
+    else:
+        state = "finished"
+    print("\t% Scan {} for {:.0f} s, parsers: {}".format(state,\
+        (job.end_time or time.time())-job.start_time, ", ".join([parser.name for parser in job.parsers])))
+    if( job.running() and job.progress ):
+        done, total, msg = job.progress
+        print("\t% {}{}%".format(msg, 100*done/max(1, total)))
+    print(bold("\t% {} SMS found".format(job.found)))
+
+CMD_SCAN_PREVIEW = "scan-preview"
+CMD_SCAN_PREVIEW_SHORT = "sp"
+def scan_preview(number_arg=None):
+    print('')
+    if( scan_job is None ):
+        print("\t% No background scan")
+        return
+    try:
+        number = min(int(number_arg), JOB_PREVIEW_MAX) if number_arg else JOB_PREVIEW
+    except ValueError:
+        print("\t% Invalid number of SMS: {}".format(number_arg))
+        return
+    recent = list(scan_job.recent)
+    print_sms_list(recent[max(0, len(recent)-number):], limit=number)
+    print(bold("\t% Last {} of {} SMS found".format(min(number, len(recent)), scan_job.found)))
+
+CMD_SCAN_CANCEL = "scan-cancel"
+CMD_SCAN_CANCEL_SHORT = "sc"
+def scan_cancel():
+    if( scan_job is None or not scan_job.running() ):
+        print("\n\t% No scan running")
+        return
+    print("\n\t% Cancelling scan...")
+    scan_job.cancel()
+
+CMD_PARTITION_LIST = "partition-list"
+CMD_PARTITION_LIST_SHORT = "pt"
+def partitions():
+    global image_partitions
+    if( image_partitions is None ):
+        image_partitions = find_partitions(image_string)
+    return image_partitions
+
+def find_partition(name):
+    """
+    Description
+    -----------
+    Returns the partition of the loaded image with name or number
+    'name', None if there is none
+    """
+    if( not image_string ):
+        return None
+    for i, partition in enumerate(partitions()):
+        if( partition.name == name or str(i) == name ):
+            return partition
+    return None
+
+def format_region(region):
+    start, end = region
+    if( end is None ):
+        return "0x{:x}-end".format(start)
+    return "0x{:x}-0x{:x}".format(start, end)
+
+def partition_list():
+    if( not image_string ):
+        print("You must load a binary first :) ")
+        return
+    print('')
+    if( not partitions() ):
+        print("\t% No MBR or GPT partition table found")
+        return
+    for i, partition in enumerate(partitions()):
+        print("\t{}.\t{:<20} {:<27} {:>10}  {}".format(i, partition.name,\
+            format_region((partition.start, partition.end)),\
+            human_size(partition.end-partition.start), partition.kind))
+
+CMD_REGION_SET = "region-set"
+CMD_REGION_SET_SHORT = "rg"
+def region_set(args):
+    """
+    Description
+    -----------
+    Sets the regions scanned by parser-run: partitions (by name or
+    number) or offset ranges "<start>-<end>", "all" scans all the image
+    """
+    global scan_regions
+    if( not image_string ):
+        print("You must load a binary first :) ")
+        return
+    print('')
+    if( not args ):
+        if( scan_regions ):
+            for region in scan_regions:
+                print("\t{}".format(format_region(region)))
+        else:
+            print("\t% Scanning all the image")
+        return
+    if( scan_busy() ):
+        return
+    if( args == ["all"] ):
+        scan_regions = []
+        print("\t% Scanning all the image")
+        return
+    regions = []
+    for arg in args:
+        partition = find_partition(arg)
+        if( partition ):
+            regions.append((partition.start, partition.end))
+            continue
+        offsets = parse_offset_range(arg)
+        if( offsets is None or (None not in offsets and offsets[0] >= offsets[1]) ):
+            print("\t% Error: unknown partition or invalid offset range: {}".format(arg))
+            return
+        regions.append((offsets[0] or 0, offsets[1]))
+    scan_regions = merge_regions(regions)
+    print("\t% Scan regions: {}".format(", ".join([format_region(region) for region in scan_regions])))
+
+CMD_TRIAGE = "triage"
+CMD_TRIAGE_SHORT = "tr"
+def triage(args):
+    """
+    Description
+    -----------
+    Runs the parsers and filters on random blocks of the image for a
+    few seconds, then shows the estimated number of SMS and the hit
+    density of the strata of the image. The triage is kept to scan the
+    densest strata first (option "scan-order")
+    """
+    global image_triage
+    global fill_report
+    global entropy_map
+    if( not image_string ):
+        print("You must load a binary first :) ")
+        return
+    if( scan_busy() ):
+        return
+    numbers = [arg for arg in args if not "=" in arg]
+    options = dict([arg.split("=", 1) for arg in args if "=" in arg])
+    print('')
+    if( [name for name in options if name not in ["time", "filters", "seed", "csv"]] ):
+        print("\t% Usage: {} [<parser nums>] [time=<s>] [filters=<nums>] [seed=<n>] [csv=<file>]".format(\
+            CMD_TRIAGE_SHORT))
+        return
+    try:
+        parser_numbers = number_list(",".join(numbers), global_parser_refs)\
+            if numbers else (sorted(set(selected_parsers)) or range(0, len(global_parser_refs)))
+        filter_numbers = number_list(options["filters"], global_filter_refs)\
+            if "filters" in options else sorted(set(selected_filters))
+        duration = float(options.get("time", TRIAGE_TIME))
+        seed = int(options["seed"]) if "seed" in options else None
+    except ValueError as e:
+        print("\t% {}".format(e))
+        return
+    parsers = [global_parser_refs[num] for num in parser_numbers]
+    filters = [global_filter_refs[num] for num in filter_numbers]
+    print("\t% Sampling blocks for {:.0f} s, parsers: {}{}".format(duration,\
+        ", ".join([parser.name for parser in parsers]),\
+        ", filters: "+", ".join([f.name for f in filters]) if filters else ""))
+    if( isinstance(image_string, CompressedImage) and image_string.size is None ):
+        print("\t% Decompressing the image once to get its size")
+    res = Triage(image_string, seed)
+    # The sampled blocks must not change the reports of the last scan
+    session = (fill_report, entropy_map, entropy_report[0])
+    fill_report = {}
+    entropy_map = array('B')
+    try:
+        nb_samples = res.run(image_string, parsers, filters, duration)
+    finally:
+        fill_report, entropy_map, entropy_report[0] = session
+    image_triage = res
+
+    sampled = sum([sum(stratum.sizes) for stratum in res.strata])
+    total, low, high = res.estimate()
+    print("\t% Sampled {} ({:.1f}% of the image) in {} blocks".format(human_size(sampled),\
+        100.0*sampled/max(1, res.size), nb_samples))
+    print(bold("\t% Estimated {:.0f} SMS (95% bounds: {:.0f} - {:.0f})".format(total, low, high)))
+    print('')
+    heatmap = res.heatmap()
+    step = res.strata[0].end-res.strata[0].start if res.strata else 0
+    for i in range(0, len(heatmap), HEATMAP_WIDTH):
+        print("\t0x{:010x} |{}|".format(res.strata[i].start, heatmap[i:i+HEATMAP_WIDTH]))
+    print("\t% One cell by {}, from '{}' (no hit) to '{}' (densest), '?' not sampled".format(\
+        human_size(step), HEATMAP_CHARS[0], HEATMAP_CHARS[-1]))
+    densest = sorted([stratum for stratum in res.strata if stratum.density() and stratum.density()[0] > 0],\
+        key=lambda stratum: -stratum.density()[0])
+    if( densest ):
+        print("\n\t"+bold("Densest strata (SMS/MB)"))
+        for stratum in densest[:QUERY_DISPLAY_LIMIT]:
+            density, low, high = stratum.density()
+            print("\t{}\t{:.1f} ({:.1f} - {:.1f}), {}/{} blocks".format(\
+                format_region((stratum.start, stratum.end)), density, low, high,\
+                len(stratum.counts), stratum.nb_blocks()))
+
+    if( "csv" in options ):
+        try:
+            f = open(options["csv"], "wb")
+            writer = csv.writer(f)
+            writer.writerow(["Start", "End", "Blocks", "Sampled blocks", "Hits",\
+                "Density (SMS/MB)", "Low bound", "High bound"])
+            for stratum in res.strata:
+                density = stratum.density() or ("", "", "")
+                writer.writerow([stratum.start, stratum.end, stratum.nb_blocks(), len(stratum.counts),\
+                    sum(stratum.counts)]+list(density))
+            f.close()
+            print("\n\t% Strata saved in {}".format(options["csv"]))
+        except IOError as e:
+            print("\t% Error: could not write {}: {}".format(options["csv"], e))
+    if( scan_options["scan-order"] != "density" ):
+        print("\n\t% Scan the densest strata first with: {} scan-order density".format(CMD_SET_SHORT))
+
+CMD_SET = "set"
+CMD_SET_SHORT = "s"
+def set_option(args):
+    global scan_options
+    if( len(args) < 2 ):
+        print('')
+        for name in sorted(scan_options.keys()):
+            print("\t{}\t{}".format(name, scan_options[name]))
+        return
+    # The running scan reads the options
+    if( scan_busy() ):
+        return
+    name, value = args[0], args[1]
+    if( name not in scan_options ):
+        print("\t% Unknown option: {}".format(name))
+        return
+    if( isinstance(scan_options[name], bool) ):
+        if( value.lower() not in ["on", "off", "true", "false", "1", "0"] ):
+            print("\t% Option {} must be on or off".format(name))
+            return
+        scan_options[name] = value.lower() in ["on", "true", "1"]
+    elif( name in scan_option_choices ):
+        if( value not in scan_option_choices[name] ):
+            print("\t% Option {} must be one of: {}".format(name,\
+                ", ".join(scan_option_choices[name])))
+            return
+        scan_options[name] = value
+    else:
+        try:
+            scan_options[name] = type(scan_options[name])(value)
+        except ValueError:
+            print("\t% Invalid value for option {}: {}".format(name, value))
+            return
+    # Filters can depend on options (bigram-threshold)
+    results_changed()
+    print("\t% {} = {}".format(name, scan_options[name]))
+
+
+CMD_ENTROPY_EXPORT = "entropy-export"
+CMD_ENTROPY_EXPORT_SHORT = "en"
+def entropy_export(filename):
+    global entropy_map
+    global filter_result
+    if( len(entropy_map) == 0 ):
+        print("\t% No entropy map, run parsers with entropy-mode skip or last")
+        return
+    hits = {}
+    for sms in filter_result:
+        block = sms.offset()/ENTROPY_BLOCK
+        hits[block] = hits.get(block, 0) + 1
+    try:
+        out = open(filename, "w")
+    except:
+        print("\t% Error: could not open file {}".format(filename))
+        return
+    out.write("Offset,Entropy,SMS\n")
+    for block in range(0, len(entropy_map)):
+        if( entropy_map[block] == ENTROPY_UNKNOWN ):
+            continue
+        out.write("{0:#x},{1:.2f},{2}\n".format(block*ENTROPY_BLOCK,\
+            float(entropy_map[block])/ENTROPY_SCALE, hits.get(block, 0)))
+    out.close()
+    print("\t% Entropy of {} blocks saved in file: {}".format(len(entropy_map), filename))
+
+CMD_QUERY = "query"
+CMD_QUERY_SHORT = "qr"
+QUERY_DISPLAY_LIMIT = 50 # Max SMS printed by a query
+result_index = None # Index of 'filter_result', built by the first query
+def parse_date_arg(string, end_of_day=False):
+    """
+    Description
+    -----------
+    Converts a UTC date "YYYY-MM-DD" or "YYYY-MM-DDTHH:MM[:SS]" into a
+    timestamp. If 'end_of_day' is set, a date without time gives the
+    last second of the day
+
+    Return
+    ------
+    The timestamp or None
+    """
+    for fmt in ["%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d"]:
+        try:
+            date = datetime.datetime.strptime(string, fmt)
+        except ValueError:
+            continue
+        epoch = calendar.timegm(date.timetuple())
+        if( fmt == "%Y-%m-%d" and end_of_day ):
+            epoch += 24*3600-1
+        return epoch
+    return None
+
+def parse_offset_range(string):
+    """
+    Description
+    -----------
+    Converts "<start>-<end>" into (start, end). Offsets can be decimal
+    or hexadecimal, and one of them can be omitted
+
+    Return
+    ------
+    (start or None, end or None), or None if the range is invalid
+    """
+    if( not "-" in string ):
+        return None
+    try:
+        return tuple([int(bound, 0) if bound else None for bound in string.split("-", 1)])
+    except ValueError:
+        return None
+
+def print_sms_list(sms_list, limit=QUERY_DISPLAY_LIMIT):
+    for sms in sms_list[:limit]:
+        msg = re.sub(u'[\x00-\x1f]', ' ', sms.message())
+        print(u"\t{0:#010x}  {1:<9} {2:<16} {3:<29} {4}".format(sms.offset(),\
+            sms.status(), sms.number(), sms.date(), msg[:50]))
+    if( len(sms_list) > limit ):
+        print("\t... {} more".format(len(sms_list)-limit))
+
+def query_criteria(args):
+    """
+    Description
+    -----------
+    Converts query arguments "<name>=<value>" into the criteria of
+    ResultIndex.query(). Raises ValueError if an argument is invalid
+    """
+    criteria = {}
+    for arg in args:
+        name, sep, value = arg.partition("=")
+        if( name == "number" and value ):
+            criteria["number"] = value
+        elif( name in ["from", "to"] ):
+            epoch = parse_date_arg(value, end_of_day=(name == "to"))
+            if( epoch is None ):
+                raise ValueError("Invalid date: {} (expected YYYY-MM-DD[THH:MM[:SS]])".format(value))
+            criteria["date_"+name] = epoch
+        elif( name == "offset" ):
+            offsets = parse_offset_range(value)
+            if( offsets is None ):
+                raise ValueError("Invalid offset range: {}".format(value))
+            criteria["offset_from"], criteria["offset_to"] = offsets
+        elif( name == "partition" ):
+            partition = find_partition(value)
+            if( partition is None ):
+                raise ValueError("Unknown partition: {}".format(value))
+            criteria["offset_from"], criteria["offset_to"] = partition.start, partition.end
+        else:
+            raise ValueError("Invalid query criterion: {}".format(arg))
+    return criteria
+
+def query(args):
+    global filter_result
+    global result_index
+    try:
+        criteria = query_criteria(args)
+    except ValueError as e:
+        print("\t% {}".format(e))
+        return
+    print('')
+    if( len(filter_result) == 0 ):
+        print("\t% No SMS to query")
+        return
+    if( isinstance(filter_result, StoredResults) ):
+        # Stored results have their own indexes
+        start = time.time()
+        res = filter_result.query(**criteria)
+        duration = time.time()-start
+        print_sms_list(res)
+        print(bold("\t% {} SMS ({:.1f} ms)".format(len(res), duration*1000)))
+        return
+    if( result_index is None or result_index.sms_list is not filter_result ):
+        start = time.time()
+        result_index = ResultIndex(filter_result)
+        print("\t% Indexed {} SMS in {:.2f} s".format(len(filter_result), time.time()-start))
+    start = time.time()
+    res = result_index.query(**criteria)
+    duration = time.time()-start
+    print_sms_list(res)
+    print(bold("\t% {} SMS ({:.1f} ms)".format(len(res), duration*1000)))
+
+CMD_SEARCH = "search"
+CMD_SEARCH_SHORT = "se"
+text_index = None # Full-text index of 'scan_result'
+def text_matcher(text):
+    """
+    Description
+    -----------
+    Returns a function giving the number of matches of a search in the
+    message of a SMS, with the rules of TextIndex: a quoted substring,
+    or words that must all be in the message
+    """
+    if( len(text) >= 2 and text[0] == '"' and text[-1] == '"' ):
+        substring = text[1:-1].decode("utf-8", "replace").lower()
+        return lambda sms: sms.message().lower().count(substring)
+    words = [word.lower() for word in text.decode("utf-8", "replace").split()]
+    def count(sms):
+        found = re.findall(r'\w+', sms.message().lower(), re.UNICODE)
+        if( not words or [word for word in words if word not in found] ):
+            return 0
+        return sum([found.count(word) for word in words])
+    return count
+
+def search(text):
+    global scan_result
+    global text_index
+    print('')
+    # The text index of the running scan is not complete
+    if( scan_busy() ):
+        return
+    if( len(scan_result) == 0 ):
+        print("\t% No SMS to search")
+        return
+    if( isinstance(scan_result, StoredResults) ):
+        # Stored results may not fit in memory: they are not indexed
+        start = time.time()
+        res = scan_result.store.search(scan_result, text_matcher(text))
+        duration = time.time()-start
+        print_sms_list([sms for count, sms in res])
+        print(bold("\t% {} SMS ({:.1f} ms, results on disk are not indexed)".format(len(res), duration*1000)))
+        return
+    if( text_index is None ):
+        start = time.time()
+        text_index = TextIndex()
+        text_index.add_all(scan_result)
+        print("\t% Indexed {} SMS in {:.2f} s".format(len(scan_result), time.time()-start))
+    start = time.time()
+    if( len(text) >= 2 and text[0] == '"' and text[-1] == '"' ):
+        res = text_index.search_substring(text[1:-1].decode("utf-8", "replace"))
+    else:
+        res = text_index.search_words(text.decode("utf-8", "replace").split())
+    duration = time.time()-start
+    print_sms_list([sms for count, sms in res])
+    print(bold("\t% {} SMS ({:.1f} ms)".format(len(res), duration*1000)))
+
+CMD_RESULTS_SAVE = "results-save"
+CMD_RESULTS_SAVE_SHORT = "rs"
+TEXT_INDEX_EXT = ".tix" # The text index is saved next to the results
+def results_save(filename):
+    global scan_result
+    global selected_parsers
+    global global_parser_refs
+    global text_index
+    try:
+        if( isinstance(scan_result, StoredResults) ):
+            # Stored results are saved as a copy of the database
+            scan_result.store.db.commit()
+            shutil.copyfile(scan_result.store.filename, filename)
+        else:
+            f = open(filename, "wb")
+            pickle.dump({"parsers": [global_parser_refs[num].name for num in selected_parsers],\
+                "sms": scan_result}, f, pickle.HIGHEST_PROTOCOL)
+            f.close()
+            if( text_index is not None ):
+                text_index.save(filename+TEXT_INDEX_EXT, scan_result)
+        # The index of results saved before in this file is stale
+        if( (isinstance(scan_result, StoredResults) or text_index is None)\
+            and os.path.exists(filename+TEXT_INDEX_EXT) ):
+            os.remove(filename+TEXT_INDEX_EXT)
+    except Exception as e:
+        print("\t% Error: could not save results: {}".format(e))
+        return
+    print("\t% {} SMS saved in file: {}".format(len(scan_result), filename))
+
+CMD_RESULTS_LOAD = "results-load"
+CMD_RESULTS_LOAD_SHORT = "rl"
+PICKLE_MAGIC = "\x80\x02" # Results saved by results-save (pickle protocol 2)
+def read_results(filename):
+    """
+    Description
+    -----------
+    Reads results saved by results-save: a pickle, or a copy of a store
+    on disk. Raises an exception if they can not be read
+
+    Return
+    ------
+    {"parsers": names of the parsers, "sms": list of SMS or StoredResults}
+    """
+    f = open(filename, "rb")
+    if( f.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC ):
+        # Results saved from a store on disk
+        f.close()
+        if( sqlite3 is None ):
+            raise ImportError("package 'sqlite3' missing")
+        store = ResultStore(filename)
+        return {"parsers": store.parser_names(), "sms": StoredResults(store)}
+    f.seek(0)
+    saved = pickle.load(f)
+    f.close()
+    if( not isinstance(saved, dict) or "sms" not in saved ):
+        raise ValueError("not a results file")
+    return saved
+
+def is_results_file(filename):
+    """
+    Returns True if 'filename' looks like results saved by results-save
+    rather than an image
+    """
+    f = open(filename, "rb")
+    head = f.read(len(SQLITE_MAGIC))
+    f.close()
+    return head == SQLITE_MAGIC or head[:2] == PICKLE_MAGIC
+
+def results_load(filename):
+    global scan_result
+    global filter_result
+    global selected_parsers
+    global selected_filters
+    global global_parser_refs
+    global text_index
+    if( scan_busy() ):
+        return
+    try:
+        saved = read_results(filename)
+    except Exception as e:
+        print("\t% Error: could not load results: {}".format(e))
+        return
+    index = None
+    if( os.path.exists(filename+TEXT_INDEX_EXT) and not isinstance(saved["sms"], StoredResults) ):
+        try:
+            index = TextIndex()
+            index.load(filename+TEXT_INDEX_EXT, saved["sms"])
+        except Exception as e:
+            # search builds the index again
+            print("\t% Ignored text index {}: {}".format(filename+TEXT_INDEX_EXT, e))
+            index = None
+    names = [parser.name for parser in global_parser_refs]
+    selected_parsers = [names.index(name) for name in saved["parsers"] if name in names]
+    selected_filters = []
+    if( isinstance(scan_result, StoredResults) ):
+        scan_result.store.close()
+    scan_result = saved["sms"]
+    filter_result = scan_result
+    results_changed()
+    text_index = index
+    print("\t% Loaded {} SMS from file: {}".format(len(scan_result), filename))
 
-class Parser:
-    def __init__(self, name, sms_type, func_list):
-        global global_parser_refs
-        self.parse_functions = func_list
-        self.sms_type = sms_type
-        self.name = name
-        global_parser_refs.append(self)
-        
+EXPORT_COLUMNS = ["Offset in binary", "Status", "Number", "Data", "Date (DD:MM:YYYY HH:MM:SS UTC)", "Date (UTC+00)"]
+CMD_EXPORT_EXCEL = "export-excel"
+CMD_EXPORT_EXCEL_SHORT = "ee"
+def export_excel(filename):
+    global filter_result
+    try:
+        import openpyxl
+    except:
+        print("\tError: package 'openpyxl' missing, could not export sms")
+        exit(1)
         
-    def parse(self, img):
+    # Write-only workbooks write the rows as they come: 'filter_result'
+    # can be read from the disk without being held in memory
+    out = openpyxl.Workbook(write_only=True)
+    sheet = out.create_sheet("SMS Scan Results")
+    sheet.append(EXPORT_COLUMNS)
+    for sms in filter_result:
+        sheet.append(sms.excel_output())
+    out.save(filename)
+    print("{} SMS saved in file: {}".format(str(len(filter_result)), filename))
+
+
+CMD_SERVE = "serve"
+CMD_SERVE_SHORT = "sv"
+SERVE_PORT = 8765
+SERVE_WORKERS = 4 # Requests handled at once
+SERVE_QUERY_LIMIT = 1000 # Default max SMS returned by a query
+scan_cache = None # Kept between two 'serve' commands
+
+def isolated_scan(img, parsers):
+    """
+    Description
+    -----------
+    Runs parsers on an image without changing the results, reports and
+    text index of the interactive session
+
+    Return
+    ------
+    The list of SMS
+    """
+    global fill_report
+    global entropy_map
+    global text_index
+    session = (fill_report, entropy_map, entropy_report[0], text_index)
+    fill_report = {}
+    entropy_map = array('B')
+    entropy_report[0] = 0
+    text_index = None
+    try:
+        if( isinstance(img, CompressedImage) ):
+            res = parse_compressed(parsers, img)
+        else:
+            res = parse(parsers, img)
+        if( scan_options["resolve-overlaps"] ):
+            res = resolve_overlaps(res, overlap_score)
+    finally:
+        fill_report, entropy_map, entropy_report[0], text_index = session
+    return res
+
+class CacheEntry:
+    """
+    A value computed by the first request that needs it. The other
+    requests wait for it instead of computing it again
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = None
+
+class ScanCache:
+    """
+    Description
+    -----------
+    Images, scan results, filter results and query indexes kept by the
+    scan server and shared by all its clients. Results get a number
+    that clients use in their next requests.
+    The scan engine has a single state (options, reports), so only one
+    scan runs at a time. Loads, filters and queries run concurrently
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.scan_lock = threading.Lock()
+        self.entries = {}
+        self.results = [] # (description, list of SMS)
+
+    def get(self, key, compute):
         """
         Description
         -----------
-        Parses an image and returns a list of SMS
-        
-        Parameters
-        ----------
-        img : a string of bytes
-        
-        Returns
-        -------
-        A list of sms instances 
+        Returns the value cached for 'key', computed by compute() if
+        it is not cached yet
+
+        Return
+        ------
+        (value, True if the value was cached)
         """
-        
-        res = []
-        for i in range(0,len(img)):
-            charging_bar(len(img)-1, i, 20, msg="Parser '{}': ".format(self.name),\
-                end_msg = "{} SMS found".format(len(res)))
-            sms = new_sms(self.sms_type)
-            sms.bin_offset = i
-            offset = 0
-            for func in self.parse_functions:
-                if( i+offset >= len(img)):
-                    sms = None
-                    break
-                parsed_bytes = func(img, i+offset, sms)
-                if( parsed_bytes == ERROR):
-                    sms = None
-                    break
-                else:
-                    offset += parsed_bytes 
-            if( sms ):
-                res.append(sms)
-        return res
+        with self.lock:
+            entry = self.entries.setdefault(key, CacheEntry())
+        with entry.lock:
+            cached = entry.value is not None
+            if( not cached ):
+                entry.value = compute()
+        return entry.value, cached
 
+    def add_result(self, description, sms_list):
+        with self.lock:
+            self.results.append((description, sms_list))
+            return len(self.results)-1
 
-#################
-# Filter class ##
-#################
+    def result(self, number):
+        with self.lock:
+            if( number < 0 or number >= len(self.results) ):
+                raise ValueError("Unknown result: {}".format(number))
+            return self.results[number][1]
 
-global_filter_refs = []
-class Filter:
-    def __init__(self, name, func_list):
-        global global_filter_refs
-        self.name = name
-        self.filter_functions = func_list 
-        global_filter_refs.append(self)
-        
-    def filter(self, sms_list):
-        msg = "\t% Filter '{}': {} -> ".format(self.name, len(sms_list))
-        tmp = sms_list
-        for func in self.filter_functions:
-            tmp = [sms for sms in tmp if func(sms)]
-        msg += "{} SMS".format(len(tmp))
-        print(msg)
-        return tmp
+    def image_key(self, filename):
+        """
+        Key of an image file, it changes if the file is modified
+        """
+        filename = os.path.abspath(filename)
+        info = os.stat(filename)
+        return ("image", filename, info.st_size, info.st_mtime)
 
-        
+    def image(self, filename):
+        """
+        Return
+        ------
+        (key, image): the image stays in memory
+        """
+        key = self.image_key(filename)
+        return key, self.get(key, lambda: read_image(key[1]))[0]
 
-#####################
-##### CLI script ####
-#####################
+    def scan(self, filename, parser_numbers, keep_image=True):
+        """
+        Description
+        -----------
+        Scans an image, or returns the cached result of the same scan.
+        With 'keep_image' False the image is read for this scan only
 
-def bold(string):
-    return '\033[1m'+string+'\033[0m'
-    
-def yellow(string):
-    return '\033[93m'+string+'\033[0m'
-    
-def green(string):
-    return '\033[92m'+string+'\033[0m'
+        Return
+        ------
+        (result number, True if the result was cached)
+        """
+        if( keep_image ):
+            image_key, img = self.image(filename)
+        else:
+            image_key, img = self.image_key(filename), None
+        parsers = [global_parser_refs[num] for num in parser_numbers]
+        def compute():
+            image = img if img is not None else read_image(image_key[1])
+            with self.scan_lock:
+                res = isolated_scan(image, parsers)
+            return self.add_result({"image": image_key[1], "parsers": parser_numbers}, res)
+        return self.get(("scan", image_key, tuple(parser_numbers),\
+            tuple(sorted(scan_options.items()))), compute)
 
-def parse(parsers, img):
-    res = []
-    for parser in parsers:
-        res += parser.parse(img)
-    return res
+    def filter(self, number, filter_numbers):
+        sms_list = self.result(number)
+        def compute():
+            res = sms_list
+            for num in filter_numbers:
+                res = global_filter_refs[num].filter(res)
+            return self.add_result({"result": number, "filters": filter_numbers}, res)
+        return self.get(("filter", number, tuple(filter_numbers)), compute)
 
-def filter_sms(filter_list, sms_list):
-    tmp = sms_list
-    for f in filter_list:
-        tmp = [sms for sms in tmp if f(sms)]
-    return tmp
-        
-# Commands
-CMD_LOAD = "load"
-CMD_LOAD_SHORT = "l"
-image_string = []
-def load(filename):
-    global image_string
-    # Read the binary 
+    def query(self, number, criteria):
+        sms_list = self.result(number)
+        index = self.get(("index", number), lambda: ResultIndex(sms_list))[0]
+        return index.query(**criteria)
+
+def number_list(string, refs):
+    """
+    Converts "0,2" into [0, 2], checking that the numbers are in 'refs'
+    """
     try:
-        f = open(filename, "rb")
-        image_string = f.read()  
-        print("\n\t% Loaded file: " + filename) 
-    except:
-        print("\t% Error: could not read binary")
-        return 
+        res = [int(num) for num in string.split(",") if num]
+    except ValueError:
+        raise ValueError("Invalid numbers: {}".format(string))
+    if( not res or [num for num in res if num < 0 or num >= len(refs)] ):
+        raise ValueError("Invalid numbers: {}".format(string))
+    return res
 
+def sms_json(sms):
+    return {"offset": sms.offset(), "status": sms.status(), "number": sms.number(),\
+        "source": sms.source(), "dest": sms.dest(), "date": sms.date(),\
+        "date_utc": sms.date_utc(), "message": sms.message()}
 
-CMD_FILTER_SELECT = "filter-apply"
-CMD_FILTER_SELECT_SHORT = "fa"
-selected_filters = []
-filter_result = []
-def filter_select(filter_numbers):    
-    global global_filter_refs
-    global selected_filters
-    global scan_result
-    global filter_result
-    
-    selected_filters = []
-    filter_result = scan_result
-    print('')
-    if( len(filter_numbers) == 0 ):
-        print("\t% Unselected all filters")
-        return 
-    elif( len(filter_result) == 0 ):
-        print("\t% No SMS to filter")
-        return 
-    for num_arg in filter_numbers:
+def serve_scan(cache, params):
+    number, cached = cache.scan(params["image"], number_list(params["parsers"], global_parser_refs))
+    return {"result": number, "sms": len(cache.result(number)), "cached": cached}
+
+def serve_filter(cache, params):
+    number, cached = cache.filter(int(params["result"]), number_list(params["filters"], global_filter_refs))
+    return {"result": number, "sms": len(cache.result(number)), "cached": cached}
+
+def serve_query(cache, params):
+    criteria = query_criteria(["{}={}".format(name, params[name])\
+        for name in ["number", "from", "to", "offset"] if name in params])
+    res = cache.query(int(params["result"]), criteria)
+    limit = int(params.get("limit", SERVE_QUERY_LIMIT))
+    return {"sms": len(res), "list": [sms_json(sms) for sms in res[:limit]]}
+
+def serve_export(cache, params):
+    """
+    The SMS of a result in CSV, with the columns of the excel export
+    """
+    out = StringIO()
+    writer = csv.writer(out)
+    writer.writerow(EXPORT_COLUMNS)
+    for sms in cache.result(int(params["result"])):
+        writer.writerow([unicode(value).encode("utf-8") for value in sms.excel_output()])
+    return out.getvalue()
+
+def serve_status(cache, params):
+    with cache.lock:
+        return {"images": sorted([key[1] for key in cache.entries if key[0] == "image"]),\
+            "results": [dict(description, result=number, sms=len(sms_list))\
+                for number, (description, sms_list) in enumerate(cache.results)]}
+
+SERVE_ACTIONS = {
+    "/scan": serve_scan, # image=<file>&parsers=<nums>
+    "/filter": serve_filter, # result=<num>&filters=<nums>
+    "/query": serve_query, # result=<num>[&number=][&from=][&to=][&offset=][&limit=]
+    "/export": serve_export, # result=<num>
+    "/status": serve_status,
+}
+
+class ScanRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Description
+    -----------
+    Answers GET /<action>?<parameters> requests (see SERVE_ACTIONS)
+    with JSON, or CSV for exports
+    """
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        params = dict([(name, values[-1]) for name, values in urlparse.parse_qs(url.query).items()])
+        action = SERVE_ACTIONS.get(url.path)
+        if( action is None ):
+            self.answer(404, {"error": "Unknown action: {}".format(url.path)})
+            return
         try:
-            num = int(num_arg)
-        except:
-            num = 9999
-        if( num >= len(global_filter_refs)):
-            print("\t% Ignored invalid filter number: {}".format(num_arg))
-        else:
-            # Filter it
-            filter_result = global_filter_refs[num].filter(filter_result)
-            selected_filters.append( num )
-    selected_filters = list(set(selected_filters))
+            self.answer(200, action(self.server.cache, params))
+        except KeyError as e:
+            self.answer(400, {"error": "Missing parameter: {}".format(e)})
+        except ValueError as e:
+            self.answer(400, {"error": str(e)})
+        except (IOError, OSError, ImportError) as e:
+            self.answer(404, {"error": str(e)})
+        except Exception as e:
+            self.answer(500, {"error": str(e)})
 
-CMD_FILTER_LIST = "filter-list"
-CMD_FILTER_LIST_SHORT = "fl"
-def filter_list():
-    global global_filter_refs
-    global selected_filters
-    print("\n\t-------------------------------")
-    print("\t"+bold("SMS-Tool-Kit filters"))
-    print("\t('"+green('*')+"'"+yellow(" indicate selected filters")+")")
-    print("\t-------------------------------\n")
-    
-    if( len(global_filter_refs) == 0):
-        print("\tNo filters are available")
-        return 
-        
-    for i in range(0,len(global_filter_refs)):
-        if( i in selected_filters ):
-            selected = green('* ')
+    def answer(self, code, body):
+        if( isinstance(body, str) ):
+            content_type = "text/csv; charset=utf-8"
         else:
-            selected = '  ' 
-        print("\t{}.\t{}{}".format(i, selected, global_filter_refs[i].name))
-       
+            content_type = "application/json"
+            body = json.dumps(body)
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
-CMD_PARSER_LIST = "parser-list"
-CMD_PARSER_LIST_SHORT = "pl"
-def parser_list():
-    global global_parser_refs
-    global selected_parsers
-    print("\n\t-------------------------------")
-    print("\t"+bold("SMS-Tool-Kit parsers"))
-    print("\t('"+green('*')+"'"+yellow(" indicate selected parsers")+")")
-    print("\t-------------------------------\n")
-    
-    if( len(global_parser_refs) == 0):
-        print("\tNo parsers are available")
-        return 
-        
-    for i in range(0, len(global_parser_refs)):
-        if( i in selected_parsers):
-            selected = green('* ')
-        else:
-            selected = '  ' 
-        
-        print("\t{}.\t{}{}".format(i, selected, global_parser_refs[i].name))
+    def log_message(self, fmt, *args):
+        print("\t% {} {}".format(self.client_address[0], fmt % args))
 
-CMD_QUIT = "quit"
-CMD_QUIT_SHORT = "q"
+class ScanServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    HTTP server handling the requests on a pool of threads
+    """
+    daemon_threads = True
+    def __init__(self, address, cache, workers):
+        BaseHTTPServer.HTTPServer.__init__(self, address, ScanRequestHandler)
+        self.cache = cache
+        self.pool = ThreadPool(workers)
 
-CMD_HELP = "help"
-CMD_HELP_SHORT = "h"
-def show_help():
-    print("\n\t-------------------------")
-    print("\t"+bold("SMS-Tool-Kit commands"))
-    print("\t---------------------------\n")  
+    def process_request(self, request, client_address):
+        self.pool.apply_async(self.process_request_thread, (request, client_address))
+
+def serve(port_arg=None, workers_arg=None):
+    global scan_cache
+    # The scans of the clients swap the reports and the text index of
+    # the session, which the running scan writes
+    if( scan_busy() ):
+        return
+    try:
+        port = int(port_arg) if port_arg else SERVE_PORT
+        workers = int(workers_arg) if workers_arg else SERVE_WORKERS
+    except ValueError:
+        print("\t% Error: invalid port or number of workers")
+        return
+    if( scan_cache is None ):
+        scan_cache = ScanCache()
+    if( image_filename and image_string ):
+        # The loaded image is shared with the clients
+        filename = os.path.abspath(image_filename)
+        info = os.stat(filename)
+        scan_cache.get(("image", filename, info.st_size, info.st_mtime), lambda: image_string)
+    try:
+        server = ScanServer(("127.0.0.1", port), scan_cache, workers)
+    except Exception as e:
+        print("\t% Error: could not start the server: {}".format(e))
+        return
+    print("\n\t% Serving on http://127.0.0.1:{}/ with {} workers, Ctrl-C to stop".format(port, workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    server.pool.terminate()
+    print("\n\t% Server stopped, {} results cached".format(len(scan_cache.results)))
+
+CMD_DIFF_IMAGES = "diff-images"
+CMD_DIFF_IMAGES_SHORT = "di"
+def sms_fingerprint(sms):
+    """
+    Description
+    -----------
+    Identifies a SMS across images by its content: status, normalized
+    number, timestamp and message (with normalized spaces). Where the
+    SMS is in the image is not part of it
+
+    Return
+    ------
+    A 16 bytes digest
+    """
+    number = sms.number()
+    message = sms.message()
+    if( isinstance(message, str) ):
+        message = message.decode("utf-8", "replace")
+    message = unicodedata.normalize("NFC", u" ".join(message.split()))
+    key = u"\x00".join([sms.status(), normalize_number(number) or number,\
+        unicode(sms.epoch()), message])
+    return hashlib.md5(key.encode("utf-8")).digest()
+
+def diff_results(results):
+    """
+    Description
+    -----------
+    Joins the SMS of several images on their fingerprints, with a hash
+    table: each list of SMS is read once, whatever the number of SMS
+
+    Parameters
+    ----------
+    results : lists of SMS, one by image
+
+    Return
+    ------
+    A list of rows [SMS, offsets in image 0, ..., offsets in image N-1]:
+    one row by fingerprint, the offsets are None if the SMS is not in
+    the image. Rows are sorted by first image and offset
+    """
+    table = {}
+    for i in range(0, len(results)):
+        for sms in results[i]:
+            fingerprint = sms_fingerprint(sms)
+            row = table.get(fingerprint)
+            if( row is None ):
+                row = table[fingerprint] = [sms]+[None]*len(results)
+            if( row[1+i] is None ):
+                row[1+i] = []
+            row[1+i].append(sms.offset())
+    rows = table.values()
+    for row in rows:
+        for offsets in row[1:]:
+            if( offsets ):
+                offsets[:] = sorted(set(offsets))
+    def first_seen(row):
+        for i in range(1, len(row)):
+            if( row[i] is not None ):
+                return (i, row[i][0])
+    rows.sort(key=first_seen)
+    return rows
+
+def diff_change(row):
+    """
+    Change of a row of diff_results() between the first and the last
+    image: persistent, new, removed or intermittent (appears and
+    disappears in between)
+    """
+    present = [offsets is not None for offsets in row[1:]]
+    if( all(present) ):
+        return "persistent"
+    if( present[-1] and not present[0] ):
+        return "new"
+    if( present[0] and not present[-1] ):
+        return "removed"
+    return "intermittent"
 
-    print("\n\t"+bold(CMD_LOAD)+', '+bold(CMD_LOAD_SHORT)+\
-        ":\t\tLoad a binary image to parse")
-    
-    print("\n\t"+bold(CMD_PARSER_LIST)+', '+bold(CMD_PARSER_LIST_SHORT)+\
-        ":\tShow available SMS parsers")
-    print("\n\t"+bold(CMD_PARSER_RUN)+', '+bold(CMD_PARSER_RUN_SHORT)+\
-        ":\t\tRun parsers on the loaded image"+\
-        "\n\t\t\t\t"+bold("Usage: ")+CMD_PARSER_RUN_SHORT+" <parser_num> [<parser_nums>]") 
-    
-    print("\n\t"+bold(CMD_FILTER_LIST)+', '+bold(CMD_FILTER_LIST_SHORT)+\
-        ":\tShow available SMS filters")
-    print("\n\t"+bold(CMD_FILTER_SELECT)+', '+bold(CMD_FILTER_SELECT_SHORT)+\
-        ":\tApply SMS filters"+\
-        "\n\t\t\t\t"+bold("Usage: ")+CMD_FILTER_SELECT_SHORT+" <filter_num> [<filter_nums>]")
-    
-    print("\n\t"+bold(CMD_EXPORT_EXCEL)+', '+bold(CMD_EXPORT_EXCEL_SHORT)+\
-        ":\tExport SMS in an excel file"+\
-        "\n\t\t\t\t"+bold("Usage: ")+CMD_EXPORT_EXCEL_SHORT+" <filename>")
-    
-    print("\n\t"+bold(CMD_HELP)+', '+bold(CMD_HELP_SHORT)+\
-        ":\t\tShow this help")
-    
-    print("\n\t"+bold(CMD_QUIT)+', '+bold(CMD_QUIT_SHORT)+\
-        ":\t\tQuit the SMS-Tool-Kit")
- 
-CMD_PARSER_RUN = "parser-run"
-CMD_PARSER_RUN_SHORT = "pr"
-selected_parsers = []
-scan_result = [] # List of parsed SMS
-def parser_run(parser_numbers):
-    global selected_parsers
-    global global_parser_refs
-    global scan_result
-    global filter_result
-    global image_string
-    
-    selected_parsers = []
-    res = []
-    if( not image_string ):
-        print("You must load a binary before running parsers :) ")
+def format_offsets(offsets):
+    if( offsets is None ):
+        return ""
+    return " ".join(["0x{:x}".format(offset) for offset in offsets])
+
+def diff_images(args):
+    """
+    Description
+    -----------
+    Compares the SMS of several acquisitions of a device: images are
+    scanned (the scans are cached) or results saved by results-save are
+    read, then the SMS are joined on their fingerprints
+    """
+    global scan_cache
+    # Images are scanned by isolated_scan(), like the scans of serve
+    if( scan_busy() ):
         return
+    files = [arg for arg in args if not "=" in arg]
+    options = dict([arg.split("=", 1) for arg in args if "=" in arg])
     print('')
-    for num_arg in parser_numbers:
-        try:
-            num = int(num_arg)
-        except:
-            num = 9999
-        if( num >= len(global_parser_refs)):
-            print("\t% Ignored invalid parser number: {}".format(num_arg))
-        else:
-            res += global_parser_refs[num].parse(image_string)
-            selected_parsers.append (num )
-    
-    selected_parsers = list(set(selected_parsers))
-    scan_result = res
-    filter_result = res
-    print(bold("\t% Found {} SMS".format(len(res))))
-        
-    
-CMD_EXPORT_EXCEL = "export-excel"
-CMD_EXPORT_EXCEL_SHORT = "ee"
-def export_excel(filename):
-    global filter_result
+    if( len(files) < 2 or [name for name in options if name not in ["parsers", "filters", "csv"]] ):
+        print("\t% Usage: {} <file> <file> [<files>] [parsers=<nums>] [filters=<nums>] [csv=<file>]".format(\
+            CMD_DIFF_IMAGES_SHORT))
+        return
     try:
-        import openpyxl
-    except:
-        print("\tError: package 'openpyxl' missing, could not export sms")
-        exit(1)
-        
-    out = openpyxl.Workbook()
-    out.active.title = "SMS Scan Results"
-    out.active.append(["Offset in binary", "Status", "Number", "Data", "Date (DD:MM:YYYY HH:MM:SS UTC)", "Date (UTC+00)"])
-    for sms in filter_result:
-        out.active.append(sms.excel_output())
-    out.save(filename)
-    print("{} SMS saved in file: {}".format(str(len(filter_result)), filename))
-    
-    
+        parser_numbers = number_list(options.get("parsers", ""), global_parser_refs)\
+            if "parsers" in options else (sorted(set(selected_parsers)) or range(0, len(global_parser_refs)))
+        filter_numbers = number_list(options["filters"], global_filter_refs) if "filters" in options else []
+    except ValueError as e:
+        print("\t% {}".format(e))
+        return
+    if( scan_cache is None ):
+        scan_cache = ScanCache()
+    results = []
+    for filename in files:
+        try:
+            if( is_results_file(filename) ):
+                sms_list = read_results(filename)["sms"]
+                print("\t% {}: {} SMS (saved results)".format(filename, len(sms_list)))
+                if( filter_numbers ):
+                    sms_list = list(sms_list)
+                    for num in filter_numbers:
+                        sms_list = global_filter_refs[num].filter(sms_list)
+            else:
+                # Images are not kept in memory, only their results
+                number, cached = scan_cache.scan(filename, parser_numbers, keep_image=False)
+                print("\t% {}: {} SMS{}".format(filename, len(scan_cache.result(number)),\
+                    " (cached scan)" if cached else ""))
+                if( filter_numbers ):
+                    number, cached = scan_cache.filter(number, filter_numbers)
+                sms_list = scan_cache.result(number)
+        except Exception as e:
+            print("\t% Error: could not read {}: {}".format(filename, e))
+            return
+        results.append(sms_list)
+
+    start = time.time()
+    rows = diff_results(results)
+    print("\t% Joined {} SMS in {:.2f} s".format(sum([len(res) for res in results]), time.time()-start))
+    print('')
+    for i in range(0, len(files)):
+        print("\t{}.\t{}: {} distinct SMS".format(i, files[i],\
+            len([row for row in rows if row[1+i] is not None])))
+    for i in range(1, len(files)):
+        print("\t{} -> {}:\t{} new, {} removed".format(i-1, i,\
+            len([row for row in rows if row[i] is None and row[1+i] is not None]),\
+            len([row for row in rows if row[i] is not None and row[1+i] is None])))
+    changes = collections.Counter([diff_change(row) for row in rows])
+    print(bold("\t% {} persistent, {} new, {} removed, {} intermittent SMS".format(changes["persistent"],\
+        changes["new"], changes["removed"], changes["intermittent"])))
+    for change in ["new", "removed", "intermittent"]:
+        selected = [row for row in rows if diff_change(row) == change]
+        if( not selected ):
+            continue
+        print("\n\t"+bold(change.capitalize()+" SMS"))
+        for row in selected[:QUERY_DISPLAY_LIMIT]:
+            sms = row[0]
+            msg = re.sub(u'[\x00-\x1f]', ' ', sms.message())
+            print(u"\t{0:<9} {1:<16} {2:<29} {3}".format(sms.status(), sms.number(), sms.date(), msg[:50]))
+            print("\t\t"+"  ".join(["{}: {}".format(i, format_offsets(row[1+i]) or "-")\
+                for i in range(0, len(files))]))
+        if( len(selected) > QUERY_DISPLAY_LIMIT ):
+            print("\t... {} more".format(len(selected)-QUERY_DISPLAY_LIMIT))
+
+    if( "csv" in options ):
+        try:
+            f = open(options["csv"], "wb")
+            writer = csv.writer(f)
+            writer.writerow(["Change", "Status", "Number", "Date", "Message"]+\
+                ["Offsets in "+os.path.basename(filename) for filename in files])
+            for row in rows:
+                sms = row[0]
+                writer.writerow([unicode(value).encode("utf-8") for value in\
+                    [diff_change(row), sms.status(), sms.number(), sms.date(), sms.message()]]+\
+                    [format_offsets(offsets) for offsets in row[1:]])
+            f.close()
+        except IOError as e:
+            print("\t% Error: could not write {}: {}".format(options["csv"], e))
+            return
+        print("\n\t% {} SMS saved in file: {}".format(len(rows), options["csv"]))
+
 def main():
     finish = False
     while(not finish):
@@ -800,12 +4716,36 @@ def main():
                 parser_run(user_args[1:])
             else:
                 print("Missing parser numbers")
+        elif( command in [CMD_WATCHLIST_LOAD, CMD_WATCHLIST_LOAD_SHORT]):
+            if( len(user_args) >= 2 ):
+                watchlist_load(*user_args[1:3])
+            else:
+                print("Missing file name")
+        elif( command in [CMD_SCAN_RESUME, CMD_SCAN_RESUME_SHORT]):
+            scan_resume(*user_args[1:2])
+        elif( command in [CMD_DIFF_IMAGES, CMD_DIFF_IMAGES_SHORT]):
+            diff_images(user_args[1:])
+        elif( command in [CMD_SCAN_STATUS, CMD_SCAN_STATUS_SHORT]):
+            scan_status()
+        elif( command in [CMD_SCAN_PREVIEW, CMD_SCAN_PREVIEW_SHORT]):
+            scan_preview(*user_args[1:2])
+        elif( command in [CMD_SCAN_CANCEL, CMD_SCAN_CANCEL_SHORT]):
+            scan_cancel()
+        elif( command in [CMD_PARTITION_LIST, CMD_PARTITION_LIST_SHORT]):
+            partition_list()
+        elif( command in [CMD_REGION_SET, CMD_REGION_SET_SHORT]):
+            region_set(user_args[1:])
+        elif( command in [CMD_TRIAGE, CMD_TRIAGE_SHORT]):
+            triage(user_args[1:])
         elif( command in [CMD_FILTER_SELECT, CMD_FILTER_SELECT_SHORT]):
             if( len(user_args) >= 2 ):
                 filter_select(user_args[1:])
             else:
                 filter_select([])
         elif( command in [CMD_QUIT, CMD_QUIT_SHORT]):
+            # A running scan saves its checkpoint
+            if( scan_job and scan_job.running() ):
+                scan_cancel()
             finish = True
         elif( command in [CMD_HELP, CMD_HELP_SHORT]):
             show_help()
@@ -814,6 +4754,39 @@ def main():
                 export_excel(user_args[1])
             else:
                 print("Missing excel file name")
+        elif( command in [CMD_ENTROPY_EXPORT, CMD_ENTROPY_EXPORT_SHORT]):
+            if( len(user_args) >= 2 ):
+                entropy_export(user_args[1])
+            else:
+                print("Missing file name")
+        elif( command in [CMD_SEARCH, CMD_SEARCH_SHORT]):
+            if( len(user_args) >= 2 ):
+                search(user_input.split(None, 1)[1].strip())
+            else:
+                print("Missing search text")
+        elif( command in [CMD_RESULTS_SAVE, CMD_RESULTS_SAVE_SHORT]):
+            if( len(user_args) >= 2 ):
+                results_save(user_args[1])
+            else:
+                print("Missing file name")
+        elif( command in [CMD_RESULTS_LOAD, CMD_RESULTS_LOAD_SHORT]):
+            if( len(user_args) >= 2 ):
+                results_load(user_args[1])
+            else:
+                print("Missing file name")
+        elif( command in [CMD_QUERY, CMD_QUERY_SHORT]):
+            query(user_args[1:])
+        elif( command in [CMD_OVERLAP_RESOLVE, CMD_OVERLAP_RESOLVE_SHORT]):
+            overlap_resolve()
+        elif( command in [CMD_SERVE, CMD_SERVE_SHORT]):
+            serve(*user_args[1:3])
+        elif( command in [CMD_SET, CMD_SET_SHORT]):
+            set_option(user_args[1:])
+        elif( command in [CMD_CONTEXT, CMD_CONTEXT_SHORT]):
+            if( len(user_args) >= 2 ):
+                show_context(*user_args[1:3])
+            else:
+                print("Missing offset")
         else:
             print('Unknown command')
 
@@ -841,14 +4814,31 @@ def main():
 #   -> my_parser = Parser("my new parser", SMSType.SMS_PDU, [\
 #                    parsing_func_1, parsing_func_2, parsing_func_3])
 #
+# A parser can also take 2 more optional arguments :
+#  - guards : a list of 'Guard' instances (see Framework-Land). A guard
+#             is a cheap check run on every offset before the parsing
+#             functions. When a guard fails the offset is rejected
+#             without creating a SMS. A guard must only reject offsets
+#             that the parsing functions would reject anyway, otherwise
+#             it changes the results ! The simplest guards check one
+#             byte at a fixed position from the start of the SMS :
+#   -> my_guard = field_guard("my guard", 0, lambda byte: byte < 0x80)
+# The parser counts how many offsets each guard rejects and runs the
+# most selective guards first. 
+#  - anchors : a function anchors(img, start, end) returning the sorted
+#             offsets of [start, end[ where a SMS can start. The parser
+#             only tries these offsets instead of all of them. It must
+#             return every offset where the parsing functions succeed
+#             (see the SCTS-anchored parser below) 
+#
 #        How do I define my parsing functions ?
 #        -------------------------------------- 
 #
 # In order to define a parser, you first need to define parsing 
 # functions or use already defined parsing functions.
 # A parsing function MUST take 3 arguments : 
-#  - img : a string of bytes representing the binary image
-#          to analyze. img[i] corresponds to the byte number 
+#  - img : a bytearray representing the binary image
+#          to analyze. img[i] is the value (int) of the byte number 
 #          i in the binary file
 #   
 #  - ind : the index in 'img' from where the parsing
@@ -865,6 +4855,12 @@ def main():
 # If the function fails to parse the desired field the value 'ERROR'
 # is returned. 'ERROR' is defined in Framework-Land as '-1'  
 #
+# Most offsets of the image are not SMS, so avoid copying bytes
+# (img[a:b]) in your parsing functions. Keep raw fields as references
+# with sms.set_ref("tp_field", img, ind, length) : the bytes are copied
+# in sms.tp_field only if the whole chain succeeds, and sms.field() 
+# returns them in the meantime.
+#
 # ------------------------------------------------------
 
 
@@ -878,7 +4874,7 @@ def parse_pdu_submit_header(img, ind, sms):
     # Get the first octet
     if( ind >= len(img) ):
         return ERROR 
-    sms.tp_header = ord(img[ind])
+    sms.tp_header = img[ind]
     if( sms.mti() != MTI_SUBMIT ):
         return ERROR
     else:
@@ -887,7 +4883,7 @@ def parse_pdu_submit_header(img, ind, sms):
 
 def parse_pdu_submit_mr(img,ind,sms):
     try:
-        sms.tp_mr = ord(img[ind])
+        sms.tp_mr = img[ind]
         return 1
     except:
         return ERROR
@@ -896,8 +4892,8 @@ def parse_pdu_pi_dcs(img, ind, sms):
     # Get Protocol Identifier and Data Coding Scheme 
     if( ind > len(img)-2 ):
         return ERROR
-    sms.tp_pi = ord(img[ind])
-    sms.tp_dcs = ord(img[ind+1])
+    sms.tp_pi = img[ind]
+    sms.tp_dcs = img[ind+1]
     return 2
         
 def parse_pdu_submit_vp(img, ind, sms):
@@ -906,14 +4902,12 @@ def parse_pdu_submit_vp(img, ind, sms):
     if( sms.vpf() == VPF_ENHANCED or sms.vpf() == VPF_ABSOLUTE ):
         if( ind > len(img)-7):
             return ERROR
-        sms.tp_vp = img[ind:ind+7+1]
+        sms.set_ref("tp_vp", img, ind, 7)
         return 7
-        sms.sms_date = str_to_date(sms.vp(),check=True)
-        sms.date_utc_00 = str_to_date_utc(sms.vp())
     elif( sms.vpf() == VPF_RELATIVE ):
         if( ind > len(img)-1):
             return ERROR
-        sms.tp_vp = img[ind]
+        sms.set_ref("tp_vp", img, ind, 1)
         return 1
     else:
         return 0
@@ -945,7 +4939,7 @@ def parse_pdu_addr(img, ind, sms):
     
     
      # Get the addr length in octets
-    addr_len = (ord(img[ind])+1)/2
+    addr_len = (img[ind]+1)/2
     if( addr_len > 12 ):
         return ERROR
     else:
@@ -956,14 +4950,13 @@ def parse_pdu_addr(img, ind, sms):
         return 2
     
     # Check if end of binary 
-    if( ind+addr_len > len(img)):
+    if( ind+1+addr_len > len(img)):
         return ERROR
         
     # Check the type of address
-    ton = (ord(img[ind]) & 0b01110000) >> 4
+    ton = (img[ind] & 0b01110000) >> 4
     # Get the number
-    nibbles = img[ind+1:ind+1+addr_len]
-    num = nibble_to_str(nibbles)
+    num = nibbles_at(img, ind+1, addr_len)
     if( not num ):
         return ERROR
     if( ton == TON_INTERNATIONAL ):
@@ -978,7 +4971,7 @@ def parse_pdu_user_data(img, ind, sms):
     # Get the user data length 
     if( ind > len(img)-1 ):
         return False
-    sms.tp_udl = ord(img[ind])
+    sms.tp_udl = img[ind]
     if( sms.udl() == 0 ):
         return False
     ind = ind + 1
@@ -986,23 +4979,27 @@ def parse_pdu_user_data(img, ind, sms):
     # Get the user data 
     if( ind > len(img) - sms.udl() ):
         return False
-    sms.tp_ud = img[ind:ind+sms.udl()]
+    sms.set_ref("tp_ud", img, ind, sms.udl())
+    # Decoded in place: the user data is copied only if the SMS is kept
+    ud = sms.field_view("tp_ud")
     if( sms.data_format() in DCS_ASCII8 ):
-        sms.msg = sms.ud().decode('ascii', errors='replace')[:sms.udl()]
+        sms.msg = unicode(ud, 'ascii', 'replace')[:sms.udl()]
     elif( sms.data_format() in DCS_UCS2 ):
-        sms.msg = sms.ud().decode('utf-16', errors='replace')[:sms.udl()]
+        sms.msg = unicode(ud, 'utf-16', 'replace')[:sms.udl()]
     elif( sms.data_format() in DCS_GSM7 ):
-        sms.msg = gsm7_decode(sms.ud())[:sms.udl()]
+        sms.msg = gsm7_decode(ud)[:sms.udl()]
+        # The length is in septets
+        return 1+(sms.udl()*7+7)/8
     else:
         return False
     
-    return True
+    return 1+sms.udl()
 
 def parse_pdu_deliver_header(img,ind,sms):
     # Get the first octet
     if( ind >= len(img) ):
         return ERROR 
-    sms.tp_header = ord(img[ind])
+    sms.tp_header = img[ind]
     if( sms.mti() != MTI_DELIVER ):
         return ERROR
     else:
@@ -1013,11 +5010,147 @@ def parse_pdu_deliver_scts(img, ind, sms):
     # Get the Service Center Time Stamp
     if( ind > len(img)-7):
         return ERROR
-    sms.tp_scts = img[ind:ind+7+1]
-    sms.sms_date = str_to_date(sms.scts(),check=True)
-    sms.date_utc_00 = str_to_date_utc(sms.scts())
+    sms.set_ref("tp_scts", img, ind, 7)
     return 7 
 
+# Define your guards here
+# -----------------------
+# The address field starts at a fixed position in both PDU types :
+# byte 1 for SMS-DELIVER, byte 2 for SMS-SUBMIT (after TP-MR)
+MAX_ADDR_DIGITS = 24
+
+def pdu_addr_guards(addr_pos):
+    """
+    Description
+    -----------
+    Guards for an address field starting at 'addr_pos' : the length
+    must fit in 12 octets (see parse_pdu_addr) and the first digit
+    of a non empty number must be decimal (see nibble_to_str)
+    """
+    def first_digit(img, ind):
+        if( ind+addr_pos >= len(img) ):
+            return False
+        if( img[ind+addr_pos] == 0 ):
+            return True
+        if( ind+addr_pos+2 >= len(img) ):
+            return False
+        return img[ind+addr_pos+2] & 0x0f <= 9
+    return [field_guard("address length", addr_pos, lambda byte: byte <= MAX_ADDR_DIGITS),\
+            Guard("address first digit", first_digit)]
+
+def pdu_submit_guards():
+    return [field_guard("MTI submit", 0, lambda byte: byte & 0b11 == MTI_SUBMIT)]\
+           + pdu_addr_guards(2)
+
+def pdu_deliver_guards():
+    return [field_guard("MTI deliver", 0, lambda byte: byte & 0b11 == MTI_DELIVER)]\
+           + pdu_addr_guards(1)
+
+# Define your anchors here
+# ------------------------
+# The 7 bytes of a SCTS are swapped BCD fields with strict ranges: they
+# are searched first (with numpy, or a regular expression), then the
+# header of each SMS-DELIVER is found by walking back from its SCTS:
+# header, address length, type of address, address digits (0 to 12
+# octets), PI, DCS. Only the SMS with a valid SCTS are found
+
+def scts_years():
+    """
+    Return
+    ------
+    (first year, last year) of the 'scts-years' option, or None
+    """
+    match = re.match(r"^(\d{4})-(\d{4})$", str(scan_options["scts-years"]).strip())
+    if( not match ):
+        return None
+    return (int(match.group(1)), int(match.group(2)))
+
+scts_tables = (None, None) # ('scts-years', tables), see scts_byte_tables()
+
+def scts_byte_tables():
+    """
+    Description
+    -----------
+    For each byte of a SCTS, the values it can take (256 booleans): BCD
+    fields in range, year in 'scts-years', time zone below 14 hours.
+    The day is checked against the month by decode_scts()
+    """
+    global scts_tables
+    years = scts_years()
+    if( scts_tables[1] is not None and scts_tables[0] == years ):
+        return scts_tables[1]
+    def allowed(low, high):
+        return [bcd_to_int(b) is not None and low <= bcd_to_int(b) <= high for b in range(0, 256)]
+    year = allowed(0, 99)
+    if( years ):
+        for b in range(0, 256):
+            if( year[b] ):
+                value = bcd_to_int(b)
+                value += 1900 if value > 50 else 2000
+                year[b] = years[0] <= value <= years[1]
+    tz = [bcd_to_int(b & 0b11110111) is not None and bcd_to_int(b & 0b11110111) <= MAX_TZ_QUARTERS\
+        for b in range(0, 256)]
+    tables = [year, allowed(1, 12), allowed(1, 31), allowed(0, 23), allowed(0, 59), allowed(0, 59), tz]
+    scts_tables = (years, tables)
+    return tables
+
+def scts_candidates(img, start, end):
+    """
+    Description
+    -----------
+    Finds the offsets s in [start, end[ where img[s:s+7] can be a SCTS
+    (see scts_byte_tables)
+
+    Return
+    ------
+    A sorted list of offsets
+    """
+    tables = scts_byte_tables()
+    end = min(end, len(img)-6)
+    if( end <= start or not all([any(table) for table in tables]) ):
+        return []
+    if( numpy is not None ):
+        data = numpy.frombuffer(img, dtype=numpy.uint8, count=end+6-start, offset=start)
+        # The month is the most selective byte, check it first
+        cand = numpy.nonzero(numpy.array(tables[1], dtype=bool)[data[1:end-start+1]])[0]
+        for k in [2, 3, 6, 4, 5, 0]:
+            cand = cand[numpy.array(tables[k], dtype=bool)[data[cand+k]]]
+        return (cand+start).tolist()
+    pattern = re.compile("(?="+"".join(["["+"".join([re.escape(chr(b)) for b in range(0, 256) if table[b]])+"]"\
+        for table in tables])+")")
+    return [match.start() for match in pattern.finditer(img, start, end+6)]
+
+def deliver_anchors(img, start, end):
+    """
+    Description
+    -----------
+    Offsets of [start, end[ where a SMS-DELIVER with a valid SCTS can
+    start: the SCTS is 5+addr_len bytes after the header, and the
+    address length byte of the header gives addr_len octets
+    """
+    res = set()
+    for s in scts_candidates(img, start+5, min(len(img), end+5+12)):
+        for addr_len in range(0, 13):
+            h = s-5-addr_len
+            if( h < start ):
+                break
+            if( h < end and (img[h+1]+1)/2 == addr_len and img[h] & 0b11 == MTI_DELIVER ):
+                res.add(h)
+    return sorted(res)
+
+def parse_pdu_deliver_valid_scts(img, ind, sms):
+    # Service Center Time Stamp found by deliver_anchors()
+    if( ind > len(img)-7 ):
+        return ERROR
+    tables = scts_byte_tables()
+    for k in range(0, 7):
+        if( not tables[k][img[ind+k]] ):
+            return ERROR
+    if( decode_scts(img[ind:ind+7]) is None ):
+        return ERROR
+    sms.set_ref("tp_scts", img, ind, 7)
+    return 7
+
 # Declare your parsers here
 # -------------------------
 
@@ -1028,7 +5161,7 @@ pdu_submit_parser = Parser("SMS-PDU-Submit", SMSType.SMS_PDU, [\
     parse_pdu_pi_dcs,\
     parse_pdu_submit_vp,\
     parse_pdu_user_data
-    ])
+    ], guards=pdu_submit_guards())
 
 pdu_deliver_parser = Parser("SMS-PDU-Deliver", SMSType.SMS_PDU, [\
     parse_pdu_deliver_header,\
@@ -1036,7 +5169,16 @@ pdu_deliver_parser = Parser("SMS-PDU-Deliver", SMSType.SMS_PDU, [\
     parse_pdu_pi_dcs,\
     parse_pdu_deliver_scts,\
     parse_pdu_user_data
-    ])
+    ], guards=pdu_deliver_guards())
+
+# Same SMS as pdu_deliver_parser, when their SCTS is valid
+pdu_deliver_scts_parser = Parser("SMS-PDU-Deliver-SCTS", SMSType.SMS_PDU, [\
+    parse_pdu_deliver_header,\
+    parse_pdu_addr,\
+    parse_pdu_pi_dcs,\
+    parse_pdu_deliver_valid_scts,\
+    parse_pdu_user_data
+    ], anchors=deliver_anchors)
 
 
 # ------------------------------------------------------
@@ -1074,6 +5216,17 @@ pdu_deliver_parser = Parser("SMS-PDU-Deliver", SMSType.SMS_PDU, [\
 # any treatment in the functions body as long as it always 
 # returns True (SMS passes the test) or False (SMS is not good) 
 #
+#         Can my filters run faster on big results ?
+#         ------------------------------------------
+#
+# Yes, give your filtering functions a batch form with the
+# 'batch_form' decorator. A batch form takes a 'ResultColumns'
+# instance (columns of SCTS bytes, UDL, DCS, messages... of all
+# the SMS) and returns one boolean per SMS, computed with numpy.
+# When numpy is installed and all the functions of a Filter have
+# a batch form, the batch forms are used. Otherwise the filtering
+# functions are applied to each SMS.
+#
 # ------------------------------------------------------
 
 # Define your filtering functions here
@@ -1113,6 +5266,13 @@ class LanguageSymbolSignature:
                 return True
         return False
 
+LATIN_INTERVALS = [(0x20, 0x7f), (0xc0, 0x17f)]
+LATIN_PERCENTAGE = 0.92
+
+def filter_lang_latin_batch(columns):
+    return char_ratio_batch(columns["messages"], LATIN_INTERVALS) > LATIN_PERCENTAGE
+
+@batch_form(filter_lang_latin_batch)
 def filter_lang_latin(sms):
     """
     Description
@@ -1129,10 +5289,10 @@ def filter_lang_latin(sms):
     """
     if( len(sms.message()) == 0 ):
         return False
-    percentage = 0.92
+    percentage = LATIN_PERCENTAGE
     yes = 0
     no = 0
-    lang = LanguageSymbolSignature([(0x20, 0x7f), (0xc0, 0x17f)]) 
+    lang = LanguageSymbolSignature(LATIN_INTERVALS)
     for char in sms.message():
         if( lang.belongs(char)):
             yes = yes + 1
@@ -1144,13 +5304,465 @@ def filter_lang_latin(sms):
     else:
         return False
 
+# Character bigram models
+# -----------------------
+# Messages are scored with the log-probabilities of their character
+# bigrams in a few languages. Characters are reduced to 30 symbols: 
+# space, the 26 letters (case and accents removed), digit, punctuation
+# and other. For each language, BIGRAM_TABLES holds the 30x30 values
+# of log(P(next symbol|symbol)*30), in 1/16 nat, as signed bytes: a
+# positive value means that the bigram is more likely in the language
+# than in random symbols. The tables of all languages follow each other
+# in the order of BIGRAM_LANGUAGES, compressed with zlib and encoded
+# in base64. They were computed from sample SMS texts.
+BIGRAM_LANGUAGES = ["english", "french", "spanish", "german", "italian"]
+BIGRAM_SYMBOLS = 30
+BIGRAM_SPACE = 0
+BIGRAM_DIGIT = 27
+BIGRAM_PUNCTUATION = 28
+BIGRAM_OTHER = 29
+BIGRAM_PUNCTUATION_CHARS = u".,;:!?'\"-()"
+BIGRAM_CODES = 0x180 # Characters after Latin Extended-A are 'other'
+BIGRAM_STEP = 1.0/16
+BIGRAM_TABLES = """
+eNqll3lzosoWwFUWRWURQdwTM5M7t97yz33f/xuYVKVSlDECEiMmrrijAvpON5CJ72a8r+r+
+6NN9ukdjT/fZaOYpMuaQdoId2Mfk0XWam3Rx0OSbbNNoNlO648R0j9BTupfyZN3TBb4AKzNe
+BxbEYrG4AcksFkLU0BpmXp3P52kseRjQ7IPE/FZ6e9uDvNFvCBZmcazF0dKPpAo7elPVNxjX
+vGqrbCKprlXbVlVazcVmQGo2q0R9bMbiNaTVRdu2i7Ytx2xEDLcQxqZLr6/r319fX7lXhIA6
+Zo311/WrtFgcE/sF1QW4bmPR7SYEuXvsggJy/IpipNTJ5XJZWIaIqCOjWWFZ4iwrWzpZFmmd
+FMtKOZYFDUhZ1snK0pPJ5DuIPJl89EfcT+hJzTTNfGYvmRmTMM1FHqYms4Bub5q8ydueTcPN
+QLNtOk84umATDY9GN2TrBTLcRxZvjhSDnYV7i12kxvR63vXa61G93tqjYEbFvR7goXZD9Pvb
+ar/PHmHs92HWJ/KgIIh+g+50Olyn842EcdLJdDrHCYxrEJhcD38iuO7QHV6lhHBODLeIf2wj
+Utsz0uJ4PK6Nx1J5jEiD+OMQauxFcD8H7mOp9g5k3iN+B4nHwwn3fvk0vF9T4bw/BgNncI5D
+faiX/3KTP1JC1jfcA9XMJg8bgYgnOTfWbA6axqZZ0WbuTNNOWl3TXJfVXI3LUexWgzWQNbVe
+rzkQZb0uYw0aWsNQ/sSfVCYTXpmAMqlPJtQkwp8Ie/C3W5Aq9jyYxfehP74Jb997D+ve+gHj
+kPKD88AVKGb+0HuYP2QeUlfhzcjRHX2+Jld2Xbfi/gJqBTRAWKSsFNznVyGSNpttJQ0jbAvw
+H+UzkkbAM9MoDX/kJvps+F0qmlw+Z0UB07wFSfX7AjZaEDKwWLI/bLjDITJMERsh7yJjdAOb
+dIcNRycF2dF17FekjTrZcdBEz+gvL6sX9wVQXl7ibh2U3Iq9ggEvDivwJ4ogh+GQB40YFg4H
+IrL/9Vf8O1KUjHY6/YCjSMBtw9FpWjKxRVcPp3HSvqFIVQDZoYjV5efzbjp9xHq31P3GGHND
+NgzDNxC8YUjGTsC6kTMq8d0OYrNhZEGMPHy04ueMHf5w0rA5CJdVEBEHzrqNFuJRHL18zvVd
+CHM2YJRd4bNL/gmZBQNhv7Yb1r3sg/8SzQXESJOGKGnSC9QvcJDEXN7zHbPIZfL7KfXWvcvT
+pJP1XTLrxu/u9nfdO+dGdWMpdTBQ1Zl6TOVhyBVmg5g6WKsqpW7kzWZTApFxC0hGipWHSF+w
+rFwBx/trlAKsnBWyLYPxNUDK2AxruD/2Q64Hg509UI/op3laApUvuTb8qOqqadUpO46TAqk5
+PxEiZSPBj/PRLjaVDVr4mC8akKLLIAmcrKuLM4iin2SLKKZv+v6GTfb76TSBd+TDCr4M+eNa
+5PByQi6fc/UGEq0IqZbGyVfEiddLhPl3eOMGnpLFrlHkUZ+KPOW6ZBIiA/d5wheqoPtl8fUu
+4PmuTamkNp0i33BxABGlkwbTraax2vRqOp3mp5jTFM2E6TQ5Ddl+xT8jRa6ZS7qIbMoExWTN
+JWPSy8CqGPOW6y4WaXC4BHa7I3K/SuiDUrd/g64RJI2PL9fv5yMd4BlIDbeQIFCq2JVRptjt
+BrsBaoMB9r2rwPs+PJH5/3zwFJE7fcGP1J/z6s95Mb/P7H9Bfn/ZB//zdglkH1l4IrJYlcJZ
+M8UMCvSJTmYG/i6dMCbNSW5L+HyzGYNa1NPpTEy3ecfWbTomQ9ylixkFahwbBWMK1QHfQapR
+OZBG5QAuDqhxlIf/CE42dp6ocxLUNLcgaIRSB7V1Huu9VK/46C2nj9Y0Lj0+eqfa4+NjkU8u
+HzGnxzIHRaecQoUnqkVxXRqTZ6FWQ/mjgfMJ5JAg5EeFjjCsyWBASMCeDyeGh2rukFsEdkWY
+0860dCx2DkcooOLxCvQ5ke1EHAUoOYXjL6BQXiwHmRFadXUGp/i+L/n4iKTglPx0Oqig/HE9
+j44EpAaShQfOy8HVjQPPbez5WRThY8Sz//zMgIz92PgZGD8Lz8yIFMgROQI8Jq/AkPeYUQA5
+2jV2/5MQlE+Z4bI9/6DN5YFf0suluTQPhxO4H0HT6KSW4JZXhC7p4kzXszghO5CkuboecSWB
+haBpLPhXaDbpoVlMV/RSz12tejmKQtfNFqATKTm4/F68h7fW+Njz5w0DkxoUUkiucEnFhwV7
+yGUfvETuhGv0yvKM7G30RvEXPti/xOVzvhccMQNvhJv0/T1DElPB82XG8+4B8/6+0doetq33
+eevQamVZ/v3QypJii2y9t7atdGtFFgJbE6PSjowUwMrAu45gWUolyoMn3BCONSyAS5RAbrBz
+1Idn3I5Gy/jT0/LJeXo6HsWnp6cyFYfpEyxwT0EtyX6qBqnP5k6F9WUVdRT7aUvAWoIi6xqk
+iMst7rwMq3PgI/R41wbEBMe126uEdzrBbNzOtmN/g1pxs3mFd1GUB5XwbdTfBO+hidf3G3gh
+KYAoIMn3cuL9M1WpuxMlKPlSKMfMiyjr8EEFCPxo70ardnsET3vkFWHIw44TbbQktUcCuOIN
+dseROxopzEgZBQ6L+DLk/xYpXMWYH6tQKBYNUBJQT1Jzaj4PCkqjp/SYXhGchsEhNAuDUM72
+wpCKvgNFpoFHw6gZhmgoVPhVg4Qw5JEedBCCvEYROo+LXurGMxaCaQ2kjsNqaTY7wZCchW/8
+fyMPXv4urq0Q5fPKCi2knL94H6Ss4A3fCQ38jMu/+18SyNmS
+"""
+
+bigram_model = None
+def load_bigram_model():
+    """
+    Description
+    -----------
+    Decodes the bigram tables, only the first time
+
+    Return
+    ------
+    (symbol of each code point < BIGRAM_CODES, list of the tables of
+    each language). Both are numpy arrays when numpy is available
+    """
+    global bigram_model
+    if( bigram_model is None ):
+        symbols = array('B')
+        for code in range(BIGRAM_CODES):
+            char = unicodedata.normalize("NFD", unichr(code))[0].lower()
+            if( char in u" \t\r\n" ):
+                symbols.append(BIGRAM_SPACE)
+            elif( char in u"0123456789" ):
+                symbols.append(BIGRAM_DIGIT)
+            elif( char in BIGRAM_PUNCTUATION_CHARS ):
+                symbols.append(BIGRAM_PUNCTUATION)
+            elif( char == u"\xdf" ): # German sharp s
+                symbols.append(1+ord("s")-ord("a"))
+            elif( u"a" <= char <= u"z" ):
+                symbols.append(1+ord(char)-ord("a"))
+            else:
+                symbols.append(BIGRAM_OTHER)
+        values = array('b', zlib.decompress(base64.b64decode(BIGRAM_TABLES)))
+        size = BIGRAM_SYMBOLS*BIGRAM_SYMBOLS
+        tables = [values[i*size:(i+1)*size] for i in range(0, len(BIGRAM_LANGUAGES))]
+        if( numpy is not None ):
+            symbols = numpy.array(symbols, dtype=numpy.int64)
+            tables = [numpy.array(table, dtype=numpy.int64) for table in tables]
+        bigram_model = (symbols, tables)
+    return bigram_model
+
+def bigram_score(message):
+    """
+    Description
+    -----------
+    Scores a message with the bigram model of the language that fits
+    it best: mean log-likelihood ratio per bigram, in nats, between 
+    the language and random symbols. Text in one of the languages 
+    scores around 1, random characters score below 0
+
+    Return
+    ------
+    A float, or None if the message has less than 2 characters
+    """
+    symbols, tables = load_bigram_model()
+    if( len(message) < 2 ):
+        return None
+    seq = [int(symbols[ord(c)]) if ord(c) < BIGRAM_CODES else BIGRAM_OTHER for c in message]
+    pairs = [seq[i]*BIGRAM_SYMBOLS+seq[i+1] for i in range(0, len(seq)-1)]
+    best = max([sum([int(table[p]) for p in pairs]) for table in tables])
+    return best*BIGRAM_STEP/(len(seq)-1)
+
+def bigram_score_batch(messages):
+    """
+    Description
+    -----------
+    Vectorized version of bigram_score(). Messages with less than 2
+    characters get -inf
+
+    Return
+    ------
+    numpy array of floats
+    """
+    symbols, tables = load_bigram_model()
+    chars, lengths = code_points(messages)
+    res = numpy.full(len(messages), -numpy.inf)
+    if( len(chars) < 2 ):
+        return res
+    seq = numpy.where(chars < BIGRAM_CODES, symbols[numpy.minimum(chars, BIGRAM_CODES-1)], BIGRAM_OTHER)
+    pairs = seq[:-1]*BIGRAM_SYMBOLS+seq[1:]
+    # Pair k is made of characters k and k+1: drop the pairs across messages
+    ends = numpy.cumsum(lengths)
+    starts = ends-lengths
+    inside = numpy.ones(len(pairs), dtype=bool)
+    inside[starts[(starts > 0) & (starts < len(chars))]-1] = False
+    scored = lengths >= 2
+    best = None
+    for table in tables:
+        sums = numpy.concatenate([[0], numpy.cumsum(numpy.where(inside, table[pairs], 0))])
+        total = sums[ends[scored]-1]-sums[starts[scored]]
+        if( best is None ):
+            best = total
+        else:
+            best = numpy.maximum(best, total)
+    res[scored] = best*BIGRAM_STEP/(lengths[scored]-1)
+    return res
+
+def filter_lang_bigram_batch(columns):
+    return bigram_score_batch(columns["messages"]) > scan_options["bigram-threshold"]
+
+@batch_form(filter_lang_bigram_batch)
+def filter_lang_bigram(sms):
+    """
+    Description
+    -----------
+    Filters only SMS whose message is likely to be written in one of 
+    the BIGRAM_LANGUAGES: the bigram score must be above the 
+    'bigram-threshold' option (see the 'set' command)
+    """
+    score = bigram_score(sms.message())
+    return score is not None and score > scan_options["bigram-threshold"]
+
+def filter_date_batch(columns):
+    dated = [getattr(sms, "tp_scts", None) is None and sms.sms_date is not None\
+        for sms in columns.sms_list]
+    return scts_valid_batch(columns["scts"]) | numpy.array(dated, dtype=bool)
+
+@batch_form(filter_date_batch)
 def filter_date(sms):
     """
     Description
     -----------
     Filters only SMS that have a valid date
     """
-    return sms.sms_date != None
+    return sms.timestamp is not None or sms.sms_date is not None
+
+# Max UDL: 160 septets in GSM7, 140 bytes otherwise
+MAX_UDL_GSM7 = 160
+MAX_UDL_8BIT = 140
+
+def filter_udl_dcs_batch(columns):
+    udl = columns["udl"]
+    dcs = columns["dcs"]
+    data_format = dcs & 0x0f
+    gsm7 = (dcs >= 0) & (data_format <= 3)
+    ascii8 = (dcs >= 0) & (data_format >= 4) & (data_format <= 7)
+    ucs2 = (dcs >= 0) & (data_format >= 8) & (data_format <= 0xb)
+    return (udl > 0) & (columns["ud_len"] == udl) & (\
+        (gsm7 & (udl <= MAX_UDL_GSM7)) | (ascii8 & (udl <= MAX_UDL_8BIT)) |\
+        (ucs2 & (udl <= MAX_UDL_8BIT) & (udl%2 == 0)))
+
+@batch_form(filter_udl_dcs_batch)
+def filter_udl_dcs(sms):
+    """
+    Description
+    -----------
+    Filters only SMS whose user data length is consistent with the
+    data coding scheme (known encoding, max length, even length for
+    UCS2) and whose user data was entirely read
+    """
+    udl = getattr(sms, "tp_udl", None)
+    dcs = getattr(sms, "tp_dcs", None)
+    if( not udl or dcs is None or getattr(sms, "tp_ud", None) is None ):
+        return False
+    if( len(sms.tp_ud) != udl ):
+        return False
+    if( dcs & 0x0f in DCS_GSM7 ):
+        return udl <= MAX_UDL_GSM7
+    elif( dcs & 0x0f in DCS_ASCII8 ):
+        return udl <= MAX_UDL_8BIT
+    elif( dcs & 0x0f in DCS_UCS2 ):
+        return udl <= MAX_UDL_8BIT and udl%2 == 0
+    return False
+
+# Watch-list of phone numbers, loaded with the 'watchlist-load' command.
+# Numbers are compared in international form without '+' or '00'
+# (national numbers get a country code instead of their leading 0) and
+# stored as integers: int("1"+digits) keeps the leading zeros.
+# Lists of more than WATCHLIST_BLOOM_MIN numbers are stored as a sorted
+# array with a Bloom filter in front, which takes less memory than a set
+WATCHLIST_BLOOM_MIN = 1000000
+# Max false positive rate of the Bloom filter: its table is rounded up to
+# a power of two bits, the rate is lower (0.47% for 1.5M numbers)
+WATCHLIST_BLOOM_ERROR = 0.005
+MAX_KEY_DIGITS = 18 # int("1"+digits) must fit in 64 bits
+MASK_64 = 0xffffffffffffffff
+watch_list = None
+
+class BloomFilter:
+    """
+    Description
+    -----------
+    Set of integers that answers "maybe in the set" or "surely not in
+    the set" with a table of 2**bits bits and 'nb_hashes' hash functions.
+    The hash functions are (h1 + i*h2) mod 2**bits, with h1 and h2
+    the high bits of two multiplicative hashes on 64 bits, so that
+    they are computed the same way by numpy on arrays of keys
+    """
+    MULT_1 = 0x9e3779b97f4a7c15
+    MULT_2 = 0xc2b2ae3d27d4eb4f
+
+    def __init__(self, nb_items, error_rate=WATCHLIST_BLOOM_ERROR):
+        nb_items = max(1, nb_items)
+        size = -nb_items*math.log(error_rate)/math.log(2)**2
+        self.bits = max(6, int(math.ceil(math.log(size, 2))))
+        self.nb_hashes = min(16, max(1, int(round(2**self.bits*math.log(2)/nb_items))))
+        self.table = bytearray(2**self.bits/8)
+
+    def _positions_batch(self, keys):
+        shift = numpy.uint64(64-self.bits)
+        h1 = (keys*numpy.uint64(self.MULT_1)) >> shift
+        h2 = ((keys*numpy.uint64(self.MULT_2)) >> shift) | numpy.uint64(1)
+        mask = numpy.uint64(2**self.bits-1)
+        for i in range(0, self.nb_hashes):
+            yield (h1+numpy.uint64(i)*h2) & mask
+
+    def _positions(self, key):
+        shift = 64-self.bits
+        h1 = ((key*self.MULT_1) & MASK_64) >> shift
+        h2 = (((key*self.MULT_2) & MASK_64) >> shift) | 1
+        mask = 2**self.bits-1
+        return [(h1+i*h2) & mask for i in range(0, self.nb_hashes)]
+
+    def add(self, key):
+        for p in self._positions(key):
+            self.table[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, key):
+        for p in self._positions(key):
+            if( not self.table[p >> 3] & (1 << (p & 7)) ):
+                return False
+        return True
+
+    def add_batch(self, keys):
+        """
+        Adds the keys of the uint64 array 'keys'
+        """
+        table = numpy.frombuffer(self.table, dtype=numpy.uint8)
+        for p in self._positions_batch(keys):
+            numpy.bitwise_or.at(table, p >> numpy.uint64(3),\
+                numpy.left_shift(1, p & numpy.uint64(7)).astype(numpy.uint8))
+
+    def contains_batch(self, keys):
+        """
+        Returns a numpy array of booleans, one per key of the uint64
+        array 'keys'
+        """
+        table = numpy.frombuffer(self.table, dtype=numpy.uint8)
+        res = numpy.ones(len(keys), dtype=bool)
+        for p in self._positions_batch(keys):
+            res &= (table[p >> numpy.uint64(3)] >> (p & numpy.uint64(7)).astype(numpy.uint8)) & 1 == 1
+        return res
+
+def normalize_number(number, country_code=""):
+    """
+    Description
+    -----------
+    International form of a phone number without '+' or '00'. National
+    numbers (one leading 0) get 'country_code' instead of their 0.
+    Spaces, dots, dashes and brackets are ignored
+
+    Return
+    ------
+    The digits, or None if 'number' is not a phone number
+    """
+    number = number or ""
+    if( not number.isdigit() ):
+        number = number_key(re.sub(r"[ .()-]", "", number))
+        if( not number or not number.isdigit() ):
+            return None
+    elif( number.startswith("00") ):
+        number = number[2:]
+        if( not number ):
+            return None
+    if( country_code and number[0] == "0" ):
+        number = country_code+number[1:]
+    return number
+
+class WatchList:
+    """
+    Description
+    -----------
+    Set of phone numbers to look for. Numbers are normalized with
+    normalize_number() and stored as integer keys: in a set, or in
+    a sorted array behind a Bloom filter ('bloom' True). With a Bloom
+    filter, most numbers that are not in the list are rejected by the
+    filter, the others are searched in the array
+    """
+    def __init__(self, numbers, country_code="", bloom=False):
+        self.country_code = country_code
+        self.invalid = 0 # Numbers of the list that could not be normalized
+        keys = set()
+        for number in numbers:
+            key = self.key(number)
+            if( key is None ):
+                self.invalid += 1
+            else:
+                keys.add(key)
+        self.size = len(keys)
+        self.bloom = None
+        if( not bloom ):
+            self.keys = keys
+            return
+        self.bloom = BloomFilter(len(keys))
+        if( numpy is not None ):
+            self.keys = numpy.fromiter(keys, dtype=numpy.uint64, count=len(keys))
+            self.keys.sort()
+            self.bloom.add_batch(self.keys)
+        else:
+            self.keys = sorted(keys)
+            for key in self.keys:
+                self.bloom.add(key)
+
+    def __len__(self):
+        return self.size
+
+    def key(self, number):
+        number = normalize_number(number, self.country_code)
+        if( number is None or len(number) > MAX_KEY_DIGITS ):
+            return None
+        return int("1"+number)
+
+    def __contains__(self, number):
+        key = self.key(number)
+        if( key is None ):
+            return False
+        if( self.bloom is None ):
+            return key in self.keys
+        if( not key in self.bloom ):
+            return False
+        i = bisect.bisect_left(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def contains_batch(self, numbers):
+        """
+        Returns a numpy array of booleans, one per number
+        """
+        keys = [self.key(number) for number in numbers]
+        if( self.bloom is None ):
+            return numpy.array([key in self.keys for key in keys], dtype=bool)
+        # 0 is never a key
+        keys = numpy.array([key or 0 for key in keys], dtype=numpy.uint64)
+        res = numpy.zeros(len(keys), dtype=bool)
+        candidates = numpy.nonzero(self.bloom.contains_batch(keys))[0]
+        if( len(candidates) and len(self.keys) ):
+            pos = numpy.searchsorted(self.keys, keys[candidates])
+            found = pos < len(self.keys)
+            found[found] = self.keys[pos[found]] == keys[candidates][found]
+            res[candidates] = found
+        return res
+
+def filter_watchlist_batch(columns):
+    if( watch_list is None ):
+        return numpy.zeros(len(columns), dtype=bool)
+    return watch_list.contains_batch([sms.source() for sms in columns.sms_list]) |\
+        watch_list.contains_batch([sms.dest() for sms in columns.sms_list])
+
+@batch_form(filter_watchlist_batch)
+def filter_watchlist(sms):
+    """
+    Description
+    -----------
+    Filters only SMS whose source or destination number is in the
+    watch-list (see the 'watchlist-load' command)
+    """
+    if( watch_list is None ):
+        return False
+    return sms.source() in watch_list or sms.dest() in watch_list
+
+# Scoring of overlapping hits (see resolve_overlaps): the hit with the
+# best score is kept
+OVERLAP_DATE_WEIGHT = 2.0
+OVERLAP_LANG_WEIGHT = 1.0
+OVERLAP_ADDR_WEIGHT = 1.0
+MIN_NUMBER_DIGITS = 3
+MAX_NUMBER_DIGITS = 15
+
+def address_sane(sms):
+    """
+    Description
+    -----------
+    Checks that the number of the correspondent has a plausible
+    length (E.164 numbers have at most 15 digits)
+    """
+    number = sms.number().lstrip("+")
+    return number.isdigit() and MIN_NUMBER_DIGITS <= len(number) <= MAX_NUMBER_DIGITS
+
+def overlap_score_batch(columns):
+    dated = numpy.array([sms.timestamp is not None or sms.sms_date is not None\
+        for sms in columns.sms_list], dtype=numpy.float64)
+    addr = numpy.array([address_sane(sms) for sms in columns.sms_list], dtype=numpy.float64)
+    lang = char_ratio_batch(columns["messages"], LATIN_INTERVALS)
+    return OVERLAP_DATE_WEIGHT*dated + OVERLAP_LANG_WEIGHT*lang + OVERLAP_ADDR_WEIGHT*addr
+
+@batch_form(overlap_score_batch)
+def overlap_score(sms):
+    """
+    Description
+    -----------
+    Scores a hit with the validity of its date, the ratio of latin
+    characters in its message and the sanity of its address
+    """
+    msg = sms.message()
+    lang = 0.0
+    if( len(msg) > 0 ):
+        signature = LanguageSymbolSignature(LATIN_INTERVALS)
+        lang = float(len([c for c in msg if signature.belongs(c)]))/len(msg)
+    dated = float(sms.timestamp is not None or sms.sms_date is not None)
+    return OVERLAP_DATE_WEIGHT*dated + OVERLAP_LANG_WEIGHT*lang\
+        + OVERLAP_ADDR_WEIGHT*float(address_sane(sms))
 
 
 # Declare your filters here
@@ -1159,6 +5771,16 @@ pdu_filter_classical = Filter("PDU-classical",[\
     filter_lang_latin,\
     filter_date])
 
+pdu_filter_sanity = Filter("PDU-sanity",[\
+    filter_udl_dcs])
+
+pdu_filter_language = Filter("PDU-language",[\
+    filter_lang_bigram,\
+    filter_date])
+
+watchlist_filter = Filter("Watch-list",[\
+    filter_watchlist])
+
 
 
 # --------------------------
@@ -1167,5 +5789,6 @@ pdu_filter_classical = Filter("PDU-classical",[\
 # just executing the script :)  
 #
 # --------------------------
-main()
-exit()
+if __name__ == "__main__":
+    main()
+    exit()
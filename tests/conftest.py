@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# Fixtures of the smsparser tests: synthetic images with known SMS, and
+# a clean session state for each test
+import os
+import sys
+import gzip
+import random
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import smsparser
+
+IMAGE_SEED = 26
+IMAGE_SIZE = 256*1024
+
+def bcd(value):
+    return ((value % 10) << 4) | (value // 10)
+
+def pdu_address(number):
+    digits = number.lstrip("+")
+    ton = 0x91 if number.startswith("+") else 0x81
+    padded = digits+("F" if len(digits) % 2 else "")
+    res = bytearray([len(digits), ton])
+    for i in range(0, len(padded), 2):
+        res.append(int(padded[i+1], 16) << 4 | int(padded[i], 16))
+    return res
+
+def pdu_scts(year, month, day, hour, minute, second, quarters):
+    return bytearray([bcd(year), bcd(month), bcd(day), bcd(hour), bcd(minute), bcd(second), bcd(quarters)])
+
+def pdu_submit(number, text):
+    return bytearray([0x11, 0x05])+pdu_address(number)+bytearray([0, 4, 0xa7, len(text)])+bytearray(text)
+
+def pdu_deliver(number, text, scts):
+    return bytearray([0x04])+pdu_address(number)+bytearray([0, 4])+scts+bytearray([len(text)])+bytearray(text)
+
+MESSAGES = ["Hello, see you at the station tomorrow morning",
+            "Call me back when you get this message please",
+            "The meeting has been moved to Thursday afternoon",
+            "Don't forget to bring the keys, I left mine at home"]
+
+def build_image():
+    """
+    Random bytes (high entropy), pages of constant fill, then SMS-SUBMIT
+    and SMS-DELIVER separated by random bytes
+
+    Return
+    ------
+    (image, list of (offset, status, number, message) of the planted SMS)
+    """
+    rnd = random.Random(IMAGE_SEED)
+    img = bytearray(rnd.getrandbits(8) for i in range(0, IMAGE_SIZE))
+    for page in range(16*4096, 32*4096, 4096):
+        img[page:page+4096] = ("\xff" if (page/4096) % 2 else "\x00")*4096
+    planted = []
+    pos = 40*4096
+    for k in range(0, 40):
+        number = "+3361234{:04d}".format(k)
+        text = MESSAGES[k % len(MESSAGES)]
+        if( k % 3 == 0 ):
+            pdu = pdu_submit(number, text)
+            planted.append((pos, "Sent", number, text))
+        else:
+            pdu = pdu_deliver(number, text, pdu_scts(18, 1+k % 12, 1+k % 28, k % 24, 30, 15, 8))
+            planted.append((pos, "Received", number, text))
+        img[pos:pos+len(pdu)] = pdu
+        pos += len(pdu)+rnd.randint(8, 64)
+    return img, planted
+
+@pytest.fixture(scope="session")
+def planted_image(tmpdir_factory):
+    """
+    (raw image file, gzip image file, planted SMS)
+    """
+    img, planted = build_image()
+    folder = tmpdir_factory.mktemp("images")
+    raw = str(folder.join("image.bin"))
+    with open(raw, "wb") as f:
+        f.write(img)
+    gz = gzip.open(raw+".gz", "wb")
+    gz.write(str(img))
+    gz.close()
+    return raw, raw+".gz", planted
+
+@pytest.fixture(autouse=True)
+def session(tmpdir, monkeypatch):
+    """
+    Options and results of the interactive session, restored after each
+    test. Files written by the scans go in the test folder
+    """
+    options = dict(smsparser.scan_options)
+    smsparser.scan_options["checkpoint-file"] = str(tmpdir.join("scan.ckpt"))
+    smsparser.scan_options["store-file"] = str(tmpdir.join("results.db"))
+    for name, value in [("scan_result", []), ("filter_result", []), ("selected_parsers", []),\
+        ("selected_filters", []), ("scan_regions", []), ("text_index", None), ("scan_job", None), ("watch_list", None)]:
+        monkeypatch.setattr(smsparser, name, value)
+    yield smsparser
+    smsparser.scan_options.clear()
+    smsparser.scan_options.update(options)
+
+def scan(filename, parsers):
+    """
+    Loads an image and runs parsers on it, like the CLI
+
+    Return
+    ------
+    The list of SMS found
+    """
+    smsparser.load(filename)
+    smsparser.parser_run([str(num) for num in parsers])
+    return list(smsparser.scan_result)
+
+def hit_keys(sms_list):
+    return [(sms.offset(), sms.status(), sms.number(), sms.message(), sms.date_utc()) for sms in sms_list]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+import smsparser
+from conftest import scan
+
+def test_batch_filters_match_scalar_filters(planted_image, tmpdir, monkeypatch):
+    raw, gz, planted = planted_image
+    watchlist = tmpdir.join("watchlist.txt")
+    watchlist.write("\n".join([number for offset, status, number, text in planted[::2]]+["+33612349999"]))
+    smsparser.watchlist_load(str(watchlist))
+    hits = scan(raw, [0, 1, 2])
+    filters = [f for f in smsparser.global_filter_refs if f.batch()]
+    assert "Watch-list" in [f.name for f in filters]
+    batch = [f.keep(hits) for f in filters]
+    assert all([any(keep) and not all(keep) for keep in batch])
+    monkeypatch.setattr(smsparser, "numpy", None)
+    for f, keep in zip(filters, batch):
+        assert not f.batch()
+        assert f.keep(hits) == keep, f.name
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import hashlib
+
+import pytest
+
+import smsparser
+from conftest import scan
+
+# Address fields cut by the end of the image: 4 digits announced, the
+# type of number and only one octet of digits present
+TRUNCATED_ADDRESSES = [("submit", 0, "\x01\x00\x04\x91\x21"),
+                       ("deliver", 1, "\x04\x04\x91\x21")]
+
+@pytest.mark.parametrize("name,parser,tail", TRUNCATED_ADDRESSES)
+def test_truncated_address_at_end_of_image(name, parser, tail):
+    img = bytearray("\x00"*64+tail)
+    hits = smsparser.global_parser_refs[parser].parse(img, 0, len(img), progress=False)
+    assert [sms for sms in hits if sms.offset() == 64] == []
+
+@pytest.mark.parametrize("name,parser,tail", TRUNCATED_ADDRESSES)
+def test_truncated_address_at_end_of_file(tmpdir, name, parser, tail):
+    filename = str(tmpdir.join("truncated.bin"))
+    with open(filename, "wb") as f:
+        f.write("\x55"*4096+tail)
+    assert [sms for sms in scan(filename, [parser]) if sms.offset() == 4096] == []
+
+# Digests of the hits of the first version of the parsers on the planted
+# image, with the fill and entropy skipping off: md5 of the sorted
+# (offset, status, source, dest, message) of the hits of each status
+BASELINE = {"Sent": (635, "d09a24ab41e7bb72ef87e7df629c3be4"),
+            "Received": (33455, "9f0925617178c8afa2169378cfe9fa85")}
+
+def test_hits_match_baseline(planted_image):
+    raw, gz, planted = planted_image
+    smsparser.scan_options["skip-fill"] = False
+    smsparser.scan_options["entropy-mode"] = "off"
+    keys = {}
+    for sms in scan(raw, [0, 1]):
+        key = (sms.offset(), sms.status(), sms.source(), sms.dest(), sms.message())
+        keys.setdefault(sms.status(), []).append(repr(key))
+    digests = dict([(status, (len(k), hashlib.md5("\n".join(sorted(k)).encode("utf-8")).hexdigest()))\
+        for status, k in keys.items()])
+    assert digests == BASELINE
+
+def test_planted_sms_found(planted_image):
+    raw, gz, planted = planted_image
+    hits = set([(sms.offset(), sms.status(), sms.number(), sms.message()) for sms in scan(raw, [0, 1])])
+    assert set(planted) <= hits
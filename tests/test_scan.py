@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import os
+import gzip
+import random
+
+import pytest
+
+import smsparser
+from conftest import scan, hit_keys, pdu_submit
+
+def test_sms_in_high_entropy_block_found_by_default(tmpdir):
+    rnd = random.Random(28)
+    img = bytearray(rnd.getrandbits(8) for i in range(0, 4*smsparser.ENTROPY_BLOCK))
+    pdu = pdu_submit("+33612340000", "Hello, see you at the station tomorrow morning")
+    pos = smsparser.ENTROPY_BLOCK+100
+    img[pos:pos+len(pdu)] = pdu
+    filename = str(tmpdir.join("random.bin"))
+    with open(filename, "wb") as f:
+        f.write(img)
+    assert max(smsparser.block_entropies(img, smsparser.ENTROPY_BLOCK, 2*smsparser.ENTROPY_BLOCK))\
+        > smsparser.scan_options["entropy-threshold"]
+    assert pos in [sms.offset() for sms in scan(filename, [0])]
+    # Skipping high-entropy blocks is opt-in
+    smsparser.scan_options["entropy-mode"] = "skip"
+    assert pos not in [sms.offset() for sms in scan(filename, [0])]
+
+def test_fill_report_does_not_depend_on_windows(tmpdir, monkeypatch):
+    # Fill runs of any length, some of them across the windows of the
+    # compressed image
+    rnd = random.Random(27)
+    img = bytearray(rnd.getrandbits(8) for i in range(0, 1024*1024))
+    pos = 0
+    while( pos < len(img) ):
+        pos += rnd.randint(1000, 40000)
+        length = rnd.choice([rnd.randint(4096, 30000), rnd.randint(1, 5)*4096])
+        img[pos:pos+length] = "\xff"*len(img[pos:pos+length])
+        pos += length
+    filename = str(tmpdir.join("fill.bin"))
+    with open(filename, "wb") as f:
+        f.write(img)
+    gz = gzip.open(filename+".gz", "wb")
+    gz.write(str(img))
+    gz.close()
+    monkeypatch.setattr(smsparser, "SCAN_WINDOW", 64*1024)
+    raw = sorted(hit_keys(scan(filename, [0, 1])))
+    raw_fill = dict(smsparser.fill_report)
+    compressed = sorted(hit_keys(scan(filename+".gz", [0, 1])))
+    assert raw_fill and smsparser.fill_report == raw_fill
+    assert compressed == raw
+
+def test_triage_of_compressed_image(planted_image, monkeypatch):
+    raw, gz, planted = planted_image
+    monkeypatch.setattr(smsparser, "TRIAGE_BLOCK", 4096)
+    img = bytearray(open(raw, "rb").read())
+    compressed = smsparser.CompressedImage(gz, "gzip")
+    assert compressed.uncompressed_size() == len(img)
+    blocks = [(0, 100), (4000, 200), (len(img)-50, 100), (len(img)+10, 10)]
+    assert list(compressed.read_blocks(blocks)) == [str(img[offset:offset+length]) for offset, length in blocks]
+    parsers = [smsparser.global_parser_refs[0], smsparser.global_parser_refs[1]]
+    estimates = []
+    for image in [img, compressed]:
+        triage = smsparser.Triage(image, seed=46)
+        assert triage.size == len(img)
+        # Long enough to sample all the blocks
+        triage.run(image, parsers, [], 600)
+        estimates.append([(stratum.start, stratum.end, stratum.counts) for stratum in triage.strata])
+    assert estimates[0] == estimates[1]
+    assert sum([sum(counts) for start, end, counts in estimates[0]]) >= len(planted)
+
+def test_raw_gzip_and_parallel_scans_agree(planted_image):
+    raw, gz, planted = planted_image
+    hits = sorted(hit_keys(scan(raw, [0, 1])))
+    assert sorted(hit_keys(scan(gz, [0, 1]))) == hits
+    if( os.name != "posix" ):
+        return
+    # Loading an image clears the regions
+    smsparser.load(raw)
+    smsparser.scan_regions = [(0, 100*1024), (100*1024, 256*1024)]
+    smsparser.parser_run(["0", "1"])
+    sequential = sorted(hit_keys(smsparser.scan_result))
+    smsparser.scan_options["scan-workers"] = 2
+    smsparser.parser_run(["0", "1"])
+    assert sorted(hit_keys(smsparser.scan_result)) == sequential
+    assert sequential == hits
+
+@pytest.mark.parametrize("store", ["memory", "disk"])
+def test_resumed_scan_equals_uninterrupted_scan(planted_image, monkeypatch, store):
+    raw, gz, planted = planted_image
+    monkeypatch.setattr(smsparser, "SCAN_WINDOW", 32*1024)
+    smsparser.scan_options["result-store"] = store
+    smsparser.scan_options["checkpoint-interval"] = 0
+    hits = sorted(hit_keys(scan(raw, [0, 1])))
+    fill = dict(smsparser.fill_report)
+    # Interrupted twice, as with ctrl-c, then resumed until the end
+    smsparser.scan_options["checkpoint-interval"] = 1e-9
+    parse = smsparser.Parser.parse
+    calls = [0]
+    def interrupted(self, *args, **kwargs):
+        calls[0] += 1
+        res = parse(self, *args, **kwargs)
+        if( calls[0] in [3, 9] ):
+            raise KeyboardInterrupt
+        return res
+    monkeypatch.setattr(smsparser.Parser, "parse", interrupted)
+    scan(raw, [0, 1])
+    checkpoint = smsparser.scan_options["checkpoint-file"]
+    resumed = 0
+    while( os.path.exists(checkpoint) and resumed < 10 ):
+        smsparser.scan_resume()
+        resumed += 1
+    assert resumed == 2 and not os.path.exists(checkpoint)
+    assert sorted(hit_keys(smsparser.scan_result)) == hits
+    assert smsparser.fill_report == fill